@@ -0,0 +1,118 @@
+import asyncio
+
+from products import Product
+from store import Store
+
+
+class AsyncStore:
+    """
+    Asyncio facade over a Store.
+
+    Orders are put on a queue. A worker task takes the orders that arrive
+    within `batch_window` seconds of each other, up to `max_batch_size`,
+    and applies them in one pass with Store.order_many, in a thread, so the
+    event loop goes on while the order hooks of the batch, like a journal
+    sync, run.
+
+    Attributes:
+        _store (Store): The store the orders are applied to.
+    """
+    def __init__(self, store: Store, batch_window: float = 0.001,
+                 max_batch_size: int = 1000):
+        if batch_window < 0:
+            raise ValueError("batch window cannot be negative")
+        if max_batch_size < 1:
+            raise ValueError("max batch size must be at least 1")
+
+        self._store = store
+        self._batch_window = batch_window
+        self._max_batch_size = max_batch_size
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def order(self, shopping_list: list[tuple[Product, int]]) -> float:
+        """Buys the products and returns the total price of the order.
+        Raises ValueError if the order was rejected, or the error that
+        stopped it from being made. An error of the order hooks, after the
+        orders of the batch were made, is raised by every order of the
+        batch."""
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._process_orders())
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((shopping_list, future))
+        return await future
+
+    async def get_all_products(self) -> tuple[Product, ...]:
+        """Returns all products in the store that are active"""
+        return self._store.get_all_products()
+
+    async def get_total_quantity(self) -> int:
+        """Returns how many items are in the store in total."""
+        return self._store.get_total_quantity()
+
+    async def close(self):
+        """Waits for the queued orders to be applied and stops the worker"""
+        if self._worker is None:
+            return
+        await self._queue.join()
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        self._queue = None
+
+    async def _next_batch(self) -> list:
+        """Waits for an order, then collects the orders that arrive within
+        the batch window"""
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self._batch_window
+
+        while len(batch) < self._max_batch_size:
+            # orders already queued never wait for the window
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(),
+                                                    timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _process_orders(self):
+        """Worker task applying the queued orders in batches"""
+        while True:
+            batch = await self._next_batch()
+            try:
+                # every order gets its own error, so an order that was made
+                # is never reported as failed because of another one
+                results = await asyncio.to_thread(
+                    self._store.order_many,
+                    [shopping_list for shopping_list, _ in batch],
+                    errors=Exception)
+            except Exception as e:
+                # only the order hooks get here. The orders were made, but
+                # the worker goes on, so later orders still run
+                results = [e] * len(batch)
+
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+                self._queue.task_done()
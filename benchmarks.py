@@ -0,0 +1,433 @@
+"""
+Benchmarks for the store hot paths.
+
+Run a benchmark by name, for example:
+    python benchmarks.py concurrency --threads 1 2 4 8
+
+The 'suite' benchmark sweeps catalog sizes, saves the results as json and
+flags regressions against a saved baseline:
+    python benchmarks.py suite --output baseline.json
+    python benchmarks.py suite --baseline baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+import catalog
+import products
+import promotions
+import sharded_store
+import store
+
+
+def iter_catalog(size: int, quantity: int = 1_000_000):
+    """Yields `size` products with plenty of stock"""
+    for index in range(size):
+        yield products.Product(f"Product {index}", price=10 + index % 500,
+                               quantity=quantity)
+
+
+def make_catalog(size: int,
+                 quantity: int = 1_000_000) -> list[products.Product]:
+    """Returns a list of `size` products with plenty of stock"""
+    return list(iter_catalog(size, quantity))
+
+
+def measure_memory(build) -> tuple[object, int]:
+    """Calls `build` and returns its result with the bytes it allocated"""
+    tracemalloc.start()
+    try:
+        result = build()
+        allocated, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, allocated
+
+
+def bench_concurrency(thread_counts: list[int], orders_per_thread: int,
+                      catalog_size: int, cart_size: int):
+    """Orders random carts from many threads at once and prints the
+    throughput for every thread count. Checks that no stock was oversold."""
+    print(f"{'threads':>8} {'orders/s':>12}")
+    for thread_count in thread_counts:
+        catalog_products = make_catalog(catalog_size)
+        best_buy = store.Store(catalog_products)
+        start_quantity = best_buy.get_total_quantity()
+        ordered_units = [0] * thread_count
+
+        def worker(worker_index: int):
+            rng = random.Random(worker_index)
+            for _ in range(orders_per_thread):
+                cart = [(product, 1)
+                        for product in rng.sample(catalog_products, cart_size)]
+                best_buy.order(cart)
+                ordered_units[worker_index] += cart_size
+
+        threads = [threading.Thread(target=worker, args=(index,))
+                   for index in range(thread_count)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        left_quantity = sum(product.quantity
+                            for product in catalog_products)
+        if start_quantity - left_quantity != sum(ordered_units):
+            raise RuntimeError("stock is out of sync with the orders made")
+        total_orders = thread_count * orders_per_thread
+        print(f"{thread_count:>8} {total_orders / elapsed:>12.0f}")
+
+
+def bench_memory(sizes: list[int]):
+    """Prints the memory used by a catalog of objects, one Product per row,
+    and by the columnar Catalog"""
+    print(f"{'products':>10} {'objects MB':>12} {'columnar MB':>12}")
+    for size in sizes:
+        objects, objects_bytes = measure_memory(lambda: make_catalog(size))
+        del objects
+        columns, columns_bytes = measure_memory(
+            lambda: catalog.Catalog.from_products(iter_catalog(size)))
+        del columns
+        print(f"{size:>10} {objects_bytes / 2**20:>12.1f} "
+              f"{columns_bytes / 2**20:>12.1f}")
+
+
+def bench_products(size: int):
+    """Prints the memory per Product object and the throughput of buy and
+    show over a catalog of `size` products"""
+    catalog_products, allocated = measure_memory(lambda: make_catalog(size))
+    print(f"{size} products: {allocated / 2**20:.1f} MB, "
+          f"{allocated / size:.0f} bytes per product")
+
+    start = time.perf_counter()
+    for product in catalog_products:
+        product.buy(1)
+    elapsed = time.perf_counter() - start
+    print(f"buy:  {size / elapsed:>12.0f} calls/s")
+
+    start = time.perf_counter()
+    for product in catalog_products:
+        product.show()
+    elapsed = time.perf_counter() - start
+    print(f"show: {size / elapsed:>12.0f} calls/s")
+
+
+def bench_promotions(lines: int):
+    """Prints the time to price one line with a single promotion and with
+    composite promotions made of it"""
+    third_one_free = promotions.ThirdOneFree("Third One Free!")
+    thirty_percent = promotions.PercentDiscount("30% off!", percent=30)
+    benchmarked = {
+        "ThirdOneFree": third_one_free,
+        "Chained(2)": promotions.ChainedPromotion(
+            "Stacked", [third_one_free, thirty_percent]),
+        "BestOf(2)": promotions.BestOfPromotion(
+            "Best deal", [third_one_free, thirty_percent]),
+        "Capped": promotions.CappedPromotion("Capped", third_one_free, 10),
+    }
+    rng = random.Random(0)
+    quantities = [rng.randint(1, 20) for _ in range(lines)]
+    prices = [rng.uniform(1, 2000) for _ in range(lines)]
+
+    print(f"{'promotion':>14} {'ns/line':>10}")
+    for name, promotion in benchmarked.items():
+        apply_promotion = promotion.apply_promotion
+        start = time.perf_counter()
+        for quantity, price in zip(quantities, prices):
+            apply_promotion(quantity, price)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>14} {elapsed / lines * 1e9:>10.0f}")
+
+
+def bench_sharded(shard_counts: list[int], catalog_size: int,
+                  cart_count: int, cart_size: int):
+    """Prints the order throughput of a ShardedStore for every shard
+    count. Carts are made of products of one shard, so every shard works
+    on its own batch at the same time."""
+    catalog_products = make_mixed_catalog(catalog_size)
+    print(f"{'shards':>8} {'orders/s':>12}")
+    for shard_count in shard_counts:
+        with sharded_store.ShardedStore(catalog_products,
+                                        shard_count) as best_buy:
+            shard_products = [[] for _ in range(shard_count)]
+            for product in catalog_products:
+                shard_products[best_buy.shard_of(product.name)].append(
+                    product)
+            carts = [cart for index in range(shard_count)
+                     for cart in make_carts(shard_products[index],
+                                            cart_count // shard_count,
+                                            cart_size, seed=index)]
+            orders_per_second = measure_throughput(
+                lambda: best_buy.order_many(carts), len(carts))
+        print(f"{shard_count:>8} {orders_per_second:>12.0f}")
+
+
+# run in a new interpreter by bench_startup: the first order of a fresh
+# process, the way the cli and short-lived workers make it
+STARTUP_SCRIPT = """
+import main
+best_buy = main.create_default_store()
+best_buy.order([(best_buy.get_all_products()[0], 1)])
+"""
+
+
+def run_python(arguments: list[str]) -> subprocess.CompletedProcess:
+    """Runs a new interpreter in the directory of the benchmarks"""
+    return subprocess.run([sys.executable, *arguments], capture_output=True,
+                          text=True, check=True,
+                          cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+def bench_startup(runs: int, top: int):
+    """Prints the median time of a bare interpreter and of a process making
+    its first Store.order, and the slowest imports of that process as
+    reported by python -X importtime"""
+    timings = {"interpreter": ["-c", "pass"],
+               "first order": ["-c", STARTUP_SCRIPT]}
+    print(f"{'':>12} {'median ms':>10}")
+    for label, arguments in timings.items():
+        elapsed = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            run_python(arguments)
+            elapsed.append(time.perf_counter() - start)
+        print(f"{label:>12} {statistics.median(elapsed) * 1e3:>10.1f}")
+
+    # lines look like "import time:   self [us] | cumulative | module"
+    imports = []
+    for line in run_python(["-X", "importtime", "-c",
+                            STARTUP_SCRIPT]).stderr.splitlines():
+        fields = line.removeprefix("import time:").split("|")
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            imports.append((int(fields[1]), fields[2].rstrip()))
+    print(f"\n{'cumulative us':>13}  module")
+    for cumulative, module in sorted(imports, reverse=True)[:top]:
+        print(f"{cumulative:>13}  {module}")
+
+
+def make_promotions() -> list[promotions.Promotion]:
+    """Returns one promotion of every simple promotion class"""
+    return [promotions.SecondHalfPrice("Second Half price!"),
+            promotions.ThirdOneFree("Third One Free!"),
+            promotions.PercentDiscount("30% off!", percent=30)]
+
+
+def make_mixed_catalog(size: int, seed: int = 0,
+                       quantity: int = 1_000_000) -> list[products.Product]:
+    """Returns `size` products of every product class, half of them with a
+    promotion. The same seed always gives the same catalog."""
+    rng = random.Random(seed)
+    catalog_promotions = make_promotions()
+    catalog_products = []
+    for index in range(size):
+        name = f"Product {index}"
+        price = round(rng.uniform(1, 2000), 2)
+        if index % 10 == 0:
+            product = products.NonStockedProduct(name, price)
+        elif index % 10 == 1:
+            product = products.LimitedProduct(name, price, quantity,
+                                              maximum=1)
+        else:
+            product = products.Product(name, price, quantity)
+        if rng.random() < 0.5:
+            product.promotion = rng.choice(catalog_promotions)
+        catalog_products.append(product)
+    return catalog_products
+
+
+def make_carts(catalog_products: list[products.Product], count: int,
+               cart_size: int, seed: int = 0) \
+        -> list[list[tuple[products.Product, int]]]:
+    """Returns `count` carts of `cart_size` different products each, one
+    item per product so every product class accepts them"""
+    rng = random.Random(seed)
+    cart_size = min(cart_size, len(catalog_products))
+    return [[(product, 1) for product in rng.sample(catalog_products,
+                                                     cart_size)]
+            for _ in range(count)]
+
+
+def measure_throughput(run, operations: int, repeat: int = 3) -> float:
+    """Calls `run`, which makes `operations` operations, `repeat` times and
+    returns the best operations per second"""
+    best_elapsed = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best_elapsed = min(best_elapsed, time.perf_counter() - start)
+    return operations / best_elapsed if best_elapsed else float("inf")
+
+
+def run_suite(sizes: list[int], cart_count: int, cart_size: int,
+              calls: int) -> dict:
+    """Measures the throughput of the hot paths and the memory of the
+    catalog for every size. Returns the results by size and metric."""
+    results = {}
+    for size in sizes:
+        print(f"catalog of {size} products...", file=sys.stderr)
+        catalog_products, allocated = measure_memory(
+            lambda: make_mixed_catalog(size))
+        best_buy = store.Store(catalog_products)
+        carts = make_carts(catalog_products, cart_count, cart_size)
+        shown_products = catalog_products[:calls]
+        size_results = {
+            "memory_bytes_per_product": allocated / size,
+            "store.order": measure_throughput(
+                lambda: best_buy.order_many(carts), len(carts)),
+            "store.get_all_products": measure_throughput(
+                lambda: [best_buy.get_all_products() for _ in range(calls)],
+                calls),
+            "store.get_total_quantity": measure_throughput(
+                lambda: [best_buy.get_total_quantity()
+                         for _ in range(calls)], calls),
+            "product.show": measure_throughput(
+                lambda: [product.show() for product in shown_products],
+                len(shown_products)),
+        }
+        for promotion in make_promotions():
+            size_results[f"{type(promotion).__name__}.apply_promotion"] = \
+                measure_throughput(
+                    lambda: [promotion.apply_promotion(quantity % 20, 9.99)
+                             for quantity in range(calls)], calls)
+        results[str(size)] = size_results
+    return results
+
+
+def find_regressions(results: dict, baseline: dict,
+                     tolerance: float) -> list[str]:
+    """Returns a description of every metric that is worse than in the
+    baseline by more than `tolerance` (0.1 is 10%)"""
+    regressions = []
+    for size, size_results in results.items():
+        for metric, value in size_results.items():
+            baseline_value = baseline.get(size, {}).get(metric)
+            if not baseline_value:
+                continue
+            # memory is better when lower, throughput when higher
+            if metric.startswith("memory"):
+                change = value / baseline_value - 1
+            else:
+                change = baseline_value / value - 1
+            if change > tolerance:
+                regressions.append(f"{metric} at {size} products: "
+                                   f"{baseline_value:.0f} -> {value:.0f}")
+    return regressions
+
+
+def bench_suite(sizes: list[int], cart_count: int, cart_size: int,
+                calls: int, output: str | None, baseline_path: str | None,
+                tolerance: float) -> bool:
+    """Runs the suite, prints and saves the results and compares them with
+    the baseline. Returns False if a regression was found."""
+    results = run_suite(sizes, cart_count, cart_size, calls)
+    for size, size_results in results.items():
+        print(f"-- {size} products")
+        for metric, value in size_results.items():
+            unit = "bytes" if metric.startswith("memory") else "ops/s"
+            print(f"{metric:>40} {value:>14.0f} {unit}")
+
+    if output:
+        with open(output, "w", encoding="utf-8") as file:
+            json.dump({"python": platform.python_version(),
+                       "results": results}, file, indent=2)
+
+    if baseline_path:
+        with open(baseline_path, encoding="utf-8") as file:
+            baseline = json.load(file)["results"]
+        regressions = find_regressions(results, baseline, tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return not regressions
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    concurrency = subparsers.add_parser(
+        "concurrency", help="order throughput as the thread count grows")
+    concurrency.add_argument("--threads", type=int, nargs="+",
+                             default=[1, 2, 4, 8])
+    concurrency.add_argument("--orders", type=int, default=10_000,
+                             help="orders per thread")
+    concurrency.add_argument("--catalog-size", type=int, default=1_000)
+    concurrency.add_argument("--cart-size", type=int, default=3)
+
+    memory = subparsers.add_parser(
+        "memory", help="memory of object-per-product vs columnar catalog")
+    memory.add_argument("--sizes", type=int, nargs="+",
+                        default=[1_000, 100_000, 1_000_000])
+
+    products_parser = subparsers.add_parser(
+        "products", help="memory per product and buy/show throughput")
+    products_parser.add_argument("--size", type=int, default=1_000_000)
+
+    promotions_parser = subparsers.add_parser(
+        "promotions", help="per-line pricing cost of composite promotions")
+    promotions_parser.add_argument("--lines", type=int, default=1_000_000)
+
+    suite = subparsers.add_parser(
+        "suite", help="sweep catalog sizes, save json, compare a baseline")
+    suite.add_argument("--sizes", type=int, nargs="+",
+                       default=[10, 100, 1_000, 10_000, 100_000],
+                       help="catalog sizes, up to 10_000_000")
+    suite.add_argument("--carts", type=int, default=2_000)
+    suite.add_argument("--cart-size", type=int, default=3)
+    suite.add_argument("--calls", type=int, default=100_000,
+                       help="calls per measurement of the cheap operations")
+    suite.add_argument("--output", help="file to save the json results to")
+    suite.add_argument("--baseline", help="json results to compare with")
+    suite.add_argument("--tolerance", type=float, default=0.2,
+                       help="allowed slowdown before flagging, 0.2 is 20%%")
+
+    sharded = subparsers.add_parser(
+        "sharded", help="order throughput as the shard count grows")
+    sharded.add_argument("--shards", type=int, nargs="+",
+                         default=[1, 2, 4])
+    sharded.add_argument("--catalog-size", type=int, default=10_000)
+    sharded.add_argument("--carts", type=int, default=40_000)
+    sharded.add_argument("--cart-size", type=int, default=3)
+
+    startup = subparsers.add_parser(
+        "startup", help="time of a new process to its first order")
+    startup.add_argument("--runs", type=int, default=20)
+    startup.add_argument("--top", type=int, default=15,
+                         help="how many of the slowest imports to show")
+
+    args = parser.parse_args()
+    if args.benchmark == "concurrency":
+        bench_concurrency(args.threads, args.orders, args.catalog_size,
+                          args.cart_size)
+    elif args.benchmark == "memory":
+        bench_memory(args.sizes)
+    elif args.benchmark == "products":
+        bench_products(args.size)
+    elif args.benchmark == "promotions":
+        bench_promotions(args.lines)
+    elif args.benchmark == "sharded":
+        bench_sharded(args.shards, args.catalog_size, args.carts,
+                      args.cart_size)
+    elif args.benchmark == "startup":
+        bench_startup(args.runs, args.top)
+    elif args.benchmark == "suite":
+        if not bench_suite(args.sizes, args.carts, args.cart_size,
+                           args.calls, args.output, args.baseline,
+                           args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,343 @@
+import json
+import mmap
+import struct
+from array import array
+from collections.abc import Iterable, Iterator
+
+import products
+import promotions
+
+# codes of the product classes in the kinds column
+KIND_PRODUCT = 0
+KIND_NON_STOCKED = 1
+KIND_LIMITED = 2
+
+_KIND_BY_CLASS = {
+    products.Product: KIND_PRODUCT,
+    products.NonStockedProduct: KIND_NON_STOCKED,
+    products.LimitedProduct: KIND_LIMITED,
+}
+
+# magic, number of rows, size of the names blob, size of the promotions json
+_SNAPSHOT_MAGIC = b"BBCAT\x00\x00\x02"
+# snapshots without the integer prices bitmap, all their prices are floats
+_SNAPSHOT_MAGIC_V1 = b"BBCAT\x00\x00\x01"
+_SNAPSHOT_HEADER = struct.Struct("<8sQQQ")
+
+
+def promotion_to_config(promotion: promotions.Promotion) -> dict:
+    """Returns a json-serializable description of the promotion"""
+    promotion_type = type(promotion).__name__
+    try:
+        registered = promotions.get_promotion_class(promotion_type) \
+            is type(promotion)
+    except ValueError:
+        registered = False
+    if not registered:
+        raise ValueError(f"Unsupported promotion class {promotion_type}")
+    return promotion.to_config()
+
+
+def promotion_from_config(config: dict) -> promotions.Promotion:
+    """Returns the promotion described by promotion_to_config. Equal
+    configs give the same, shared promotion."""
+    return promotions.create_promotion(config)
+
+
+def product_to_config(product: products.Product) -> dict:
+    """Returns a json-serializable description of the product"""
+    if type(product) not in _KIND_BY_CLASS:
+        raise ValueError(f"Unsupported product class "
+                         f"{type(product).__name__}")
+    config = {"type": type(product).__name__, "name": product.name,
+              "price": product.price, "quantity": product.quantity,
+              "active": product.is_active(), "promotion": None}
+    if isinstance(product, products.LimitedProduct):
+        config["maximum"] = product.maximum
+    if product.promotion:
+        config["promotion"] = promotion_to_config(product.promotion)
+    return config
+
+
+def product_from_config(config: dict) -> products.Product:
+    """Builds a product from the description made by product_to_config"""
+    if config["type"] == products.NonStockedProduct.__name__:
+        product = products.NonStockedProduct(config["name"], config["price"])
+    elif config["type"] == products.LimitedProduct.__name__:
+        product = products.LimitedProduct(config["name"], config["price"],
+                                          config["quantity"],
+                                          config["maximum"])
+    elif config["type"] == products.Product.__name__:
+        product = products.Product(config["name"], config["price"],
+                                   config["quantity"])
+    else:
+        raise ValueError(f"Unsupported product class {config['type']}")
+
+    if config["promotion"]:
+        product.promotion = promotion_from_config(config["promotion"])
+    if not config["active"]:
+        product.deactivate()
+    return product
+
+
+class _NameColumn:
+    """Read-only column of names stored as one utf-8 blob and the offsets
+    where every name ends"""
+    def __init__(self, blob: memoryview, offsets: memoryview):
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("catalog index out of range")
+        start, end = self._offsets[index], self._offsets[index + 1]
+        return str(self._blob[start:end], "utf-8")
+
+
+class Catalog:
+    """
+    Columnar storage for very large catalogs.
+
+    Every product is a row spread over typed arrays instead of a Python
+    object: prices are a float array, quantities and maximums are int
+    arrays, the product class is a byte code, active flags are a bitmap and
+    promotions are small integer codes into a table of promotion objects.
+    A second bitmap marks the prices that were ints, so they are given back
+    as ints.
+    Rows are turned back into Product objects only when they are needed.
+
+    Attributes:
+        _promotions (list): Promotion for every promotion code. Code 0 is
+            reserved for "no promotion".
+    """
+    def __init__(self):
+        self._names: list[str] = []
+        self._prices = array("d")
+        self._quantities = array("q")
+        self._maximums = array("q")
+        self._kinds = array("B")
+        self._promotion_codes = array("H")
+        self._active = bytearray()
+        self._integer_prices = bytearray()
+        self._promotions: list[promotions.Promotion | None] = [None]
+        self._promotion_codes_by_promotion: dict[promotions.Promotion,
+                                                 int] = {}
+        # products built by product(), by row index
+        self._built_products: dict[int, products.Product] = {}
+        # catalogs loaded from a snapshot are views onto the mapped file
+        self._read_only = False
+
+    @classmethod
+    def from_products(cls, catalog_products: Iterable[products.Product]) \
+            -> "Catalog":
+        """Returns a catalog holding a row for every product"""
+        catalog = cls()
+        for product in catalog_products:
+            catalog.append(product)
+        return catalog
+
+    @classmethod
+    def from_states(cls, states: Iterable[tuple]) -> "Catalog":
+        """Returns a catalog holding a row for every product state, a
+        (product, price, quantity, active, promotion) tuple like the ones
+        of a StoreSnapshot. The product gives the class, name and maximum
+        of the row."""
+        catalog = cls()
+        for product, price, quantity, active, promotion in states:
+            catalog._append_row(product, price, quantity, active, promotion)
+        return catalog
+
+    def __len__(self):
+        return len(self._names)
+
+    def _promotion_code(self, promotion: promotions.Promotion | None) -> int:
+        """Returns the code of the promotion, adding it to the table if it
+        is new"""
+        if promotion is None:
+            return 0
+        code = self._promotion_codes_by_promotion.get(promotion)
+        if code is None:
+            code = len(self._promotions)
+            self._promotions.append(promotion)
+            self._promotion_codes_by_promotion[promotion] = code
+        return code
+
+    def append(self, product: products.Product):
+        """Adds a row with the state of the product"""
+        self._append_row(product, product.price, product.quantity,
+                         product.is_active(), product.promotion)
+
+    def _append_row(self, product: products.Product, price: float,
+                    quantity: int, active: bool,
+                    promotion: promotions.Promotion | None):
+        """Adds a row for the product with the given state"""
+        if self._read_only:
+            raise ValueError("catalog loaded from a snapshot is read-only")
+        kind = _KIND_BY_CLASS.get(type(product))
+        if kind is None:
+            raise ValueError(f"Unsupported product class "
+                             f"{type(product).__name__}")
+
+        index = len(self._names)
+        self._names.append(product.name)
+        self._prices.append(price)
+        self._quantities.append(quantity)
+        self._maximums.append(product.maximum if kind == KIND_LIMITED else 0)
+        self._kinds.append(kind)
+        self._promotion_codes.append(self._promotion_code(promotion))
+        if index % 8 == 0:
+            self._active.append(0)
+            self._integer_prices.append(0)
+        if isinstance(price, int):
+            self._integer_prices[index >> 3] |= 1 << (index & 7)
+        self.set_active(index, active)
+
+    def name(self, index: int) -> str:
+        """Returns the name of the product in the row"""
+        return self._names[index]
+
+    def price(self, index: int) -> float:
+        """Returns the price of the product in the row, an int if it was
+        one"""
+        price = self._prices[index]
+        if index < 0:
+            index += len(self._names)
+        if self._integer_prices[index >> 3] & (1 << (index & 7)):
+            return int(price)
+        return price
+
+    def quantity(self, index: int) -> int:
+        """Returns the quantity of the product in the row"""
+        return self._quantities[index]
+
+    def promotion(self, index: int) -> promotions.Promotion | None:
+        """Returns the promotion of the product in the row"""
+        return self._promotions[self._promotion_codes[index]]
+
+    def is_active(self, index: int) -> bool:
+        """Returns True if the product in the row is active"""
+        if not 0 <= index < len(self._names):
+            raise IndexError("catalog index out of range")
+        return bool(self._active[index >> 3] & (1 << (index & 7)))
+
+    def set_active(self, index: int, active: bool):
+        """Sets the active flag of the product in the row"""
+        if self._read_only:
+            raise ValueError("catalog loaded from a snapshot is read-only")
+        if not 0 <= index < len(self._names):
+            raise IndexError("catalog index out of range")
+        if active:
+            self._active[index >> 3] |= 1 << (index & 7)
+        else:
+            self._active[index >> 3] &= ~(1 << (index & 7)) & 0xFF
+
+    def total_quantity(self) -> int:
+        """Returns how many items are in the catalog in total"""
+        return sum(self._quantities)
+
+    def active_count(self) -> int:
+        """Returns how many products in the catalog are active"""
+        return sum(bin(flags).count("1") for flags in self._active)
+
+    def to_product(self, index: int) -> products.Product:
+        """Builds a Product object from the row"""
+        name = self._names[index]
+        price = self.price(index)
+        kind = self._kinds[index]
+        if kind == KIND_NON_STOCKED:
+            product = products.NonStockedProduct(name, price)
+        elif kind == KIND_LIMITED:
+            product = products.LimitedProduct(name, price,
+                                              self._quantities[index],
+                                              self._maximums[index])
+        else:
+            product = products.Product(name, price, self._quantities[index])
+
+        product.promotion = self.promotion(index)
+        if not self.is_active(index):
+            product.deactivate()
+        return product
+
+    def product(self, index: int) -> products.Product:
+        """Returns the Product of the row. It is built on first access and
+        the same object is returned after that. Changes made to the product
+        are not written back to the row."""
+        product = self._built_products.get(index)
+        if product is None:
+            product = self._built_products[index] = self.to_product(index)
+        return product
+
+    def products(self) -> Iterator[products.Product]:
+        """Yields a Product object built from every row"""
+        for index in range(len(self._names)):
+            yield self.to_product(index)
+
+    def save(self, path: str):
+        """Writes the catalog to a binary snapshot file. The columns are
+        written as they are in memory, in native byte order."""
+        names_blob = bytearray()
+        name_offsets = array("Q", [0])
+        for index in range(len(self)):
+            names_blob += self._names[index].encode("utf-8")
+            name_offsets.append(len(names_blob))
+        promotions_json = json.dumps(
+            [promotion_to_config(promotion)
+             for promotion in self._promotions[1:]]).encode("utf-8")
+
+        with open(path, "wb") as file:
+            file.write(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, len(self),
+                                             len(names_blob),
+                                             len(promotions_json)))
+            # 8 byte columns first, so every column stays aligned
+            for column in (self._prices, self._quantities, self._maximums,
+                           name_offsets, self._promotion_codes, self._kinds,
+                           self._active, self._integer_prices, names_blob,
+                           promotions_json):
+                file.write(column)
+
+    @classmethod
+    def load(cls, path: str) -> "Catalog":
+        """Returns a read-only catalog over a snapshot written by save().
+        The file is memory-mapped, so loading does not depend on the
+        number of rows. Raises ValueError if the file is not a snapshot."""
+        with open(path, "rb") as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(mapped)
+        if len(buffer) < _SNAPSHOT_HEADER.size:
+            raise ValueError(f"{path} is not a catalog snapshot")
+        magic, rows, names_size, promotions_size = \
+            _SNAPSHOT_HEADER.unpack_from(buffer)
+        if magic not in (_SNAPSHOT_MAGIC, _SNAPSHOT_MAGIC_V1):
+            raise ValueError(f"{path} is not a catalog snapshot")
+
+        offset = _SNAPSHOT_HEADER.size
+
+        def next_column(size: int, column_format: str = "B") -> memoryview:
+            nonlocal offset
+            column = buffer[offset:offset + size]
+            if len(column) != size:
+                raise ValueError(f"catalog snapshot {path} is truncated")
+            offset += size
+            return column.cast(column_format)
+
+        catalog = cls()
+        catalog._prices = next_column(8 * rows, "d")
+        catalog._quantities = next_column(8 * rows, "q")
+        catalog._maximums = next_column(8 * rows, "q")
+        name_offsets = next_column(8 * (rows + 1), "Q")
+        catalog._promotion_codes = next_column(2 * rows, "H")
+        catalog._kinds = next_column(rows)
+        catalog._active = next_column((rows + 7) // 8)
+        catalog._integer_prices = next_column((rows + 7) // 8) \
+            if magic == _SNAPSHOT_MAGIC else bytes((rows + 7) // 8)
+        catalog._names = _NameColumn(next_column(names_size), name_offsets)
+        catalog._promotions += [
+            promotion_from_config(config)
+            for config in json.loads(bytes(next_column(promotions_size)))]
+        catalog._read_only = True
+        return catalog
@@ -0,0 +1,334 @@
+"""
+Typed events about the inventory of a store.
+
+An EventBus attached to a store compares every change its products report
+with the state it saw before, and publishes what changed as events, so
+replenishment and cache layers don't have to poll the store.
+"""
+import asyncio
+import collections
+import contextlib
+import logging
+import threading
+from typing import NamedTuple
+
+from products import Product
+from promotions import Promotion
+from store import Store
+
+logger = logging.getLogger(__name__)
+
+
+class StockDecremented(NamedTuple):
+    """Items of the product were bought or taken out of stock"""
+    product: Product
+    quantity: int
+    previous_quantity: int
+
+
+class StockIncremented(NamedTuple):
+    """Items of the product were added to its stock"""
+    product: Product
+    quantity: int
+    previous_quantity: int
+
+
+class LowStock(NamedTuple):
+    """The stock of the product went down to its low-stock threshold"""
+    product: Product
+    quantity: int
+    threshold: int
+
+
+class SoldOut(NamedTuple):
+    """The last item of the product was bought, so it was deactivated"""
+    product: Product
+
+
+class Deactivated(NamedTuple):
+    """The product was deactivated, other than by selling its last item"""
+    product: Product
+
+
+class Reactivated(NamedTuple):
+    """The product was activated again"""
+    product: Product
+
+
+class PriceChanged(NamedTuple):
+    """The price of the product changed"""
+    product: Product
+    price: float
+    previous_price: float
+
+
+class PromotionChanged(NamedTuple):
+    """The product got another promotion, or lost its promotion"""
+    product: Product
+    promotion: Promotion | None
+    previous_promotion: Promotion | None
+
+
+class Subscription:
+    """
+    Subscriber called in the thread that made the change, right after the
+    store was updated.
+
+    An error raised by the callback is logged and counted in `errors`:
+    the change was already made, and an order may be half way through its
+    buys, so it must not fail.
+
+    Attributes:
+        _event_types (tuple): Event classes delivered, all when empty.
+        _batch (bool): When True the callback gets a list of events per
+            delivery, otherwise it is called once per event.
+        errors (int): Number of calls of the callback that raised.
+    """
+    def __init__(self, callback, event_types: tuple[type, ...] = (),
+                 batch: bool = False):
+        self._callback = callback
+        self._event_types = event_types
+        self._batch = batch
+        self.errors = 0
+
+    def _select(self, events: list) -> list:
+        """Returns the events this subscriber wants"""
+        if not self._event_types:
+            return events
+        return [event for event in events
+                if isinstance(event, self._event_types)]
+
+    def _deliver(self, events: list):
+        events = self._select(events)
+        if not events:
+            return
+        if self._batch:
+            self._call(events)
+        else:
+            for event in events:
+                self._call(event)
+
+    def _call(self, argument):
+        """Calls the callback, logging and counting its errors"""
+        try:
+            self._callback(argument)
+        except Exception:
+            self.errors += 1
+            logger.exception("Event subscriber %r failed", self._callback)
+
+
+class AsyncSubscription(Subscription):
+    """
+    Subscriber on an asyncio event loop. Events are queued and read with
+    get_batch() or `async for`.
+
+    The queue holds up to `max_pending` events. When it is full the oldest
+    event is dropped and counted in `dropped`, so a slow subscriber never
+    holds up the orders publishing the events.
+    """
+    def __init__(self, event_types: tuple[type, ...] = (),
+                 max_pending: int = 10_000):
+        if max_pending < 1:
+            raise ValueError("max pending must be at least 1")
+        super().__init__(None, event_types)
+        self._loop = asyncio.get_running_loop()
+        self._events: collections.deque = collections.deque()
+        self._max_pending = max_pending
+        self._lock = threading.Lock()
+        self._ready = asyncio.Event()
+        self.dropped = 0
+
+    def _deliver(self, events: list):
+        events = self._select(events)
+        if not events:
+            return
+        with self._lock:
+            self._events.extend(events)
+            overflow = len(self._events) - self._max_pending
+            for _ in range(overflow):
+                self._events.popleft()
+            self.dropped += max(overflow, 0)
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            # the event loop was closed, nobody is reading anymore
+            pass
+
+    async def get_batch(self) -> list:
+        """Waits until there are events, and returns all the queued ones"""
+        while True:
+            with self._lock:
+                if self._events:
+                    events = list(self._events)
+                    self._events.clear()
+                    return events
+                self._ready.clear()
+            await self._ready.wait()
+
+    async def __aiter__(self):
+        while True:
+            for event in await self.get_batch():
+                yield event
+
+
+class EventBus:
+    """
+    Publishes the changes of the products of a store as typed events.
+
+    Events are delivered in the order the changes were made. Inside a
+    batch() block, events are held back and delivered together when the
+    outermost block ends, so batch subscribers get them in one call.
+
+    Attributes:
+        _low_stock_threshold (int): Stock at or below which LowStock is
+            published, for products without a threshold of their own.
+    """
+    def __init__(self, low_stock_threshold: int = 0):
+        self._low_stock_threshold = low_stock_threshold
+        self._thresholds: dict[Product, int] = {}
+        self._lock = threading.RLock()
+        # key: product, value: (quantity, active, price, promotion) it had
+        # the last time the store reported it
+        self._states: dict[Product, tuple] = {}
+        self._subscriptions: list[Subscription] = []
+        self._pending: list = []
+        self._batch_depth = 0
+
+    def attach(self, store: Store):
+        """Starts publishing the changes of the products of the store"""
+        store.add_listener(self._store_changed)
+        for product in store:
+            state = self._state_of(product)
+            with self._lock:
+                self._states.setdefault(product, state)
+
+    def detach(self, store: Store):
+        """Stops publishing the changes of the products of the store"""
+        store.remove_listener(self._store_changed)
+        # the store is read before the lock is taken: store listeners take
+        # the locks in the other order
+        store_products = tuple(store)
+        with self._lock:
+            for product in store_products:
+                self._states.pop(product, None)
+
+    def set_low_stock_threshold(self, product: Product, threshold: int):
+        """Publishes LowStock when the stock of the product goes down to
+        `threshold` or below"""
+        if threshold < 0:
+            raise ValueError("threshold cannot be negative")
+        with self._lock:
+            self._thresholds[product] = threshold
+
+    def subscribe(self, callback, event_types: tuple[type, ...] = (),
+                  batch: bool = False) -> Subscription:
+        """Calls `callback` with every event of the given types, or of any
+        type when none are given. With batch=True the callback gets a list
+        of events instead."""
+        return self._add(Subscription(callback, event_types, batch))
+
+    def subscribe_async(self, event_types: tuple[type, ...] = (),
+                        max_pending: int = 10_000) -> AsyncSubscription:
+        """Returns a queue of the events of the given types for the running
+        event loop"""
+        return self._add(AsyncSubscription(event_types, max_pending))
+
+    def _add(self, subscription):
+        with self._lock:
+            self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        """Stops delivering events to the subscription"""
+        with self._lock:
+            self._subscriptions.remove(subscription)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Holds back the events published inside the block, and delivers
+        them together at its end"""
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                if not self._batch_depth:
+                    events, self._pending = self._pending, []
+                    self._deliver(events)
+
+    def publish(self, events: list):
+        """Delivers the events to the subscribers, or holds them back until
+        the open batch ends"""
+        if not events:
+            return
+        with self._lock:
+            if self._batch_depth:
+                self._pending.extend(events)
+            else:
+                self._deliver(events)
+
+    def _deliver(self, events: list):
+        """Delivers the events to every subscription. The lock must be
+        held."""
+        if not events:
+            return
+        for subscription in tuple(self._subscriptions):
+            subscription._deliver(events)
+
+    @staticmethod
+    def _state_of(product: Product) -> tuple:
+        return (product.quantity, product.is_active(), product.price,
+                product.promotion)
+
+    def _store_changed(self, event: str, product: Product):
+        """Store listener turning the changes of a product into events"""
+        state = self._state_of(product)
+        with self._lock:
+            if event == "remove":
+                self._states.pop(product, None)
+                return
+            previous_state = self._states.get(product)
+            self._states[product] = state
+            if event == "add" or previous_state is None:
+                return
+            threshold = self._thresholds.get(product,
+                                             self._low_stock_threshold)
+            self.publish(self._diff(product, previous_state, state,
+                                    threshold))
+
+    @staticmethod
+    def _diff(product: Product, previous_state: tuple, state: tuple,
+              threshold: int) -> list:
+        """Returns the events that take the product from the previous state
+        to the new one"""
+        previous_quantity, was_active, previous_price, previous_promotion = \
+            previous_state
+        quantity, active, price, promotion = state
+        events = []
+        sold_out = False
+
+        if quantity < previous_quantity:
+            events.append(StockDecremented(product, quantity,
+                                           previous_quantity))
+            if quantity == 0:
+                sold_out = True
+                events.append(SoldOut(product))
+            elif quantity <= threshold < previous_quantity:
+                events.append(LowStock(product, quantity, threshold))
+        elif quantity > previous_quantity:
+            events.append(StockIncremented(product, quantity,
+                                           previous_quantity))
+
+        if active and not was_active:
+            events.append(Reactivated(product))
+        elif was_active and not active and not sold_out:
+            events.append(Deactivated(product))
+
+        if price != previous_price:
+            events.append(PriceChanged(product, price, previous_price))
+        if promotion is not previous_promotion:
+            events.append(PromotionChanged(product, promotion,
+                                           previous_promotion))
+        return events
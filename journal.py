@@ -0,0 +1,263 @@
+import json
+import os
+import threading
+
+import catalog
+from products import Product
+from store import Store
+
+
+class Journal:
+    """
+    Append-only journal of the changes made to the products of a store.
+
+    Every change is written as a json line with the new state of the
+    product, keyed by its name, which is unique in a store. Replaying a
+    record twice gives the same result. Records are group committed: they
+    are buffered and written with one flush (and one fsync) for many
+    changes. Nothing is written by the store listener, so no order waits
+    for the disk while it holds the locks of its products.
+
+    With wait_for_commit, an order returns only once its records are on
+    disk, so an order that returned is never lost on a crash. The first
+    order waiting commits every pending record, and the orders made while
+    it syncs are committed together by the next one. Other changes, and
+    all of them without wait_for_commit, are committed by a background
+    thread when `group_size` records are pending, or every
+    `commit_interval` seconds, and are lost on a crash before that.
+
+    Once the journal is bigger than `compact_size` bytes, it is compacted:
+    the store is saved to the snapshot and the journal starts over.
+
+    Attributes:
+        _path (str): The journal file.
+        _snapshot_path (str): The snapshot the journal is replayed on.
+    """
+    def __init__(self, path: str, snapshot_path: str, group_size: int = 1000,
+                 commit_interval: float = 0.01, fsync: bool = True,
+                 compact_size: int = 64 * 2**20,
+                 wait_for_commit: bool = True):
+        if group_size < 1:
+            raise ValueError("group size must be at least 1")
+        if commit_interval <= 0:
+            raise ValueError("commit interval must be positive")
+
+        self._path = path
+        self._old_path = path + ".old"
+        self._snapshot_path = snapshot_path
+        self._group_size = group_size
+        self._commit_interval = commit_interval
+        self._fsync = fsync
+        self._compact_size = compact_size
+        self._wait_for_commit = wait_for_commit
+
+        # guards the pending records, the sequence numbers and _committing
+        self._lock = threading.Lock()
+        # notified whenever a commit ends
+        self._commit_ended = threading.Condition(self._lock)
+        self._pending: list[str] = []
+        # number of records made, and of records on disk
+        self._sequence = 0
+        self._committed_sequence = 0
+        # a thread is writing the file. It is a flag rather than a lock, so
+        # threads waiting for their records wait on _commit_ended, and all
+        # wake up when a commit ends instead of taking turns at the file.
+        self._committing = False
+        # sequence number of the last record made by every thread
+        self._thread_sequence = threading.local()
+        self._file = open(path, "a", encoding="utf-8")
+        self._store: Store | None = None
+        self._closed = threading.Event()
+        # set when group_size records are pending
+        self._group_full = threading.Event()
+        self._worker: threading.Thread | None = None
+
+    def replay(self, store: Store):
+        """Applies the records of the journal to a store loaded from the
+        snapshot. Records left by an unfinished compaction are applied
+        first. A torn last line, from a crash in the middle of a write,
+        is ignored."""
+        for path in (self._old_path, self._path):
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding="utf-8") as file:
+                for line in file:
+                    if not line.endswith("\n"):
+                        break
+                    _apply_record(store, json.loads(line))
+
+    def attach(self, store: Store):
+        """Starts recording the changes of the store and the background
+        thread doing the timed commits and the compaction"""
+        if self._store is not None:
+            raise ValueError("journal is already attached to a store")
+        self._store = store
+        store.add_listener(self.record)
+        if self._wait_for_commit:
+            store.add_order_hook(self.wait)
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def record(self, event: str, product: Product):
+        """Store listener adding a record of the change to the journal"""
+        if event == "remove":
+            record = {"op": "remove", "name": product.name}
+        elif event == "add":
+            record = {"op": "add",
+                      "product": catalog.product_to_config(product)}
+        else:
+            promotion = product.promotion
+            record = {"op": "state", "name": product.name,
+                      "price": product.price, "quantity": product.quantity,
+                      "active": product.is_active(),
+                      "promotion": catalog.promotion_to_config(promotion)
+                      if promotion else None}
+        line = json.dumps(record) + "\n"
+
+        with self._lock:
+            self._pending.append(line)
+            self._sequence += 1
+            self._thread_sequence.value = self._sequence
+            if len(self._pending) >= self._group_size:
+                self._group_full.set()
+
+    def commit(self):
+        """Writes the pending records to the journal file"""
+        self._commit()
+
+    def _commit(self, rotate: bool = False):
+        """Writes the pending records once no other thread is writing, and
+        then moves the journal to the old path and starts a new one if
+        `rotate` is True"""
+        with self._lock:
+            while self._committing:
+                self._commit_ended.wait()
+            self._committing = True
+            lines, self._pending = self._pending, []
+            sequence = self._sequence
+        committed = False
+        try:
+            if lines:
+                self._file.write("".join(lines))
+                self._file.flush()
+                if self._fsync:
+                    os.fsync(self._file.fileno())
+            committed = True
+            if rotate:
+                self._file.close()
+                os.replace(self._path, self._old_path)
+                self._file = open(self._path, "a", encoding="utf-8")
+        finally:
+            with self._lock:
+                self._committing = False
+                if committed:
+                    self._committed_sequence = sequence
+                else:
+                    # written again by the next commit, replaying a record
+                    # twice is harmless
+                    self._pending[:0] = lines
+                self._commit_ended.notify_all()
+
+    def wait(self):
+        """Waits until the records made by the calling thread are on disk.
+        The commit under way may cover them; if not, the records made while
+        it syncs are committed together once it ends, by the first thread
+        to get there."""
+        sequence = getattr(self._thread_sequence, "value", 0)
+        while True:
+            with self._lock:
+                while self._committing and \
+                        self._committed_sequence < sequence:
+                    self._commit_ended.wait()
+                if self._committed_sequence >= sequence:
+                    return
+            self._commit()
+
+    def compact(self):
+        """Saves the store to the snapshot and starts the journal over.
+        The journal is rotated before the store is saved, so the snapshot
+        holds every change of the rotated journal. The store is saved from
+        a snapshot(), so orders go on while it is written. The snapshot is
+        written to a temporary file, and is on disk before it replaces the
+        old one and before the rotated journal is removed, so a crash
+        always leaves a whole snapshot and the records that go with it."""
+        if self._store is None:
+            raise ValueError("journal is not attached to a store")
+
+        self._commit(rotate=True)
+
+        temporary_path = self._snapshot_path + ".tmp"
+        self._store.save(temporary_path)
+        if self._fsync:
+            _sync_path(temporary_path)
+        os.replace(temporary_path, self._snapshot_path)
+        if self._fsync and os.name == "posix":
+            # the directory entry of the new snapshot
+            _sync_path(os.path.dirname(os.path.abspath(self._snapshot_path)))
+        os.remove(self._old_path)
+
+    def close(self, compact: bool = False):
+        """Commits the pending records and stops recording. With compact,
+        the store is also saved to the snapshot and the journal starts
+        over, so the next start has nothing to replay."""
+        if self._store is not None:
+            self._store.remove_listener(self.record)
+            if self._wait_for_commit:
+                self._store.remove_order_hook(self.wait)
+        self._closed.set()
+        self._group_full.set()
+        if self._worker is not None:
+            self._worker.join()
+        # after the worker stopped, so it cannot compact at the same time
+        if compact:
+            self.compact()
+        self._commit()
+        self._file.close()
+
+    def _run(self):
+        """Background thread committing the records every commit interval,
+        or as soon as a group is full, and compacting the journal when it
+        grows too big"""
+        while True:
+            self._group_full.wait(self._commit_interval)
+            if self._closed.is_set():
+                return
+            self._group_full.clear()
+            self.commit()
+            if os.path.getsize(self._path) > self._compact_size:
+                self.compact()
+
+
+def _sync_path(path: str):
+    """Flushes a file, or the entries of a directory, to disk"""
+    descriptor = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def _apply_record(store: Store, record: dict):
+    """Applies one journal record to the store"""
+    if record["op"] == "add":
+        if store.get_product(record["product"]["name"]) is None:
+            store.add_product(catalog.product_from_config(record["product"]))
+        return
+
+    product = store.get_product(record["name"])
+    if product is None:
+        return
+    if record["op"] == "remove":
+        store.remove_product(product)
+    else:
+        product.price = record["price"]
+        product.quantity = record["quantity"]
+        if record["promotion"]:
+            product.promotion = catalog.promotion_from_config(
+                record["promotion"])
+        else:
+            product.promotion = None
+        if record["active"]:
+            product.activate()
+        else:
+            product.deactivate()
@@ -0,0 +1,295 @@
+"""
+Load generator and latency profiler for Store.order.
+
+Replays synthetic or recorded orders against a store at a target rate.
+The schedule is open loop: every order is due at a fixed time, whatever
+the latency of the orders before it, and its latency is measured from
+when it was due. A slow order then shows up in the latency of the orders
+queued behind it, instead of slowing the generator down and hiding them.
+
+    python loadgen.py --rate 20000 --duration 10
+    python loadgen.py --trace orders.csv --rate 5000 --poisson
+    python loadgen.py --profile sample --folded stacks.txt
+
+--profile cprofile prints the hottest functions of products.py,
+promotions.py and store.py. --profile sample samples the stack of the
+generator, and --folded writes the samples as folded stacks, the input
+of flamegraph.pl and speedscope.
+"""
+import argparse
+import collections
+import itertools
+import math
+import os
+import random
+import sys
+import threading
+import time
+
+import benchmarks
+import main
+import metrics
+import store
+
+# files shown by the cProfile report
+PROFILED_FILES = r"(products|promotions|store)\.py"
+
+
+class LatencyHistogram:
+    """
+    Latencies in nanoseconds, in log-linear buckets like an HDR histogram.
+
+    Values below 2 ** sub_bucket_bits get one bucket each. Every power of
+    two above is split in 2 ** (sub_bucket_bits - 1) buckets, so a value
+    from a nanosecond to hours is recorded in O(1), with a relative error
+    below 1 / 2 ** (sub_bucket_bits - 1), 1.6% by default.
+    """
+    def __init__(self, sub_bucket_bits: int = 7):
+        if sub_bucket_bits < 1:
+            raise ValueError("sub bucket bits must be at least 1")
+        self._sub_bucket_bits = sub_bucket_bits
+        self._counts: list[int] = []
+        self.count = 0
+        self.max = 0
+
+    def _index(self, value: int) -> int:
+        """Returns the bucket of the value"""
+        bits = self._sub_bucket_bits
+        if value < 1 << bits:
+            return value
+        shift = value.bit_length() - bits
+        return (shift << (bits - 1)) + (value >> shift)
+
+    def _highest_value(self, index: int) -> int:
+        """Returns the highest value of the bucket"""
+        bits = self._sub_bucket_bits
+        if index < 1 << bits:
+            return index
+        shift = (index >> (bits - 1)) - 1
+        top = index - (shift << (bits - 1))
+        return ((top + 1) << shift) - 1
+
+    def record(self, value: int):
+        """Records a latency in nanoseconds"""
+        value = max(value, 0)
+        index = self._index(value)
+        if index >= len(self._counts):
+            self._counts.extend([0] * (index + 1 - len(self._counts)))
+        self._counts[index] += 1
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent: float) -> int:
+        """Returns the latency that `percent` percent of the recorded ones
+        are at or below, 0 if nothing was recorded"""
+        if not self.count:
+            return 0
+        target = max(math.ceil(percent / 100 * self.count), 1)
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= target:
+                return min(self._highest_value(index), self.max)
+        return self.max
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of a thread every `interval` seconds from a
+    background thread, and counts how often every stack was seen.
+
+    While it runs, the interpreter switches threads every `interval`
+    seconds, so the sampling thread gets to run in time.
+    """
+    def __init__(self, thread_id: int | None = None,
+                 interval: float = 0.001):
+        self._thread_id = threading.get_ident() if thread_id is None \
+            else thread_id
+        self._interval = interval
+        self._stop = threading.Event()
+        self._sampler = None
+        self._switch_interval = None
+        # key: stack as "file:function;file:function", root first
+        self.stacks: collections.Counter = collections.Counter()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self._switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self._interval, self._switch_interval))
+        self._stop.clear()
+        self._sampler = threading.Thread(target=self._run, daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+        sys.setswitchinterval(self._switch_interval)
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:"
+                             f"{code.co_qualname}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def folded(self) -> str:
+        """Returns the samples as folded stacks, one "stack count" line
+        per stack"""
+        return "".join(f"{stack} {count}\n"
+                       for stack, count in self.stacks.most_common())
+
+
+def _wait_until(due: int):
+    """Waits until time.perf_counter_ns() reaches `due`. Sleeps for long
+    waits and spins for the last millisecond, which sleep is too coarse
+    for."""
+    while True:
+        remaining = due - time.perf_counter_ns()
+        if remaining <= 0:
+            return
+        if remaining > 2_000_000:
+            time.sleep((remaining - 1_000_000) / 1e9)
+
+
+def run_load(best_buy: store.Store, shopping_lists, rate: float,
+             poisson: bool = False, seed: int = 0) \
+        -> tuple[LatencyHistogram, collections.Counter, float]:
+    """
+    Makes the orders at `rate` orders per second, open loop. Orders are
+    due at regular intervals, or after exponential gaps of the same mean
+    with poisson=True. Returns the histogram of the latencies, measured
+    from when every order was due, the count of every outcome, and the
+    seconds the run took.
+    """
+    if rate <= 0:
+        raise ValueError("rate must be positive")
+    rng = random.Random(seed)
+    interval = 1e9 / rate
+    histogram = LatencyHistogram()
+    outcomes: collections.Counter = collections.Counter()
+    clock = time.perf_counter_ns
+
+    start = clock()
+    due = float(start)
+    for shopping_list in shopping_lists:
+        _wait_until(int(due))
+        error = None
+        try:
+            best_buy.order(shopping_list)
+        except ValueError as e:
+            error = e
+        histogram.record(clock() - int(due))
+        outcomes[metrics.outcome_of(error)] += 1
+        due += rng.expovariate(1) * interval if poisson else interval
+    return histogram, outcomes, (clock() - start) / 1e9
+
+
+def load_trace(path: str, best_buy: store.Store) -> list:
+    """Returns the shopping lists of a csv or jsonl file in the format of
+    the bulk order mode of main.py. Orders with invalid rows are left
+    out."""
+    file_format = "csv" if path.endswith(".csv") else "jsonl"
+    with open(path, encoding="utf-8", newline="") as trace_file:
+        rows = main.read_order_rows(trace_file, file_format)
+        return [shopping_list for _, _, shopping_list, errors
+                in main.group_orders(main.resolve_order_rows(rows, best_buy))
+                if not errors]
+
+
+def print_report(histogram: LatencyHistogram, outcomes: collections.Counter,
+                 elapsed: float, rate: float):
+    """Prints the throughput, outcomes and latency percentiles of a run"""
+    print(f"orders      {histogram.count} in {elapsed:.2f}s "
+          f"({histogram.count / elapsed:.0f} orders/s, target {rate:.0f})")
+    print("outcomes    " + ", ".join(f"{outcome} {count}" for outcome, count
+                                     in sorted(outcomes.items())))
+    percentiles = [("p50", 50), ("p90", 90), ("p99", 99), ("p99.9", 99.9)]
+    print("latency us  " + "  ".join(
+        f"{label} {histogram.percentile(percent) / 1e3:.1f}"
+        for label, percent in percentiles) +
+        f"  max {histogram.max / 1e3:.1f}")
+
+
+def main_loadgen():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=10_000,
+                        help="orders per second")
+    parser.add_argument("--duration", type=float, default=5,
+                        help="seconds of orders to make")
+    parser.add_argument("--poisson", action="store_true",
+                        help="exponential gaps between orders instead of "
+                             "regular ones")
+    parser.add_argument("--trace",
+                        help="csv or jsonl orders to replay, in the format "
+                             "of main.py --orders, against the snapshot or "
+                             "the default store")
+    parser.add_argument("--snapshot",
+                        help="store snapshot to load, for --trace")
+    parser.add_argument("--catalog-size", type=int, default=1_000,
+                        help="products of the synthetic catalog")
+    parser.add_argument("--cart-size", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--profile", choices=["cprofile", "sample"])
+    parser.add_argument("--top", type=int, default=20,
+                        help="functions shown by the cprofile report")
+    parser.add_argument("--folded",
+                        help="file to write the sampled stacks to")
+    args = parser.parse_args()
+
+    order_count = max(int(args.rate * args.duration), 1)
+    if args.trace:
+        best_buy = store.Store.load(args.snapshot) if args.snapshot \
+            else main.create_default_store()
+        shopping_lists = load_trace(args.trace, best_buy)
+        if not shopping_lists:
+            sys.exit("the trace has no valid orders")
+    else:
+        catalog_products = benchmarks.make_mixed_catalog(args.catalog_size,
+                                                         args.seed)
+        best_buy = store.Store(catalog_products)
+        shopping_lists = benchmarks.make_carts(
+            catalog_products, min(order_count, 10_000), args.cart_size,
+            args.seed)
+    orders = itertools.islice(itertools.cycle(shopping_lists), order_count)
+
+    if args.profile == "cprofile":
+        import cProfile
+        import pstats
+
+        profiler = cProfile.Profile()
+        results = profiler.runcall(run_load, best_buy, orders, args.rate,
+                                   args.poisson, args.seed)
+        print_report(*results, args.rate)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(
+            PROFILED_FILES, args.top)
+    elif args.profile == "sample":
+        with SamplingProfiler() as profiler:
+            results = run_load(best_buy, orders, args.rate, args.poisson,
+                               args.seed)
+        print_report(*results, args.rate)
+        if args.folded:
+            with open(args.folded, "w", encoding="utf-8") as folded_file:
+                folded_file.write(profiler.folded())
+        else:
+            sys.stdout.write(profiler.folded())
+    else:
+        print_report(*run_load(best_buy, orders, args.rate, args.poisson,
+                               args.seed), args.rate)
+
+
+if __name__ == '__main__':
+    main_loadgen()
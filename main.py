@@ -1,13 +1,53 @@
+import atexit
+import itertools
+import json
+import os
+import time
 import products
 import store
 import sys
 import promotions
 
+# products are saved here when quitting and loaded on the next start
+STORE_SNAPSHOT_PATH = "best_buy_store.bin"
+# changes made since the snapshot was saved, replayed after a crash
+STORE_JOURNAL_PATH = "best_buy_store.journal"
+# products written to the terminal per write when listing the store
+LISTING_PAGE_SIZE = 10_000
+
 
 def start():
     """ This function starts the main program loop. The user is presented
     with a menu of options to interact with the store. This loop continues
     until the user decides to quit."""
+    best_buy = open_store()
+    while True:
+        print_menu()
+        user_input = input("Please choose a number: ")
+        execute_user_input(user_input, best_buy)
+
+
+def open_store() -> store.Store:
+    """Returns the store saved in the snapshot, or the default store, with
+    the journal replayed on it and recording its changes. The store is
+    saved to the snapshot on exit, by the compaction of the journal."""
+    # the journal pulls in the catalog, only needed once the store is open
+    import journal
+
+    if os.path.exists(STORE_SNAPSHOT_PATH):
+        best_buy = store.Store.load(STORE_SNAPSHOT_PATH)
+    else:
+        best_buy = create_default_store()
+    store_journal = journal.Journal(STORE_JOURNAL_PATH, STORE_SNAPSHOT_PATH)
+    store_journal.replay(best_buy)
+    store_journal.attach(best_buy)
+    atexit.register(store_journal.close, compact=True)
+    return best_buy
+
+
+def create_default_store() -> store.Store:
+    """Returns the store with the products it starts with when there is no
+    saved snapshot"""
     product_list = [
         products.Product("MacBook Air M2", price=1450, quantity=100),
         products.Product("Bose QuietComfort Earbuds", price=250, quantity=500),
@@ -25,11 +65,7 @@ def start():
     product_list[0].promotion = second_half_price
     product_list[1].promotion = third_one_free
     product_list[3].promotion = thirty_percent
-    best_buy = store.Store(product_list)
-    while True:
-        print_menu()
-        user_input = input("Please choose a number: ")
-        execute_user_input(user_input, best_buy)
+    return store.Store(product_list)
 
 
 def execute_user_input(user_input: str, store_best_buy: store.Store) -> None:
@@ -52,15 +88,22 @@ def execute_user_input(user_input: str, store_best_buy: store.Store) -> None:
 
 
 def print_all_products_in_store(store_best_buy: store.Store):
-    all_products = store_best_buy.get_all_products()
-
-    # printing
     print("-"*10)
-    for store_product in all_products:
-        print(store_product.show())
+    write_products(store_best_buy)
     print("-"*10)
 
 
+def write_products(store_best_buy: store.Store, numbered: bool = False,
+                   output=None):
+    """Writes the listing of the active products, one page of
+    LISTING_PAGE_SIZE lines per write"""
+    output = sys.stdout if output is None else output
+    product_count = len(store_best_buy.get_all_products())
+    for start in range(0, product_count, LISTING_PAGE_SIZE):
+        output.write(store_best_buy.render_products(start, LISTING_PAGE_SIZE,
+                                                    numbered))
+
+
 def print_total_amount_in_store(store_best_buy: store.Store):
     print("-"*10)
     total_amount = store_best_buy.get_total_quantity()
@@ -71,8 +114,9 @@ def print_total_amount_in_store(store_best_buy: store.Store):
 def make_an_order(store_best_buy: store.Store):
     """Allows the user to make an order by
     selecting products and quantities."""
-    all_products: list[products.Product] = store_best_buy.get_all_products()
-    print_products_list(all_products)
+    all_products: tuple[products.Product, ...] = \
+        store_best_buy.get_all_products()
+    print_products_list(store_best_buy)
 
     # dictionary key:Product, value:int - amount to buy. represent user order
     orders: dict[products.Product, int] =\
@@ -145,16 +189,16 @@ def validate_user_input(user_number_input: str, user_amount_input: str,
 
     return product_to_buy, quantity
 
-def print_products_list(all_products):
+def print_products_list(store_best_buy: store.Store):
     """Printing list of items for make_an_order func"""
     print("-" * 10)
-    for index, store_product in enumerate(all_products, start=1):
-        print(f"{index} {store_product.show()}")
+    write_products(store_best_buy, numbered=True)
     print("-" * 10)
     print("When you want to finish order, enter empty text.")
 
 
-def quit_the_programm(*args):
+def quit_the_programm(store_best_buy: store.Store):
+    # the journal saves the store when the program exits
     print("BYE")
     sys.exit()
 
@@ -170,6 +214,169 @@ def print_menu():
     print(menu_to_print)
 
 
+def read_order_rows(orders_file, file_format: str):
+    """
+    Yields (line number, row) for every row of a csv or jsonl file of
+    orders. row is a tuple (order id, product, quantity), without
+    validation, or None if the line cannot be parsed.
+
+    csv files have a header with the columns order_id, product, quantity.
+    jsonl files have one object with the same keys on every line.
+    Rows of the same order must follow each other.
+    """
+    if file_format == "csv":
+        # only the bulk order mode reads csv files
+        import csv
+
+        reader = csv.DictReader(orders_file)
+        for row in reader:
+            yield reader.line_num, (row.get("order_id"), row.get("product"),
+                                    row.get("quantity"))
+        return
+
+    for line_number, line in enumerate(orders_file, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+            yield line_number, (row.get("order_id"), row.get("product"),
+                                row.get("quantity"))
+        except (AttributeError, ValueError):
+            yield line_number, None
+
+
+def resolve_order_rows(rows, store_best_buy: store.Store):
+    """
+    Yields (line number, order id, product, quantity, error) for every
+    row. The product is looked up by name, or by its number in the product
+    list (the one shown by make_an_order) and validated like the input of
+    make_an_order. On invalid rows, product and quantity are None and
+    error describes the problem.
+    """
+    all_products = store_best_buy.get_all_products()
+    for line_number, row in rows:
+        if row is None:
+            yield line_number, None, None, None, "Invalid row"
+            continue
+        order_id, product_field, quantity_field = row
+        product_field = str(product_field or "")
+        try:
+            if product_field.isdigit():
+                product, quantity = validate_user_input(
+                    product_field, str(quantity_field), all_products, {})
+            else:
+                product = store_best_buy.get_product(product_field)
+                if product is None:
+                    raise ValueError(f"Unknown product {product_field}")
+                quantity = int(quantity_field)
+                if quantity <= 0:
+                    raise ValueError
+        except (TypeError, ValueError) as e:
+            yield line_number, order_id, None, None, str(e) or "Wrong amount"
+            continue
+        yield line_number, order_id, product, quantity, None
+
+
+def group_orders(resolved_rows):
+    """Yields (first line number, order id, shopping list, errors) for
+    every run of rows with the same order id"""
+    for order_id, order_rows in itertools.groupby(resolved_rows,
+                                                  key=lambda row: row[1]):
+        order_rows = list(order_rows)
+        shopping_list = [(product, quantity)
+                         for _, _, product, quantity, error in order_rows
+                         if error is None]
+        errors = [f"line {line_number}: {error}"
+                  for line_number, _, _, _, error in order_rows if error]
+        yield order_rows[0][0], order_id, shopping_list, errors
+
+
+def apply_orders(orders, store_best_buy: store.Store, batch_size: int):
+    """Applies the orders in batches of `batch_size` with order_many.
+    Yields (order id, total price or None, errors) for every order.
+    Orders with invalid rows are not applied."""
+    while True:
+        batch = list(itertools.islice(orders, batch_size))
+        if not batch:
+            return
+        valid_orders = [order for order in batch if not order[3]]
+        results = iter(store_best_buy.order_many(
+            [shopping_list for _, _, shopping_list, _ in valid_orders]))
+
+        for line_number, order_id, shopping_list, errors in batch:
+            if errors:
+                yield order_id, None, errors
+                continue
+            result = next(results)
+            if isinstance(result, ValueError):
+                yield order_id, None, [f"line {line_number}: {result}"]
+            else:
+                yield order_id, result, []
+
+
+def ingest_orders(orders_file, file_format: str,
+                  store_best_buy: store.Store, batch_size: int = 1000,
+                  output=sys.stdout, errors_output=sys.stderr) -> int:
+    """
+    Streams the orders of a csv or jsonl file into the store, without
+    keeping more than one batch in memory. Writes one line per order
+    made to `output` and one line per error to `errors_output`, then a
+    throughput summary. Returns the number of rejected orders.
+    """
+    start_time = time.perf_counter()
+    made, rejected = 0, 0
+    rows = read_order_rows(orders_file, file_format)
+    orders = group_orders(resolve_order_rows(rows, store_best_buy))
+    for order_id, price_paid, errors in apply_orders(orders, store_best_buy,
+                                                     batch_size):
+        if errors:
+            rejected += 1
+            for error in errors:
+                print(f"order {order_id}: {error}", file=errors_output)
+        else:
+            made += 1
+            print(f"order {order_id}: {price_paid}", file=output)
+
+    elapsed = time.perf_counter() - start_time
+    print(f"{made} orders made, {rejected} rejected in {elapsed:.2f}s "
+          f"({(made + rejected) / elapsed if elapsed else 0:.0f} orders/s)",
+          file=errors_output)
+    return rejected
+
+
+def main():
+    """Runs the interactive menu, or the bulk order mode when an orders
+    file is given"""
+    # imported here, so importing main for its functions stays cheap
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Best Buy store")
+    parser.add_argument("--orders",
+                        help="csv or jsonl file of orders to make, "
+                             "'-' for stdin")
+    parser.add_argument("--format", choices=["csv", "jsonl"],
+                        help="format of the orders file, guessed from the "
+                             "file extension when not given")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.orders is None:
+        start()
+        return
+
+    file_format = args.format or \
+        ("csv" if args.orders.endswith(".csv") else "jsonl")
+    best_buy = open_store()
+    if args.orders == "-":
+        rejected = ingest_orders(sys.stdin, file_format, best_buy,
+                                 args.batch_size)
+    else:
+        with open(args.orders, encoding="utf-8", newline="") as orders_file:
+            rejected = ingest_orders(orders_file, file_format, best_buy,
+                                     args.batch_size)
+    sys.exit(1 if rejected else 0)
+
+
 if __name__ == '__main__':
 
-    start()
+    main()
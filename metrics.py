@@ -0,0 +1,194 @@
+"""
+In-process metrics of the store hot paths.
+
+Instrumentation is off by default. The instrumented functions only check
+the module-level ENABLED flag while it is off, so it is cheap enough to
+leave in production code. Call enable() to start recording, and
+REGISTRY.to_prometheus() to export everything in the Prometheus text
+format.
+"""
+import threading
+import time
+
+ENABLED = False
+
+# upper bounds, in seconds, of the latency histogram buckets
+DEFAULT_BUCKETS = (0.000_001, 0.000_005, 0.000_01, 0.000_05, 0.000_1,
+                   0.000_5, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+
+def enable():
+    """Starts recording metrics"""
+    global ENABLED
+    ENABLED = True
+
+
+def disable():
+    """Stops recording metrics. Recorded values are kept."""
+    global ENABLED
+    ENABLED = False
+
+
+def _format_labels(label_names: tuple[str, ...], label_values: tuple,
+                   extra: str = "") -> str:
+    """Returns the labels in the Prometheus format, like {a="1",b="2"}"""
+    labels = [f'{name}="{value}"'
+              for name, value in zip(label_names, label_values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class Counter:
+    """
+    Counts events, separately for every combination of label values.
+
+    Attributes:
+        name (str): The name of the metric.
+        help (str): One line describing the metric.
+    """
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self._label_names = label_names
+        self._lock = threading.Lock()
+        self._values: dict[tuple, int] = {}
+
+    def inc(self, *label_values, amount: int = 1):
+        """Adds the amount to the count of the label values"""
+        with self._lock:
+            self._values[label_values] = \
+                self._values.get(label_values, 0) + amount
+
+    def get(self, *label_values) -> int:
+        """Returns the count of the label values"""
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def to_prometheus(self) -> list[str]:
+        """Returns the lines of the metric in the Prometheus text format"""
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                labels = _format_labels(self._label_names, label_values)
+                lines.append(f"{self.name}{labels} {value}")
+        return lines
+
+
+class Histogram:
+    """
+    Distribution of observed values, like latencies, in fixed buckets,
+    separately for every combination of label values.
+
+    Attributes:
+        name (str): The name of the metric.
+        help (str): One line describing the metric.
+    """
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self._label_names = label_names
+        self._buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # key: label values, value: [count per bucket..., +Inf count, sum]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        """Records a value for the label values"""
+        index = 0
+        for index, bound in enumerate(self._buckets):
+            if value <= bound:
+                break
+        else:
+            index = len(self._buckets)
+
+        with self._lock:
+            values = self._values.get(label_values)
+            if values is None:
+                values = self._values[label_values] = \
+                    [0] * (len(self._buckets) + 1) + [0.0]
+            values[index] += 1
+            values[-1] += value
+
+    def time(self, start: float, *label_values):
+        """Records the seconds elapsed since `start`, a time.perf_counter()
+        value"""
+        self.observe(time.perf_counter() - start, *label_values)
+
+    def get_count(self, *label_values) -> int:
+        """Returns how many values were recorded for the label values"""
+        with self._lock:
+            values = self._values.get(label_values)
+            return sum(values[:-1]) if values else 0
+
+    def to_prometheus(self) -> list[str]:
+        """Returns the lines of the metric in the Prometheus text format"""
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, values in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self._buckets + (float("inf"),),
+                                        values):
+                    cumulative += count
+                    bound_label = "+Inf" if bound == float("inf") \
+                        else repr(bound)
+                    labels = _format_labels(self._label_names, label_values,
+                                            f'le="{bound_label}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self._label_names, label_values)
+                lines.append(f"{self.name}_sum{labels} {values[-1]}")
+                lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Holds metrics by name and exports them together"""
+    def __init__(self):
+        self._metrics: dict[str, Counter | Histogram] = {}
+
+    def register(self, metric: Counter | Histogram) \
+            -> Counter | Histogram:
+        """Adds the metric to the registry and returns it"""
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name: str) -> Counter | Histogram:
+        """Returns the metric with the given name"""
+        return self._metrics[name]
+
+    def to_prometheus(self) -> str:
+        """Returns all metrics in the Prometheus text format"""
+        lines = []
+        for metric in self._metrics.values():
+            lines += metric.to_prometheus()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+ORDER_SECONDS = REGISTRY.register(Histogram(
+    "store_order_seconds", "Latency of Store.order", ("outcome",)))
+ORDERS = REGISTRY.register(Counter(
+    "store_orders_total", "Orders by outcome", ("outcome",)))
+GET_ALL_PRODUCTS_SECONDS = REGISTRY.register(Histogram(
+    "store_get_all_products_seconds", "Latency of Store.get_all_products"))
+BUY_SECONDS = REGISTRY.register(Histogram(
+    "product_buy_seconds", "Latency of Product.buy", ("outcome",)))
+BUYS = REGISTRY.register(Counter(
+    "product_buys_total", "Product buys by outcome", ("outcome",)))
+PROMOTION_SECONDS = REGISTRY.register(Histogram(
+    "promotion_apply_seconds", "Latency of Promotion.apply_promotion",
+    ("promotion",)))
+
+
+def outcome_of(error: Exception | None) -> str:
+    """Returns the outcome label of an operation that raised `error`,
+    or "success" if it raised nothing"""
+    if error is None:
+        return "success"
+    return getattr(error, "outcome", "rejected")
@@ -0,0 +1,306 @@
+"""
+Cheapest way to buy a basket.
+
+Promotions price every line of an order on their own, so what a basket
+costs depends on how its items are split into orders: with ThirdOneFree,
+two orders of 3 items cost less than one of 4 and one of 2, and a
+LimitedProduct allows only `maximum` items per order. A basket line can
+also name several equivalent products, any mix of which will do.
+
+Promotions round the price of every line to cents, so a plan could gain
+a cent here and there by splitting a line into many orders. Lines are
+compared before that rounding instead, so plans don't split lines for a
+rounding cent. Their total, the sum of the rounded line prices, is the
+cheapest when line prices need no rounding, as with whole-unit prices,
+and can otherwise be a few cents above the cheapest split of the rounded
+prices.
+
+Lines are searched up to the split size of the promotion, and at most up
+to MAX_LINE_SIZE items, so planning stays fast. When that leaves bigger
+lines out, buying all the items of a product in one line is tried too,
+so a plan never costs more than one order per product, but may miss a
+cheaper split into big lines.
+"""
+import math
+from typing import NamedTuple
+
+from products import LimitedProduct, NonStockedProduct, Product
+
+# largest line searched, when the promotion gives no smaller split size
+MAX_LINE_SIZE = 16
+# lines are compared in millionths of the currency, before rounding
+PRICE_SCALE = 1_000_000
+
+
+class CartPlan(NamedTuple):
+    """Orders buying a basket, and their total price"""
+    total_price: float
+    orders: list[list[tuple[Product, int]]]
+
+
+class _ProductCosts:
+    """
+    Cheapest price of any quantity of one product, bought as lines of at
+    most `line_size` items, one line per order.
+
+    In a cheapest plan, the lines of another size than the one with the
+    lowest price per item add up to at most (best size - 1) * line size
+    items: from any `best size` lines, some can always be swapped for
+    lines of the best size at no extra cost. So prices are searched only
+    up to that many items, and the rest is bought in lines of the best
+    size, which makes the price of any quantity O(line size).
+
+    Prices are in units of 1 / PRICE_SCALE, before rounding to cents, see
+    _unrounded_price().
+
+    With `unsplit`, bigger lines than `line_size` may be cheaper, so the
+    price of a quantity is also compared with the one of a single line.
+    """
+    def __init__(self, product: Product, line_size: int,
+                 unsplit: bool = False):
+        self.product = product
+        self._line_size = line_size
+        self._unsplit = unsplit
+        line_prices = [0] + [_unrounded_price(product, size)
+                             for size in range(1, line_size + 1)]
+        # ties go to the bigger line, so the plan needs fewer orders
+        self.best_size = min(range(1, line_size + 1),
+                             key=lambda size: (line_prices[size] / size,
+                                               -size))
+        self.best_price = line_prices[self.best_size]
+
+        bound = (self.best_size - 1) * line_size
+        self._prices = [0] + [math.inf] * bound
+        # size of the last line of the cheapest plan of every quantity
+        self._last_line = [0] * (bound + 1)
+        for quantity in range(1, bound + 1):
+            for size in range(min(line_size, quantity), 0, -1):
+                price = self._prices[quantity - size] + line_prices[size]
+                if price < self._prices[quantity]:
+                    self._prices[quantity] = price
+                    self._last_line[quantity] = size
+
+    def _split(self, quantity: int) -> tuple[int, int]:
+        """Returns (items bought in searched lines, lines of the best size)
+        of the cheapest plan of the quantity"""
+        bound = len(self._prices) - 1
+        best_rest, best_price = 0, math.inf
+        for rest in range(quantity % self.best_size, min(quantity, bound) + 1,
+                          self.best_size):
+            price = self._prices[rest] + \
+                (quantity - rest) // self.best_size * self.best_price
+            if price < best_price:
+                best_rest, best_price = rest, price
+        return best_rest, (quantity - best_rest) // self.best_size
+
+    def _split_price(self, quantity: int) -> int:
+        """Returns the cheapest price of the quantity in searched lines"""
+        rest, best_lines = self._split(quantity)
+        return self._prices[rest] + best_lines * self.best_price
+
+    def _single_line_price(self, quantity: int) -> float:
+        """Returns the price of the quantity in one line bigger than the
+        searched ones, or math.inf when there is no such line"""
+        if not self._unsplit or quantity <= self._line_size:
+            return math.inf
+        if isinstance(self.product, LimitedProduct) and \
+                quantity > self.product.maximum:
+            return math.inf
+        return _unrounded_price(self.product, quantity)
+
+    def price(self, quantity: int) -> int:
+        """Returns the cheapest price of the quantity, in units of
+        1 / PRICE_SCALE before rounding"""
+        return min(self._split_price(quantity),
+                   self._single_line_price(quantity))
+
+    def line_counts(self, quantity: int) -> dict[int, int]:
+        """Returns how many lines of every size the cheapest plan of the
+        quantity has. Lines of the best size are merged into bigger ones
+        when that costs no more, so the plan needs fewer orders."""
+        # ties go to the single line, which needs fewer orders
+        if self._single_line_price(quantity) <= self._split_price(quantity):
+            return {quantity: 1}
+        rest, best_lines = self._split(quantity)
+        merged_lines = best_lines
+        if isinstance(self.product, LimitedProduct):
+            merged_lines = min(merged_lines,
+                               self.product.maximum // self.best_size)
+        line_counts: dict[int, int] = {}
+        if merged_lines > 1:
+            merged_size = merged_lines * self.best_size
+            merged_price = _unrounded_price(self.product, merged_size)
+            if merged_price <= merged_lines * self.best_price:
+                line_counts[merged_size] = best_lines // merged_lines
+                best_lines %= merged_lines
+        if best_lines:
+            line_counts[self.best_size] = \
+                line_counts.get(self.best_size, 0) + best_lines
+        while rest:
+            size = self._last_line[rest]
+            line_counts[size] = line_counts.get(size, 0) + 1
+            rest -= size
+        return line_counts
+
+    def lines(self, quantity: int) -> list[int]:
+        """Returns the line sizes of the cheapest plan of the quantity,
+        biggest first"""
+        return [size for size, count
+                in sorted(self.line_counts(quantity).items(), reverse=True)
+                for _ in range(count)]
+
+
+def _unrounded_price(product: Product, quantity: int) -> int:
+    """Returns the price of a line of the product in units of
+    1 / PRICE_SCALE. The promotion prices the line at PRICE_SCALE times
+    the unit price, so its rounding to cents is negligible, and lines of
+    the built-in promotions cost the sum of their parts."""
+    price = product.price * PRICE_SCALE
+    if product.promotion is None:
+        return round(price * quantity)
+    return round(product.promotion.apply_promotion(quantity, price))
+
+
+def _line_size(product: Product) -> tuple[int, bool]:
+    """Returns the biggest line of the product worth searching, and whether
+    bigger lines than that may still be cheaper"""
+    promotion = product.promotion
+    line_size = 1 if promotion is None else promotion.split_size()
+    unsplit = line_size is None or line_size > MAX_LINE_SIZE
+    if unsplit:
+        line_size = MAX_LINE_SIZE
+    if isinstance(product, LimitedProduct):
+        line_size = min(line_size, product.maximum)
+    return line_size, unsplit
+
+
+def _available(product: Product, quantity: int, held: int) -> int:
+    """Returns how many items of the product can be bought, up to
+    `quantity`, with `held` items held by reservations"""
+    if not product.is_active() or _line_size(product)[0] < 1:
+        return 0
+    if isinstance(product, NonStockedProduct):
+        return quantity
+    return max(min(product.quantity - held, quantity), 0)
+
+
+def _allocate(costs: list[_ProductCosts], available: list[int],
+              quantity: int) -> list[int]:
+    """
+    Returns how many items to buy of every product so the quantity costs
+    the least.
+
+    Past a few items, every product costs the same for every `best size`
+    more items, so the bulk of the quantity goes to the products with the
+    lowest price per item first. Only the last items given to every
+    product, and the rest of the quantity, are searched, with dynamic
+    programming over the products.
+    """
+    order = sorted(range(len(costs)),
+                   key=lambda index: costs[index].best_price /
+                   costs[index].best_size)
+    window = max(len(cost._prices) + cost.best_size for cost in costs)
+    base = [0] * len(costs)
+    remaining = quantity
+    for index in order:
+        take = min(available[index], remaining)
+        base[index] = max(take - window, 0)
+        remaining -= take
+    rest = quantity - sum(base)
+
+    # cheapest price of buying `items` more items with the products so far
+    prices = [0] + [math.inf] * rest
+    choices = []
+    for index, cost in enumerate(costs):
+        extra_limit = min(available[index] - base[index], rest)
+        extra_prices = [cost.price(base[index] + extra)
+                        for extra in range(extra_limit + 1)]
+        new_prices = [math.inf] * (rest + 1)
+        choice = [0] * (rest + 1)
+        for items in range(rest + 1):
+            for extra in range(min(extra_limit, items) + 1):
+                price = prices[items - extra] + extra_prices[extra]
+                if price < new_prices[items]:
+                    new_prices[items] = price
+                    choice[items] = extra
+        prices = new_prices
+        choices.append(choice)
+
+    allocation = [0] * len(costs)
+    items = rest
+    for index in range(len(costs) - 1, -1, -1):
+        extra = choices[index][items]
+        allocation[index] = base[index] + extra
+        items -= extra
+    return allocation
+
+
+def _allocate_basket(basket: list[tuple[Product | list[Product], int]],
+                     held: dict[Product, int] | None) \
+        -> list[tuple[_ProductCosts, int]]:
+    """Returns the costs of every product of the basket and how many of
+    its items the cheapest plan buys"""
+    held = held or {}
+    allocations = []
+    seen_products: set[Product] = set()
+    for basket_products, quantity in basket:
+        if isinstance(basket_products, Product):
+            basket_products = [basket_products]
+        if quantity <= 0:
+            raise ValueError("Quantity to buy must be positive")
+        for product in basket_products:
+            if product in seen_products:
+                raise ValueError(f"Product {product.name} is in more than "
+                                 f"one line of the basket")
+            seen_products.add(product)
+
+        available = [_available(product, quantity, held.get(product, 0))
+                     for product in basket_products]
+        if sum(available) < quantity:
+            names = ", ".join(product.name for product in basket_products)
+            raise ValueError(f"Not enough stock to buy {quantity} of "
+                             f"{names}")
+        costs = []
+        for product in basket_products:
+            line_size, unsplit = _line_size(product)
+            costs.append(_ProductCosts(product, max(line_size, 1), unsplit))
+        allocations += zip(costs, _allocate(costs, available, quantity))
+    return allocations
+
+
+def quote_cart(basket: list[tuple[Product | list[Product], int]],
+               held: dict[Product, int] | None = None) -> float:
+    """Returns the total price of the cheapest plan of the basket, see
+    plan_cart(), without listing its orders. The time it takes doesn't
+    grow with the quantities."""
+    total_price = 0
+    for cost, quantity in _allocate_basket(basket, held):
+        for size, count in cost.line_counts(quantity).items():
+            total_price += count * cost.product.get_total_price(size)
+    return round(total_price, 2)
+
+
+def plan_cart(basket: list[tuple[Product | list[Product], int]],
+              held: dict[Product, int] | None = None) -> CartPlan:
+    """
+    Returns the cheapest orders buying the basket.
+
+    Every line of the basket is a product, or a list of equivalent
+    products, and how many items of it to buy. A product can be in only
+    one line. Plans respect the stock of the products and the maximum
+    per order of LimitedProduct, and prefer bigger lines, so fewer orders,
+    when prices tie. `held` gives how many items of a product are held by
+    reservations, which the plan leaves alone. Raises ValueError when the
+    basket cannot be bought.
+    """
+    lines_by_product = {cost.product: cost.lines(quantity)
+                        for cost, quantity in _allocate_basket(basket, held)
+                        if quantity}
+    order_count = max(map(len, lines_by_product.values()), default=0)
+    orders = [[(product, lines[index])
+               for product, lines in lines_by_product.items()
+               if index < len(lines)]
+              for index in range(order_count)]
+    total_price = sum(product.get_total_price(quantity)
+                      for order in orders for product, quantity in order)
+    return CartPlan(round(total_price, 2), orders)
@@ -0,0 +1,108 @@
+import bisect
+import itertools
+import operator
+
+from products import Product
+
+
+class PriceIndex:
+    """
+    Products sorted by price, for range queries and sorted listings.
+
+    The index keeps a sorted list of (price, sequence) keys next to a list
+    of the products in the same order. The sequence number is given to a
+    product when it is first indexed, so products with the same price keep
+    the order they were indexed in. Lookups are O(log n) and queries
+    returning k products are O(log n + k). update() inserts into the
+    lists, which is O(n), so many products are indexed at once with
+    update_many(), which sorts the whole index once.
+    """
+    def __init__(self):
+        self._keys: list[tuple[float, int]] = []
+        self._products: list[Product] = []
+        # key of every indexed product
+        self._key_by_product: dict[Product, tuple[float, int]] = {}
+        self._sequence_by_product: dict[Product, int] = {}
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, product):
+        return product in self._key_by_product
+
+    def update(self, product: Product, price: float | None):
+        """Indexes the product at the given price. A price of None removes
+        the product from the index."""
+        old_key = self._key_by_product.get(product)
+        new_key = None if price is None else self._key(product, price)
+        if old_key == new_key:
+            return
+
+        if old_key is not None:
+            index = bisect.bisect_left(self._keys, old_key)
+            del self._keys[index]
+            del self._products[index]
+            del self._key_by_product[product]
+        if new_key is not None:
+            index = bisect.bisect_left(self._keys, new_key)
+            self._keys.insert(index, new_key)
+            self._products.insert(index, product)
+            self._key_by_product[product] = new_key
+
+    def update_many(self, prices: list[tuple[Product, float | None]]):
+        """Indexes every product at its price, like update() for each of
+        them, in O(n log n) for the whole index"""
+        key_by_product = self._key_by_product
+        for product, price in prices:
+            if price is None:
+                key_by_product.pop(product, None)
+            else:
+                key_by_product[product] = self._key(product, price)
+
+        # keys are unique, so products are never compared
+        entries = sorted(key_by_product.items(), key=operator.itemgetter(1))
+        self._keys = [key for _, key in entries]
+        self._products = [product for product, _ in entries]
+
+    def _key(self, product: Product, price: float) -> tuple[float, int]:
+        """Returns the key of the product at the given price, giving it a
+        sequence number if it has none yet"""
+        sequence = self._sequence_by_product.get(product)
+        if sequence is None:
+            sequence = self._sequence_by_product[product] = \
+                next(self._sequence)
+        return price, sequence
+
+    def discard(self, product: Product):
+        """Removes the product from the index, if it is there"""
+        self.update(product, None)
+        self._sequence_by_product.pop(product, None)
+
+    def in_range(self, low: float, high: float) -> list[Product]:
+        """Returns the products with low <= price <= high, cheapest first"""
+        start = bisect.bisect_left(self._keys, (low,))
+        end = bisect.bisect_right(self._keys, (high, float("inf")))
+        return self._products[start:end]
+
+    def cheapest(self, count: int) -> list[Product]:
+        """Returns up to `count` products, cheapest first"""
+        return self._products[:max(count, 0)]
+
+    def most_expensive(self, count: int) -> list[Product]:
+        """Returns up to `count` products, most expensive first"""
+        if count <= 0:
+            return []
+        return self._products[:-count - 1:-1]
+
+    def page(self, page: int, page_size: int,
+             descending: bool = False) -> list[Product]:
+        """Returns the products of a page of the listing sorted by price.
+        Pages are numbered from 1."""
+        if page < 1 or page_size < 1:
+            raise ValueError("page and page size must be at least 1")
+        start = (page - 1) * page_size
+        if descending:
+            end = len(self._products) - start
+            return self._products[max(end - page_size, 0):max(end, 0)][::-1]
+        return self._products[start:start + page_size]
@@ -1,27 +1,59 @@
+import threading
+import time
+
+import metrics
 import promotions
 
 
+class OutOfStockError(ValueError):
+    """Raised when buying more items than what exists"""
+    outcome = "out_of_stock"
+
+
+class LimitExceededError(ValueError):
+    """Raised when buying more items than allowed in one order"""
+    outcome = "limit_exceeded"
+
+
 class Product:
     """The Product class represents a product in the store."""
+    __slots__ = ("_observers", "_lock", "_name", "_price", "_quantity",
+                 "_active", "_promotion")
+
     def __init__(self, name: str, price: float, quantity: int):
         if not name:
             raise ValueError("name cannot be empty")
         if price < 0:
             raise ValueError("price cannot be negative")
+        if quantity < 0:
+            raise ValueError("quantity cannot be negative")
 
+        # callbacks notified with the product whenever its state changes
+        self._observers = []
+        # guards the check-then-act of buy against concurrent orders
+        self._lock = threading.RLock()
         self._name = name
         self._price = price
-        self.__quantity = quantity
+        self._quantity = quantity
         self._active = True
         self._promotion: promotions.Promotion = None
 
-
     def __gt__(self, other):
         return self.price > other.price
 
     def __lt__(self, other):
         return self.price < other.price
 
+    def _changed(self):
+        """Notifies all observers that the state of the product changed"""
+        for observer in self._observers:
+            observer(self)
+
+    @property
+    def name(self) -> str:
+        """Returns the name of the product"""
+        return self._name
+
     @property
     def price(self) -> float:
         return self._price
@@ -31,6 +63,7 @@ class Product:
         if price < 0:
                 raise ValueError("price cannot be negative")
         self._price = price
+        self._changed()
 
     def __str__(self):
         return self.show()
@@ -44,6 +77,7 @@ class Product:
     def promotion(self, product_promotion: promotions.Promotion):
         """Set the promotions for the product"""
         self._promotion = product_promotion
+        self._changed()
 
     @property
     def quantity(self) -> int:
@@ -56,11 +90,12 @@ class Product:
         deactivates the product."""
         if quantity < 0:
             raise ValueError("quantity cannot be negative")
-        self._quantity = quantity
-        if not self._quantity:
-            self._active = False
-
-    __quantity = quantity
+        with self._lock:
+            self._quantity = quantity
+            if not self._quantity:
+                self.deactivate()
+            else:
+                self._changed()
 
     def is_active(self) -> bool:
         """Returns True if the product is active, otherwise False."""
@@ -69,10 +104,12 @@ class Product:
     def activate(self):
         """Activates the product."""
         self._active = True
+        self._changed()
 
     def deactivate(self):
         """Deactivates the product."""
         self._active = False
+        self._changed()
 
     def show(self) -> str:
         """Returns a string that represents the product"""
@@ -85,30 +122,60 @@ class Product:
 
         return product_representation
 
-    def buy(self, quantity: int) -> float:
-        """Buys a given quantity of the product.
-        Returns the total price (float) of the purchase"""
-        if quantity > self._quantity:
-            raise ValueError("Error while making order! "
-                             "Quantity larger than what exists")
+    def check_buy(self, quantity: int, reserved: int = 0):
+        """Raises ValueError if the given quantity cannot be bought while
+        `reserved` items are held for other orders"""
+        if quantity + reserved > self._quantity:
+            raise OutOfStockError("Error while making order! "
+                                  "Quantity larger than what exists")
 
-        # assign total_price
+    def get_total_price(self, quantity: int) -> float:
+        """Returns the price (float) of a given quantity of the product,
+        without buying it"""
         if self._promotion:
+            if metrics.ENABLED:
+                start = time.perf_counter()
                 total_price = self._promotion.apply_promotion(quantity,
                                                               self._price)
-        else:
-            total_price = self._price * quantity
+                metrics.PROMOTION_SECONDS.time(start,
+                                               self._promotion.get_name())
+                return total_price
+            return self._promotion.apply_promotion(quantity, self._price)
+        return self._price * quantity
 
-        # deactivate product if it reached 0
-        self._quantity -= quantity
-        if self._quantity == 0:
-            self.deactivate()
+    def buy(self, quantity: int) -> float:
+        """Buys a given quantity of the product.
+        Returns the total price (float) of the purchase"""
+        if not metrics.ENABLED:
+            return self._buy(quantity)
+
+        start = time.perf_counter()
+        error = None
+        try:
+            return self._buy(quantity)
+        except ValueError as e:
+            error = e
+            raise
+        finally:
+            outcome = metrics.outcome_of(error)
+            metrics.BUY_SECONDS.time(start, outcome)
+            metrics.BUYS.inc(outcome)
+
+    def _buy(self, quantity: int) -> float:
+        """buy() without the instrumentation"""
+        with self._lock:
+            self.check_buy(quantity)
+            total_price = self.get_total_price(quantity)
+
+            # the setter deactivates the product if it reached 0
+            self.quantity = self._quantity - quantity
 
         return total_price
 
 
 class NonStockedProduct(Product):
     """Not physical product. quantity always stays 0 """
+    __slots__ = ()
     _QUANTITY = 0
 
     def __init__(self, name: str, price: float):
@@ -125,17 +192,13 @@ class NonStockedProduct(Product):
         physical product"""
         pass
 
-    def buy(self, quantity: int) -> float:
-        """Buys a given quantity of the product.
-        Returns the total price (float) of the purchase"""
-        # calculate total price
-        prom = self.promotion
-        if prom:  # case when there is promotion
-            total_price = prom.apply_promotion(quantity, self._price)
-        else:
-            total_price = self._price * quantity
+    def check_buy(self, quantity: int, reserved: int = 0):
+        """Any quantity of not physical product can be bought"""
+        pass
 
-        return total_price
+    def _buy(self, quantity: int) -> float:
+        """Not physical product is only priced, its quantity stays 0"""
+        return self.get_total_price(quantity)
 
     def show(self):
         """Returns a string that represents the product"""
@@ -152,30 +215,21 @@ class NonStockedProduct(Product):
 
 class LimitedProduct(Product):
     """this product can be purchased maximum amount of times in an order"""
+    __slots__ = ("_maximum",)
+
     def __init__(self, name: str, price: float, quantity: int, maximum: int):
         super().__init__(name, price, quantity)
         self._maximum = maximum
 
-    def buy(self, quantity: int) -> float:
-        """Buys a given quantity of the product.
-        Returns the total price (float) of the purchase"""
-        if quantity > self._maximum:
-            raise ValueError(f"Product {self._name} can be purchased"
-                             f" {self._maximum} times")
-        if quantity > self._quantity:
-            raise ValueError("Error while making order! "
-                             "Quantity larger than what exists")
-
-        # calculate total price
-        prom = self.promotion
-        if prom:  # case when there is promotions
-            total_price = prom.apply_promotion(quantity, self._price)
-        else:
-            total_price = self._price * quantity
-
-        # deactivate product if it reached 0
-        self._quantity -= quantity
-        if self._quantity == 0:
-            self.deactivate()
+    @property
+    def maximum(self) -> int:
+        """Returns how many items can be purchased in an order"""
+        return self._maximum
 
-        return total_price
+    def check_buy(self, quantity: int, reserved: int = 0):
+        """Raises ValueError if the given quantity is above the maximum
+        for an order or larger than what exists"""
+        if quantity > self._maximum:
+            raise LimitExceededError(f"Product {self._name} can be purchased"
+                                     f" {self._maximum} times")
+        super().check_buy(quantity, reserved)
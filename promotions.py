@@ -1,4 +1,8 @@
 import abc
+from collections.abc import Callable
+
+# signature of a pricing function: (quantity, price) -> total price
+PriceFunction = Callable[[int, float], float]
 
 
 class Promotion(abc.ABC):
@@ -12,6 +16,8 @@ class Promotion(abc.ABC):
     Attributes:
         _name (str): The name of the promotion.
     """
+    __slots__ = ("_name",)
+
     def __init__(self, name):
         self._name = name
 
@@ -33,10 +39,58 @@ class Promotion(abc.ABC):
         """
         pass
 
+    def apply_promotion_batch(self, quantities, prices) -> list[float]:
+        """
+        Calculate the total prices of many (quantity, price) pairs at once.
+        Subclasses override it with the arithmetic of apply_promotion
+        inlined, so the results are exactly the same as the scalar path.
+
+        Args:
+            quantities (Iterable[int]): The quantities being purchased.
+            prices (Iterable[float]): The original price of each item,
+                one for every quantity.
+
+        Returns:
+            list[float]: The total price of every pair after applying
+                the discount.
+        """
+        return [self.apply_promotion(quantity, price)
+                for quantity, price in zip(quantities, prices)]
+
+    def compile(self) -> PriceFunction:
+        """
+        Return a function (quantity, price) -> total price doing the same
+        as apply_promotion. Composite promotions call it once, when they
+        are created, on every promotion they are made of.
+        """
+        return self.apply_promotion
+
+    def split_size(self) -> int | None:
+        """
+        Return a line size n such that any line of more than n items
+        costs at least as much as the same items split into lines of at
+        most n items, or None when the promotion doesn't know one. Prices
+        are compared before they are rounded to cents: the rounding of
+        every line makes the price of lines no exact sum of their parts.
+        The cart optimizer uses it to bound the line sizes it tries.
+        Promotions are assumed to never cost more than the full price.
+        """
+        return None
+
+    def to_config(self) -> dict:
+        """
+        Return a json-serializable description of the promotion. Building
+        the type named by config["type"] with the other keys as arguments
+        gives back an equal promotion.
+        """
+        return {"type": type(self).__name__, "name": self._name}
+
 
 class SecondHalfPrice(Promotion):
     """represent promotion that reduces the price
     of every second item in the purchased quantity by 50%."""
+    __slots__ = ()
+
     def __init__(self, name: str):
         super().__init__(name)
 
@@ -64,6 +118,17 @@ class SecondHalfPrice(Promotion):
 
         return round(total_price, 2)
 
+    def apply_promotion_batch(self, quantities, prices) -> list[float]:
+        """Batch version of apply_promotion, see Promotion"""
+        discount = 0.5
+        return [round(((quantity + 1) // 2) * price +
+                      (quantity - (quantity + 1) // 2) * price * discount, 2)
+                for quantity, price in zip(quantities, prices)]
+
+    def split_size(self) -> int:
+        """pairs of items cost the same in one line or in many"""
+        return 2
+
 
 class PercentDiscount(Promotion):
     """
@@ -78,6 +143,8 @@ class PercentDiscount(Promotion):
            between 0 and 100 (inclusive).
 
       """
+    __slots__ = ("_percent",)
+
     def __init__(self, name: str, percent: float):
         super().__init__(name)
         if 0 <= percent <= 100:
@@ -85,6 +152,17 @@ class PercentDiscount(Promotion):
         else:
             raise ValueError("Wrong percent discount value")
 
+    def to_config(self) -> dict:
+        """returns a json-serializable description of the promotion"""
+        config = super().to_config()
+        config["percent"] = self._percent
+        return config
+
+    @property
+    def percent(self) -> float:
+        """returns the percentage discount of the promotion"""
+        return self._percent
+
     def apply_promotion(self, quantity: int, price: float) -> float:
         """
         Applies the percentage discount to the given quantity and price.
@@ -101,6 +179,16 @@ class PercentDiscount(Promotion):
         total_price_discount = total_price * ((100 - self._percent)/100)
         return round(total_price_discount, 2)
 
+    def apply_promotion_batch(self, quantities, prices) -> list[float]:
+        """Batch version of apply_promotion, see Promotion"""
+        multiplier = (100 - self._percent)/100
+        return [round(quantity * price * multiplier, 2)
+                for quantity, price in zip(quantities, prices)]
+
+    def split_size(self) -> int:
+        """every item costs the same, whatever the line"""
+        return 1
+
 
 class ThirdOneFree(Promotion):
     """
@@ -109,6 +197,8 @@ class ThirdOneFree(Promotion):
     Attributes:
         name (str): The name of the promotion.
     """
+    __slots__ = ()
+
     def __init__(self, name):
         super().__init__(name)
 
@@ -130,3 +220,300 @@ class ThirdOneFree(Promotion):
         total_price = amount_of_products_to_pay * price
         return round(total_price, 2)
 
+    def apply_promotion_batch(self, quantities, prices) -> list[float]:
+        """Batch version of apply_promotion, see Promotion"""
+        return [round((quantity - quantity // 3) * price, 2)
+                for quantity, price in zip(quantities, prices)]
+
+    def split_size(self) -> int:
+        """groups of three items cost the same in one line or in many"""
+        return 3
+
+
+class CompositePromotion(Promotion):
+    """
+    Base class for promotions made of other promotions.
+
+    The pricing function of the composite is built once, in the
+    constructor, from the compiled functions of its parts. Pricing a line
+    is then one call of that function, instead of walking the tree of
+    promotion objects every time.
+
+    Attributes:
+        _price_function (PriceFunction): The compiled pricing function.
+    """
+    __slots__ = ("_price_function",)
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._price_function = self._build_price_function()
+
+    @abc.abstractmethod
+    def _build_price_function(self) -> PriceFunction:
+        """Returns the pricing function of the composite"""
+        pass
+
+    def apply_promotion(self, quantity: int, price: float) -> float:
+        """
+        Calculate the total price after applying the composite promotion.
+
+        Args:
+            quantity (int): The quantity of items being purchased.
+            price (float): The original price of each item.
+
+        Returns:
+            float: The total price after applying the discount.
+        """
+        return self._price_function(quantity, price)
+
+    def apply_promotion_batch(self, quantities, prices) -> list[float]:
+        """Batch version of apply_promotion, see Promotion"""
+        price_function = self._price_function
+        return [price_function(quantity, price)
+                for quantity, price in zip(quantities, prices)]
+
+    def compile(self) -> PriceFunction:
+        """returns the compiled pricing function"""
+        return self._price_function
+
+
+class ChainedPromotion(CompositePromotion):
+    """
+    Stacks promotions: they are applied one after another, in the order
+    given, so the first one has the highest priority. Every promotion gets
+    the unit price left by the ones before it, so ThirdOneFree and then
+    PercentDiscount takes the percent off the price after the free items.
+
+    Attributes:
+        _promotions (tuple[Promotion, ...]): The stacked promotions.
+    """
+    __slots__ = ("_promotions",)
+
+    def __init__(self, name: str, promotions: list[Promotion]):
+        if not promotions:
+            raise ValueError("Chained promotion needs at least one promotion")
+        self._promotions = tuple(promotions)
+        super().__init__(name)
+
+    def _build_price_function(self) -> PriceFunction:
+        first_function, *next_functions = [promotion.compile() for promotion
+                                           in self._promotions]
+        next_functions = tuple(next_functions)
+
+        def chained_price(quantity: int, price: float) -> float:
+            total_price = first_function(quantity, price)
+            if quantity:
+                for price_function in next_functions:
+                    total_price = price_function(quantity,
+                                                 total_price / quantity)
+            return total_price
+
+        return chained_price
+
+    def to_config(self) -> dict:
+        """returns a json-serializable description of the promotion"""
+        config = super().to_config()
+        config["promotions"] = [promotion.to_config()
+                                for promotion in self._promotions]
+        return config
+
+
+class BestOfPromotion(CompositePromotion):
+    """
+    Gives the customer the cheapest of the promotions.
+
+    Attributes:
+        _promotions (tuple[Promotion, ...]): The promotions to choose from.
+    """
+    __slots__ = ("_promotions",)
+
+    def __init__(self, name: str, promotions: list[Promotion]):
+        if not promotions:
+            raise ValueError("Best of promotion needs at least one promotion")
+        self._promotions = tuple(promotions)
+        super().__init__(name)
+
+    def _build_price_function(self) -> PriceFunction:
+        first_function, *next_functions = [promotion.compile() for promotion
+                                           in self._promotions]
+        next_functions = tuple(next_functions)
+
+        def best_price(quantity: int, price: float) -> float:
+            total_price = first_function(quantity, price)
+            for price_function in next_functions:
+                other_price = price_function(quantity, price)
+                if other_price < total_price:
+                    total_price = other_price
+            return total_price
+
+        return best_price
+
+    def to_config(self) -> dict:
+        """returns a json-serializable description of the promotion"""
+        config = super().to_config()
+        config["promotions"] = [promotion.to_config()
+                                for promotion in self._promotions]
+        return config
+
+    def split_size(self) -> int | None:
+        """the largest split size of the promotions, the one of the
+        cheapest promotion of a line splits it at no extra cost"""
+        split_sizes = [promotion.split_size()
+                       for promotion in self._promotions]
+        if None in split_sizes:
+            return None
+        return max(split_sizes)
+
+
+class CappedPromotion(CompositePromotion):
+    """
+    Applies a promotion to at most `max_quantity` items of a line. The
+    items above the cap are paid at the full price.
+
+    Attributes:
+        _promotion (Promotion): The capped promotion.
+        _max_quantity (int): How many items get the promotion.
+    """
+    __slots__ = ("_promotion", "_max_quantity")
+
+    def __init__(self, name: str, promotion: Promotion, max_quantity: int):
+        if max_quantity < 0:
+            raise ValueError("max quantity cannot be negative")
+        self._promotion = promotion
+        self._max_quantity = max_quantity
+        super().__init__(name)
+
+    def _build_price_function(self) -> PriceFunction:
+        price_function = self._promotion.compile()
+        max_quantity = self._max_quantity
+
+        def capped_price(quantity: int, price: float) -> float:
+            if quantity <= max_quantity:
+                return price_function(quantity, price)
+            return round(price_function(max_quantity, price) +
+                         (quantity - max_quantity) * price, 2)
+
+        return capped_price
+
+    def to_config(self) -> dict:
+        """returns a json-serializable description of the promotion"""
+        config = super().to_config()
+        config["promotion"] = self._promotion.to_config()
+        config["max_quantity"] = self._max_quantity
+        return config
+
+    def split_size(self) -> int:
+        """lines of at most max_quantity items all get the promotion"""
+        split_size = self._promotion.split_size()
+        if split_size is None:
+            return max(self._max_quantity, 1)
+        return max(min(split_size, self._max_quantity), 1)
+
+
+class ConditionalPromotion(CompositePromotion):
+    """
+    Applies a promotion only to lines of at least `min_quantity` items.
+
+    Attributes:
+        _promotion (Promotion): The promotion applied to big enough lines.
+        _min_quantity (int): The smallest quantity getting the promotion.
+    """
+    __slots__ = ("_promotion", "_min_quantity")
+
+    def __init__(self, name: str, promotion: Promotion, min_quantity: int):
+        self._promotion = promotion
+        self._min_quantity = min_quantity
+        super().__init__(name)
+
+    def _build_price_function(self) -> PriceFunction:
+        price_function = self._promotion.compile()
+        min_quantity = self._min_quantity
+
+        def conditional_price(quantity: int, price: float) -> float:
+            if quantity >= min_quantity:
+                return price_function(quantity, price)
+            return price * quantity
+
+        return conditional_price
+
+    def to_config(self) -> dict:
+        """returns a json-serializable description of the promotion"""
+        config = super().to_config()
+        config["promotion"] = self._promotion.to_config()
+        config["min_quantity"] = self._min_quantity
+        return config
+
+    def split_size(self) -> int | None:
+        """with a promotion pricing every item on its own, lines of
+        2 * min_quantity items or more split into lines that all get the
+        promotion"""
+        if self._promotion.split_size() == 1:
+            return max(2 * self._min_quantity - 1, 1)
+        return None
+
+
+# key: promotion type name, value: the promotion class, or the
+# "module:ClassName" it is imported from when it is first used
+_PROMOTION_TYPES: dict[str, type | str] = {}
+# promotions built by create_promotion, by their config
+_PROMOTION_CACHE: dict[tuple, Promotion] = {}
+
+
+def register_promotion(type_name: str, promotion_class: type | str):
+    """Makes create_promotion build promotions of the type with the class.
+    The class can be given as "module:ClassName", so its module is only
+    imported once a promotion of the type is built."""
+    _PROMOTION_TYPES[type_name] = promotion_class
+
+
+def get_promotion_class(type_name: str) -> type:
+    """Returns the class registered for the promotion type"""
+    promotion_class = _PROMOTION_TYPES.get(type_name)
+    if promotion_class is None:
+        raise ValueError(f"Unknown promotion type {type_name}")
+    if isinstance(promotion_class, str):
+        import importlib
+
+        module_name, _, class_name = promotion_class.partition(":")
+        promotion_class = getattr(importlib.import_module(module_name),
+                                  class_name)
+        _PROMOTION_TYPES[type_name] = promotion_class
+    return promotion_class
+
+
+def _config_key(config) -> tuple:
+    """Returns a hashable key equal for equal configs"""
+    if isinstance(config, dict):
+        return tuple(sorted((key, _config_key(value))
+                            for key, value in config.items()))
+    if isinstance(config, (list, tuple)):
+        return tuple(_config_key(value) for value in config)
+    return config
+
+
+def create_promotion(config: dict) -> Promotion:
+    """Returns the promotion described by a config made by to_config().
+    Promotions hold no state, so one promotion is built per distinct config,
+    with its pricing function compiled once, and shared by everyone asking
+    for it."""
+    key = _config_key(config)
+    promotion = _PROMOTION_CACHE.get(key)
+    if promotion is None:
+        arguments = dict(config)
+        promotion_class = get_promotion_class(arguments.pop("type"))
+        # composite promotions hold the configs of their parts
+        if "promotion" in arguments:
+            arguments["promotion"] = create_promotion(arguments["promotion"])
+        if "promotions" in arguments:
+            arguments["promotions"] = [create_promotion(part_config)
+                                       for part_config
+                                       in arguments["promotions"]]
+        promotion = _PROMOTION_CACHE[key] = promotion_class(**arguments)
+    return promotion
+
+
+for _promotion_class in (SecondHalfPrice, PercentDiscount, ThirdOneFree,
+                         ChainedPromotion, BestOfPromotion, CappedPromotion,
+                         ConditionalPromotion):
+    register_promotion(_promotion_class.__name__, _promotion_class)
+del _promotion_class
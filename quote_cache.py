@@ -0,0 +1,123 @@
+import collections
+import threading
+import time
+
+from products import Product
+
+
+class QuoteCache:
+    """
+    Bounded LRU cache of product prices for a quantity.
+
+    Entries are keyed on the product, the quantity, and the price and
+    promotion the quote was made with, so a quote is never reused after
+    they change. invalidate() also drops the entries of a product as soon
+    as its price or promotion changes, so they don't take up room until
+    they are evicted. The keys of a product are grouped by price and
+    promotion, so invalidate() only looks at the groups, and costs O(1)
+    after a change of anything else, like the stock of the product.
+
+    Attributes:
+        _max_size (int): How many quotes are kept before the least
+            recently used one is evicted.
+        _ttl (float | None): Seconds a quote stays valid, None for no limit.
+    """
+    def __init__(self, max_size: int = 100_000, ttl: float | None = None):
+        if max_size < 1:
+            raise ValueError("max size must be at least 1")
+        if ttl is not None and ttl <= 0:
+            raise ValueError("ttl must be positive")
+
+        self._max_size = max_size
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        # key: (product, quantity, price, promotion), value: (quote, expiry)
+        self._quotes: collections.OrderedDict = collections.OrderedDict()
+        # key: product, value: dict with (price, promotion) as key and the
+        # keys of the quotes made with them as value
+        self._keys_by_product: dict[Product, dict[tuple, set]] = {}
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def __len__(self):
+        return len(self._quotes)
+
+    def get_total_price(self, product: Product, quantity: int) -> float:
+        """Returns the price of a quantity of the product, from the cache
+        when possible"""
+        key = (product, quantity, product.price, product.promotion)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._quotes.get(key)
+            if entry is not None:
+                quote, expiry = entry
+                if expiry is None or expiry > now:
+                    self._quotes.move_to_end(key)
+                    self._hits += 1
+                    return quote
+                self._remove(key)
+            self._misses += 1
+
+        quote = product.get_total_price(quantity)
+        expiry = None if self._ttl is None else now + self._ttl
+        with self._lock:
+            self._quotes[key] = (quote, expiry)
+            self._keys_by_product.setdefault(product, {}).setdefault(
+                key[2:], set()).add(key)
+            while len(self._quotes) > self._max_size:
+                self._remove(next(iter(self._quotes)))
+                self._evictions += 1
+        return quote
+
+    def _remove(self, key: tuple):
+        """Removes a cached quote. The lock must be held."""
+        del self._quotes[key]
+        product_groups = self._keys_by_product[key[0]]
+        group_keys = product_groups[key[2:]]
+        group_keys.discard(key)
+        if not group_keys:
+            del product_groups[key[2:]]
+            if not product_groups:
+                del self._keys_by_product[key[0]]
+
+    def invalidate(self, product: Product):
+        """Drops the cached quotes of the product that were made with
+        another price or promotion than the current ones"""
+        with self._lock:
+            product_groups = self._keys_by_product.get(product)
+            if not product_groups:
+                return
+            price, promotion = product.price, product.promotion
+            stale_keys = [key for (group_price, group_promotion), group_keys
+                          in product_groups.items()
+                          if group_price != price
+                          or group_promotion is not promotion
+                          for key in group_keys]
+            for key in stale_keys:
+                self._remove(key)
+            self._invalidations += len(stale_keys)
+
+    def discard(self, product: Product):
+        """Drops every cached quote of the product"""
+        with self._lock:
+            for group_keys in list(self._keys_by_product.get(product,
+                                                             {}).values()):
+                for key in list(group_keys):
+                    self._remove(key)
+
+    def clear(self):
+        """Drops every cached quote"""
+        with self._lock:
+            self._quotes.clear()
+            self._keys_by_product.clear()
+
+    def stats(self) -> dict[str, int]:
+        """Returns the hits, misses, evictions and invalidations so far and
+        the current size of the cache"""
+        with self._lock:
+            return {"hits": self._hits, "misses": self._misses,
+                    "evictions": self._evictions,
+                    "invalidations": self._invalidations,
+                    "size": len(self._quotes)}
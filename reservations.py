@@ -0,0 +1,122 @@
+import itertools
+import threading
+import time
+
+from products import Product
+from timer_wheel import TimerWheel
+
+
+class Reservations:
+    """
+    Items of products held for orders that are not made yet.
+
+    Every hold has a time to live. Holds are kept in a timer wheel, so
+    expire() drops the expired ones in O(1) each, without scanning the
+    holds that are still live. expire() is called by the store before it
+    reads the holds, so expired items are available again without a
+    background thread.
+
+    Attributes:
+        _clock: Function returning the current time in seconds.
+    """
+    def __init__(self, tick: float = 0.01, clock=time.monotonic):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._wheel = TimerWheel(tick, start=clock())
+        # key: reservation id, value: (product, quantity, timer handle)
+        self._holds: dict[int, tuple[Product, int, int]] = {}
+        # key: product, value: how many of its items are held
+        self._held: dict[Product, int] = {}
+        # key: product, value: ids of its reservations
+        self._ids_by_product: dict[Product, set[int]] = {}
+        self._ids = itertools.count(1)
+
+    def __len__(self):
+        return len(self._holds)
+
+    def held(self, product: Product) -> int:
+        """Returns how many items of the product are held"""
+        return self._held.get(product, 0)
+
+    def add(self, product: Product, quantity: int, ttl: float) -> int:
+        """Holds the items for `ttl` seconds, and returns the id of the
+        reservation"""
+        if quantity <= 0:
+            raise ValueError("Quantity to reserve must be positive")
+        if ttl <= 0:
+            raise ValueError("ttl must be positive")
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            reservation_id = next(self._ids)
+            handle = self._wheel.schedule(now + ttl, reservation_id)
+            self._holds[reservation_id] = (product, quantity, handle)
+            self._held[product] = self._held.get(product, 0) + quantity
+            self._ids_by_product.setdefault(product, set()).add(
+                reservation_id)
+        return reservation_id
+
+    def get_product(self, reservation_id: int) -> Product:
+        """Returns the product of the reservation. Raises ValueError if it
+        doesn't exist, or expired."""
+        with self._lock:
+            self._expire(self._clock())
+            hold = self._holds.get(reservation_id)
+        if hold is None:
+            raise ValueError(f"Reservation {reservation_id} does not "
+                             f"exist or expired")
+        return hold[0]
+
+    def pop(self, reservation_id: int) -> tuple[Product, int]:
+        """Drops the reservation and returns its product and quantity.
+        Raises ValueError if it doesn't exist, or expired."""
+        with self._lock:
+            self._expire(self._clock())
+            hold = self._holds.pop(reservation_id, None)
+            if hold is None:
+                raise ValueError(f"Reservation {reservation_id} does not "
+                                 f"exist or expired")
+            product, quantity, handle = hold
+            self._wheel.cancel(handle)
+            self._release(reservation_id, product, quantity)
+        return product, quantity
+
+    def discard_product(self, product: Product) -> int:
+        """Drops all the reservations of the product, and returns how many
+        there were"""
+        with self._lock:
+            reservation_ids = tuple(self._ids_by_product.get(product, ()))
+            for reservation_id in reservation_ids:
+                _, quantity, handle = self._holds.pop(reservation_id)
+                self._wheel.cancel(handle)
+                self._release(reservation_id, product, quantity)
+            return len(reservation_ids)
+
+    def _release(self, reservation_id: int, product: Product,
+                 quantity: int):
+        """Removes a dropped reservation from the held count. The lock must
+        be held."""
+        held = self._held[product] - quantity
+        reservation_ids = self._ids_by_product[product]
+        reservation_ids.discard(reservation_id)
+        if held:
+            self._held[product] = held
+        else:
+            del self._held[product]
+            del self._ids_by_product[product]
+
+    def expire(self) -> int:
+        """Drops the expired reservations, and returns how many there
+        were"""
+        if not self._holds:
+            return 0
+        with self._lock:
+            return self._expire(self._clock())
+
+    def _expire(self, now: float) -> int:
+        """expire() at the time `now`. The lock must be held."""
+        expired = self._wheel.advance(now)
+        for reservation_id in expired:
+            product, quantity, _ = self._holds.pop(reservation_id)
+            self._release(reservation_id, product, quantity)
+        return len(expired)
@@ -0,0 +1,134 @@
+import bisect
+import heapq
+import itertools
+import re
+
+from products import Product
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    """Returns the lowercase words of the text"""
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+class SearchIndex:
+    """
+    Full-text and prefix search over product names.
+
+    An inverted index maps every word to the products whose name has it.
+    The words themselves are kept in a sorted list, so all the words
+    starting with a prefix are one bisect away, which serves autocomplete
+    the same way a prefix trie would with far fewer objects. add()
+    inserts into that list, which is O(n), so many products are indexed
+    at once with add_many(), which sorts the new words in once.
+    """
+    def __init__(self):
+        self._products_by_token: dict[str, dict[Product, None]] = {}
+        self._sorted_tokens: list[str] = []
+        self._tokens_by_product: dict[Product, tuple[str, ...]] = {}
+        # order the products were indexed in, used to break ranking ties
+        self._sequence_by_product: dict[Product, int] = {}
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return len(self._tokens_by_product)
+
+    def add(self, product: Product):
+        """Indexes the name of the product"""
+        for token in self._index(product):
+            bisect.insort(self._sorted_tokens, token)
+
+    def add_many(self, products: list[Product]):
+        """Indexes the names of the products, like add() for each of them,
+        in O(n log n) for the whole index"""
+        new_tokens = [token for product in products
+                      for token in self._index(product)]
+        if new_tokens:
+            self._sorted_tokens += new_tokens
+            self._sorted_tokens.sort()
+
+    def _index(self, product: Product) -> list[str]:
+        """Adds the product to the inverted index, and returns the words
+        of its name that were not indexed yet, which are left for the
+        caller to add to the sorted words"""
+        if product in self._tokens_by_product:
+            return []
+        tokens = tuple(dict.fromkeys(tokenize(product.name)))
+        self._tokens_by_product[product] = tokens
+        self._sequence_by_product[product] = next(self._sequence)
+        new_tokens = []
+        for token in tokens:
+            token_products = self._products_by_token.get(token)
+            if token_products is None:
+                token_products = self._products_by_token[token] = {}
+                new_tokens.append(token)
+            token_products[product] = None
+        return new_tokens
+
+    def remove(self, product: Product):
+        """Removes the product from the index, if it is there"""
+        tokens = self._tokens_by_product.pop(product, ())
+        self._sequence_by_product.pop(product, None)
+        for token in tokens:
+            token_products = self._products_by_token[token]
+            del token_products[product]
+            if not token_products:
+                del self._products_by_token[token]
+                index = bisect.bisect_left(self._sorted_tokens, token)
+                del self._sorted_tokens[index]
+
+    def _tokens_with_prefix(self, prefix: str) -> list[str]:
+        """Returns the indexed words starting with the prefix"""
+        start = bisect.bisect_left(self._sorted_tokens, prefix)
+        end = bisect.bisect_left(self._sorted_tokens, prefix + "\U0010ffff")
+        return self._sorted_tokens[start:end]
+
+    def search(self, query: str, limit: int = 10) -> list[Product]:
+        """
+        Returns up to `limit` products matching the query, best first.
+
+        Every word of the query matches the same word in a name, and the
+        last word also matches as a prefix, so results show up while the
+        user is typing. Products matching more words rank higher, exact
+        word matches rank above prefix matches, and ties keep the order
+        the products were indexed in.
+        """
+        tokens = tokenize(query)
+        if not tokens or limit <= 0:
+            return []
+
+        # key: product, value: [matched words, exact matches]
+        scores: dict[Product, list[int]] = {}
+        for position, token in enumerate(tokens):
+            is_last = position == len(tokens) - 1
+            matched_tokens = self._tokens_with_prefix(token) if is_last \
+                else [token]
+            matched_products: dict[Product, bool] = {}
+            for matched_token in matched_tokens:
+                for product in self._products_by_token.get(matched_token, ()):
+                    exact = matched_token == token
+                    matched_products[product] = \
+                        matched_products.get(product, False) or exact
+            for product, exact in matched_products.items():
+                score = scores.setdefault(product, [0, 0])
+                score[0] += 1
+                score[1] += exact
+
+        sequence = self._sequence_by_product
+        return heapq.nsmallest(limit, scores,
+                               key=lambda product: (-scores[product][0],
+                                                    -scores[product][1],
+                                                    sequence[product]))
+
+    def autocomplete(self, prefix: str, limit: int = 10) -> list[str]:
+        """Returns up to `limit` indexed words starting with the last word
+        of the prefix, in alphabetical order"""
+        tokens = tokenize(prefix)
+        if not tokens or limit <= 0:
+            return []
+        start = bisect.bisect_left(self._sorted_tokens, tokens[-1])
+        completions = self._sorted_tokens[start:start + limit]
+        return [token for token in completions
+                if token.startswith(tokens[-1])]
@@ -0,0 +1,337 @@
+import itertools
+import multiprocessing
+import os
+import threading
+import zlib
+
+import catalog
+from products import Product
+from store import Store
+
+# seconds a prepared order holds its stock. A prepared order is committed
+# or aborted right away, so this only frees the stock held for a
+# coordinator that stopped in between.
+PREPARE_TTL = 60.0
+
+
+def _resolve(shard_store: Store, lines: list[tuple[str, int]]) \
+        -> list[tuple[Product, int]]:
+    """Returns the shopping list with the product names replaced by the
+    products of the shard"""
+    shopping_list = []
+    for name, quantity in lines:
+        product = shard_store.get_product(name)
+        if product is None:
+            raise ValueError(f"Product {name} is not in the store")
+        shopping_list.append((product, quantity))
+    return shopping_list
+
+
+def _reply_of(error: Exception) -> tuple[str, str]:
+    """Returns the reply reporting the error: ("error", message) for a
+    rejected request, ("failure", message) for any other error"""
+    if isinstance(error, ValueError):
+        return "error", str(error)
+    return "failure", f"{type(error).__name__}: {error}"
+
+
+def _run_shard(connection, product_configs: list[dict]):
+    """Main loop of a shard process. Every request is a tuple
+    (command, *arguments), answered with ("ok", result), ("error",
+    message) when it was rejected, or ("failure", message) when it raised
+    any other error. Errors never stop the loop."""
+    shard_store = Store([catalog.product_from_config(config)
+                         for config in product_configs])
+    # key: transaction id, value: ids of the reservations holding the
+    # stock of the prepared order
+    prepared: dict[int, list[int]] = {}
+
+    while True:
+        command, *arguments = connection.recv()
+        if command == "close":
+            connection.close()
+            return
+        try:
+            if command == "order":
+                result = shard_store.order(_resolve(shard_store,
+                                                    arguments[0]))
+            elif command == "order_many":
+                # a reply for every order, so one failing order doesn't
+                # lose the results of the others
+                result = []
+                for lines in arguments[0]:
+                    try:
+                        result.append(("ok", shard_store.order(
+                            _resolve(shard_store, lines))))
+                    except Exception as e:
+                        result.append(_reply_of(e))
+            elif command == "prepare":
+                transaction_id, lines = arguments
+                quantities: dict[Product, int] = {}
+                for product, quantity in _resolve(shard_store, lines):
+                    if quantity <= 0:
+                        raise ValueError("Quantity to buy must be positive")
+                    quantities[product] = quantities.get(product, 0) + \
+                        quantity
+                # the stock is only checked and held: nothing is bought
+                # before the commit, so an aborted order never makes other
+                # orders see less stock than there is
+                reservation_ids = []
+                try:
+                    for product, quantity in quantities.items():
+                        reservation_ids.append(shard_store.reserve(
+                            product, quantity, PREPARE_TTL))
+                except Exception:
+                    for reservation_id in reservation_ids:
+                        shard_store.release(reservation_id)
+                    raise
+                prepared[transaction_id] = reservation_ids
+                result = None
+            elif command == "commit":
+                result = sum(shard_store.confirm(reservation_id)
+                             for reservation_id
+                             in prepared.pop(arguments[0]))
+            elif command == "abort":
+                for reservation_id in prepared.pop(arguments[0]):
+                    try:
+                        shard_store.release(reservation_id)
+                    except ValueError:
+                        # the hold already expired
+                        pass
+                result = None
+            elif command == "total_quantity":
+                result = shard_store.get_total_quantity()
+            elif command == "all_products":
+                result = [catalog.product_to_config(product)
+                          for product in shard_store.get_all_products()]
+            else:
+                raise ValueError(f"Unknown command {command}")
+        except Exception as e:
+            connection.send(_reply_of(e))
+        else:
+            connection.send(("ok", result))
+
+
+class ShardedStore:
+    """
+    Store split across worker processes, to use more than one core.
+
+    Every product lives in one shard, chosen by a hash of its name. Order
+    lines name the product they buy and are sent to its shard. An order
+    with products in several shards is made with a two-phase commit: every
+    shard checks its part of the order and holds its stock with a
+    reservation, then the parts are all bought, or all released if one
+    failed. Held items can't be bought by other orders, but nothing is
+    bought before the commit.
+
+    Attributes:
+        _connections (list): Pipe to every shard process.
+    """
+    def __init__(self, store_products: list[Product],
+                 shard_count: int | None = None):
+        shard_count = shard_count or os.cpu_count() or 1
+        if shard_count < 1:
+            raise ValueError("shard count must be at least 1")
+
+        product_configs = [[] for _ in range(shard_count)]
+        self._shard_count = shard_count
+        for product in store_products:
+            product_configs[self.shard_of(product.name)].append(
+                catalog.product_to_config(product))
+
+        self._connections = []
+        self._processes = []
+        # one request at a time on every pipe
+        self._locks = [threading.Lock() for _ in range(shard_count)]
+        self._transaction_ids = itertools.count()
+        for shard_configs in product_configs:
+            connection, child_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_run_shard, args=(child_connection, shard_configs),
+                daemon=True)
+            process.start()
+            child_connection.close()
+            self._connections.append(connection)
+            self._processes.append(process)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def shard_of(self, name: str) -> int:
+        """Returns the shard of the product with the given name"""
+        return zlib.crc32(name.encode("utf-8")) % self._shard_count
+
+    def _request_all(self, requests: dict[int, tuple]) -> dict[int, tuple]:
+        """Sends a request to every shard in `requests` and returns their
+        replies. The requests are sent before any reply is read, so the
+        shards work in parallel. A shard that is not running anymore gets
+        a ("failure", message) reply, and every other shard is still
+        answered, so no reply is left unread on a pipe."""
+        shards = sorted(requests)
+        # locks are taken in shard order, so concurrent callers can't
+        # deadlock
+        for shard in shards:
+            self._locks[shard].acquire()
+        try:
+            replies = {}
+            sent = []
+            for shard in shards:
+                try:
+                    self._connections[shard].send(requests[shard])
+                    sent.append(shard)
+                except OSError:
+                    replies[shard] = ("failure",
+                                      f"Shard {shard} is not running")
+            for shard in sent:
+                try:
+                    replies[shard] = self._connections[shard].recv()
+                except (EOFError, OSError):
+                    replies[shard] = ("failure",
+                                      f"Shard {shard} is not running")
+            return replies
+        finally:
+            for shard in shards:
+                self._locks[shard].release()
+
+    @staticmethod
+    def _outcome(reply: tuple):
+        """Returns the result of a reply, or the error it reports:
+        ValueError for a rejected request, RuntimeError for a failure"""
+        status, result = reply
+        if status == "error":
+            return ValueError(result)
+        if status == "failure":
+            return RuntimeError(result)
+        return result
+
+    @classmethod
+    def _result(cls, reply: tuple):
+        """Returns the result of a reply, raises the error it reports"""
+        outcome = cls._outcome(reply)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def _split_by_shard(self,
+                        shopping_list: list[tuple[Product | str, int]]) \
+            -> dict[int, list[tuple[str, int]]]:
+        """Returns the lines of the shopping list, by shard, with products
+        replaced by their names"""
+        lines_by_shard: dict[int, list[tuple[str, int]]] = {}
+        for product, quantity in shopping_list:
+            name = product if isinstance(product, str) else product.name
+            lines_by_shard.setdefault(self.shard_of(name), []).append(
+                (name, quantity))
+        return lines_by_shard
+
+    def order(self, shopping_list: list[tuple[Product | str, int]]) -> float:
+        """Buys the products and returns the total price of the order.
+        Products are given as Product or by name. The order is
+        all-or-nothing, across shards too: if any line cannot be bought,
+        ValueError is raised and no stock is changed. Any other error in a
+        shard, or a shard that stopped, raises RuntimeError, and the other
+        shards are rolled back too."""
+        lines_by_shard = self._split_by_shard(shopping_list)
+        if len(lines_by_shard) <= 1:
+            for shard, lines in lines_by_shard.items():
+                return self._result(self._request_all(
+                    {shard: ("order", lines)})[shard])
+            return 0
+
+        transaction_id = next(self._transaction_ids)
+        replies = self._request_all({
+            shard: ("prepare", transaction_id, lines)
+            for shard, lines in lines_by_shard.items()})
+        prepared = [shard for shard, (status, _) in replies.items()
+                    if status == "ok"]
+        errors = [self._outcome(reply) for reply in replies.values()
+                  if reply[0] != "ok"]
+
+        # every shard that prepared is aborted when any other one did not
+        # reply ok, whether it rejected the order, failed or stopped
+        if errors:
+            self._request_all({shard: ("abort", transaction_id)
+                               for shard in prepared})
+            raise errors[0]
+        replies = self._request_all({shard: ("commit", transaction_id)
+                                     for shard in prepared})
+        return sum(self._result(reply) for reply in replies.values())
+
+    def order_many(self, shopping_lists: list[list[tuple[Product | str,
+                                                          int]]]) \
+            -> list[float | Exception]:
+        """Makes many orders in one call, like Store.order_many, with the
+        same result: orders get their stock in the order they are given.
+        Runs of orders within one shard are sent to it in one batch, and
+        all the shards work on their batches at the same time. An order
+        failing with another error than ValueError gets the RuntimeError of
+        order() in the results, instead of stopping the others."""
+        results: list[float | Exception | None] = \
+            [None] * len(shopping_lists)
+        batches: dict[int, list] = {}
+        batch_indexes: dict[int, list[int]] = {}
+        for index, shopping_list in enumerate(shopping_lists):
+            lines_by_shard = self._split_by_shard(shopping_list)
+            if len(lines_by_shard) == 1:
+                (shard, lines), = lines_by_shard.items()
+                batches.setdefault(shard, []).append(lines)
+                batch_indexes.setdefault(shard, []).append(index)
+            elif not lines_by_shard:
+                results[index] = 0
+            else:
+                # the orders before it are made first, so it competes for
+                # stock with them in the same order as in Store.order_many
+                self._order_batches(batches, batch_indexes, results)
+                batches, batch_indexes = {}, {}
+                try:
+                    results[index] = self.order(shopping_list)
+                except (ValueError, RuntimeError) as e:
+                    results[index] = e
+        self._order_batches(batches, batch_indexes, results)
+        return results
+
+    def _order_batches(self, batches: dict[int, list],
+                       batch_indexes: dict[int, list[int]], results: list):
+        """Sends every shard its batch of orders, and puts the result of
+        every order at its index in `results`"""
+        replies = self._request_all({shard: ("order_many", batch)
+                                     for shard, batch in batches.items()})
+        for shard, reply in replies.items():
+            outcome = self._outcome(reply)
+            order_replies = [reply] * len(batch_indexes[shard]) \
+                if isinstance(outcome, Exception) else outcome
+            for index, order_reply in zip(batch_indexes[shard],
+                                          order_replies):
+                results[index] = self._outcome(order_reply)
+
+    def get_total_quantity(self) -> int:
+        """Returns how many items are in all the shards in total"""
+        replies = self._request_all({shard: ("total_quantity",)
+                                     for shard in range(self._shard_count)})
+        return sum(self._result(reply) for reply in replies.values())
+
+    def get_all_products(self) -> list[Product]:
+        """Returns copies of the active products of all the shards"""
+        replies = self._request_all({shard: ("all_products",)
+                                     for shard in range(self._shard_count)})
+        return [catalog.product_from_config(config)
+                for shard in sorted(replies)
+                for config in self._result(replies[shard])]
+
+    def close(self):
+        """Stops the shard processes"""
+        for shard, connection in enumerate(self._connections):
+            with self._locks[shard]:
+                try:
+                    connection.send(("close",))
+                except OSError:
+                    # the shard already stopped
+                    pass
+                connection.close()
+        for process in self._processes:
+            process.join()
+        self._connections = []
+        self._processes = []
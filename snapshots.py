@@ -0,0 +1,152 @@
+import collections
+
+from products import Product
+
+# products per page of VersionedState, a power of two
+PAGE_BITS = 10
+PAGE_SIZE = 1 << PAGE_BITS
+
+# state of a product in a snapshot. collections.namedtuple rather than
+# typing.NamedTuple: the store imports this module at startup, and typing
+# is slow to import.
+ProductState = collections.namedtuple(
+    "ProductState", ("product", "price", "quantity", "active", "promotion"))
+
+
+class VersionedState:
+    """
+    States of the products of a store, copied on write for snapshots.
+
+    States are kept in pages of PAGE_SIZE products. share() hands the
+    current pages to a snapshot in O(1) and marks them shared. The first
+    write after that copies the list of pages, and every page is copied
+    the first time it is written, so a snapshot never sees a later change
+    and writers never wait for readers. Versions no snapshot refers to
+    anymore are freed like any other object.
+
+    Attributes:
+        version (int): Number of writes so far.
+    """
+    def __init__(self):
+        self._pages: list[list] = []
+        # key: product, value: its slot in the pages. Slots of removed
+        # products are not reused.
+        self._slots: dict[Product, int] = {}
+        self._slot_count = 0
+        # pages and slots are referenced by a snapshot
+        self._pages_shared = False
+        self._slots_shared = False
+        # pages copied since the last share()
+        self._owned_pages: set[int] = set()
+        self.version = 0
+
+    def set(self, product: Product, state: tuple | None):
+        """Sets the state of the product, a ProductState-like tuple, or
+        removes the product when the state is None"""
+        slot = self._slots.get(product)
+        # most writes update a product on a page that was already copied
+        if slot is not None and state is not None and \
+                not self._pages_shared:
+            page_index = slot >> PAGE_BITS
+            if page_index in self._owned_pages:
+                self._pages[page_index][slot & (PAGE_SIZE - 1)] = state
+                self.version += 1
+                return
+
+        if slot is None:
+            if state is None:
+                return
+            if self._slots_shared:
+                self._slots = dict(self._slots)
+                self._slots_shared = False
+            slot = self._slots[product] = self._slot_count
+            self._slot_count += 1
+        elif state is None:
+            if self._slots_shared:
+                self._slots = dict(self._slots)
+                self._slots_shared = False
+            del self._slots[product]
+
+        if self._pages_shared:
+            self._pages = list(self._pages)
+            self._owned_pages = set()
+            self._pages_shared = False
+        page_index, offset = slot >> PAGE_BITS, slot & (PAGE_SIZE - 1)
+        if page_index == len(self._pages):
+            self._pages.append([None] * PAGE_SIZE)
+            self._owned_pages.add(page_index)
+        elif page_index not in self._owned_pages:
+            self._pages[page_index] = list(self._pages[page_index])
+            self._owned_pages.add(page_index)
+        self._pages[page_index][offset] = state
+        self.version += 1
+
+    def share(self) -> tuple[list[list], dict[Product, int], int]:
+        """Returns the current pages, slots and version, which are not
+        changed anymore"""
+        self._pages_shared = True
+        self._slots_shared = True
+        return self._pages, self._slots, self.version
+
+
+class StoreSnapshot:
+    """
+    Read-only view of the products of a store at one moment.
+
+    Reading a snapshot takes no lock: it is never changed, and it sees
+    none of the changes made after it was taken. Every product, and the
+    totals, are consistent with each other, and an order buying several
+    products is seen either made in full or not at all.
+
+    Attributes:
+        version (int): Number of changes made to the store before the
+            snapshot was taken.
+    """
+    def __init__(self, pages: list[list], slots: dict[Product, int],
+                 version: int, total_quantity: int,
+                 quantity_by_class: dict[type, int], active_count: int):
+        self._pages = pages
+        self._slots = slots
+        self.version = version
+        self._total_quantity = total_quantity
+        self._quantity_by_class = quantity_by_class
+        self._active_count = active_count
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __iter__(self):
+        """Iterates over the states of all the products, active or not, in
+        the order they were added to the store"""
+        make = ProductState._make
+        for page in self._pages:
+            for state in page:
+                if state is not None:
+                    yield make(state)
+
+    def get(self, product: Product) -> ProductState | None:
+        """Returns the state of the product, None if it was not in the
+        store"""
+        slot = self._slots.get(product)
+        if slot is None:
+            return None
+        page_index, offset = divmod(slot, PAGE_SIZE)
+        return ProductState._make(self._pages[page_index][offset])
+
+    def get_all_products(self) -> list[ProductState]:
+        """Returns the states of the active products"""
+        return [state for state in self if state.active]
+
+    def get_total_quantity(self) -> int:
+        """Returns how many items were in the store in total"""
+        return self._total_quantity
+
+    def get_active_count(self) -> int:
+        """Returns how many products were active"""
+        return self._active_count
+
+    def get_quantity_by_class(self) -> dict[type, int]:
+        """Returns how many items were in the store for every product
+        class"""
+        return {product_class: quantity for product_class, quantity
+                in self._quantity_by_class.items() if quantity}
@@ -1,48 +1,643 @@
-from products import Product
+import contextlib
+import math
+import threading
+import time
+
+import metrics
+from price_index import PriceIndex
+from products import NonStockedProduct, Product
+from quote_cache import QuoteCache
+from reservations import Reservations
+from search import SearchIndex
+from snapshots import StoreSnapshot, VersionedState
 
 
 class Store:
     """This class represents a store with a list of products."""
-    def __init__(self, store_products: list[Product]):
-        self._products = store_products
+    def __init__(self, store_products: list[Product], debug: bool = False,
+                 quote_cache: QuoteCache | None = None,
+                 reservations: Reservations | None = None):
+        """
+        :param store_products: products the store starts with.
+        :param debug: when True, every read of the running totals is
+            checked against a full recount of the products.
+        :param quote_cache: cache used by quote(), a new QuoteCache with
+            the default size when not given.
+        :param reservations: holds made by reserve(), a new Reservations
+            when not given.
+        """
+        self._debug = debug
+        # guards the indexes and totals below. Orders lock the products
+        # they buy, and only take this lock for the short index updates.
+        self._lock = threading.RLock()
+        # products changed by the order the thread is making, synced when
+        # its buys are done, see _order()
+        self._order_changes = threading.local()
+        # dicts are used as insertion-ordered sets for O(1) lookups
+        self._products: dict[Product, None] = {}
+        self._products_by_name: dict[str, Product] = {}
+        self._active_products: dict[Product, None] = {}
+        # cached result of get_all_products, in the order of _products,
+        # None when it has to be rebuilt
+        self._active_view: tuple[Product, ...] | None = None
+
+        # running stock totals, updated whenever a product reports a change
+        self._quantities: dict[Product, int] = {}
+        self._total_quantity = 0
+        self._quantity_by_class: dict[type, int] = {}
+
+        # active products sorted by price
+        self._price_index = PriceIndex()
+        # product names, for search and autocomplete
+        self._search_index = SearchIndex()
+        self._quote_cache = QuoteCache() if quote_cache is None \
+            else quote_cache
+        # states of the products, for snapshot()
+        self._state = VersionedState()
+        self._reservations = Reservations() if reservations is None \
+            else reservations
+        # show() string of every product listed since it last changed
+        self._rendered: dict[Product, str] = {}
+
+        # callbacks called with ("add" | "remove" | "change", product)
+        self._listeners: list = []
+        # number of calls of a listener that raised
+        self.listener_errors = 0
+        # callbacks called after every order, once its locks are released
+        self._order_hooks: list = []
+
+        self.add_products(store_products)
+
+    @classmethod
+    def load(cls, path: str) -> "Store":
+        """Returns a store with the products of a snapshot written by
+        save(). The snapshot is memory-mapped, but every product is built
+        here, since the indexes and totals of the store need all of them,
+        so loading a store takes time proportional to the number of
+        products, a few seconds for 100k of them. Startup stays flat only
+        for code reading the snapshot with catalog.Catalog.load(), which
+        builds a product on first access to its row."""
+        # snapshots are imported on first use, so processes that never
+        # load or save one start faster
+        import catalog
+
+        return cls(catalog.Catalog.load(path).products())
+
+    def save(self, path: str):
+        """Writes all products of the store to a binary snapshot file. The
+        products are read from a snapshot(), so orders are not held up
+        while the file is written."""
+        import catalog
+
+        catalog.Catalog.from_states(self.snapshot()).save(path)
 
     def __contains__(self, item):
         return item in self._products
 
+    def __len__(self):
+        return len(self._products)
+
+    def __iter__(self):
+        """Iterates over all products of the store, active or not"""
+        with self._lock:
+            return iter(tuple(self._products))
+
     def add_product(self, product: Product):
-        """Adding product to the list of products in the store"""
-        self._products.append(product)
+        """Adding product to the list of products in the store. Raises
+        ValueError if another product of the store has the same name."""
+        with self._lock:
+            if product in self._products:
+                return
+            if product.name in self._products_by_name:
+                raise ValueError(f"Product {product.name} is already in "
+                                 f"the store")
+
+            self._products[product] = None
+            self._products_by_name[product.name] = product
+            product._observers.append(self._product_changed)
+            self._search_index.add(product)
+            self._sync_product(product)
+            self._notify_listeners("add", product)
+
+    def add_products(self, new_products: list[Product]):
+        """Adds many products, like add_product() for each of them, but
+        builds the price and search indexes once for all of them, so adding
+        n products takes O(n log n) instead of O(n²). Raises ValueError,
+        and adds none of them, if two products have the same name."""
+        with self._lock:
+            new_products = [product for product in dict.fromkeys(new_products)
+                            if product not in self._products]
+            names = set(self._products_by_name)
+            for product in new_products:
+                if product.name in names:
+                    raise ValueError(f"Product {product.name} is already in "
+                                     f"the store")
+                names.add(product.name)
+
+            # add_product() finds the products already indexed
+            self._search_index.add_many(new_products)
+            self._price_index.update_many(
+                [(product, product.price) for product in new_products
+                 if product.is_active()])
+            for product in new_products:
+                self.add_product(product)
 
     def remove_product(self, product):
         """Removes a product from store"""
-        try:
-            self._products.remove(product)
-        except ValueError:
-            pass
+        with self._lock:
+            if product not in self._products:
+                return
+
+            del self._products[product]
+            if self._products_by_name.get(product.name) is product:
+                del self._products_by_name[product.name]
+            product._observers.remove(self._product_changed)
+            if self._active_products.pop(product, False) is None:
+                self._active_view = None
+            self._update_quantity(product, 0)
+            del self._quantities[product]
+            self._price_index.discard(product)
+            self._search_index.remove(product)
+            self._quote_cache.discard(product)
+            self._rendered.pop(product, None)
+            self._state.set(product, None)
+            # holds don't outlive the product, so they don't count against
+            # it if it is added back
+            self._reservations.discard_product(product)
+            self._notify_listeners("remove", product)
+
+    def add_listener(self, listener):
+        """Registers a callback called with ("add", product),
+        ("remove", product) or ("change", product) whenever a product is
+        added, removed or changes its state. Callbacks are called in the
+        order the changes were made."""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """Unregisters a callback registered with add_listener"""
+        with self._lock:
+            self._listeners.remove(listener)
+
+    def add_order_hook(self, hook):
+        """Registers a callback called with no arguments after every order
+        that was made, in the thread that made it, once the order released
+        its locks. order() returns after the hooks, and raises their
+        errors: a journal uses it to make orders wait until their records
+        are on disk. order_many() calls the hooks once, after all its
+        orders."""
+        with self._lock:
+            self._order_hooks.append(hook)
+
+    def remove_order_hook(self, hook):
+        """Unregisters a callback registered with add_order_hook"""
+        with self._lock:
+            self._order_hooks.remove(hook)
+
+    def _notify_listeners(self, event: str, product: Product):
+        """Calls every listener with the event. The change is already made,
+        and an order may be half way through its buys, so an error raised
+        by a listener is logged and counted in listener_errors instead of
+        stopping it."""
+        for listener in self._listeners:
+            try:
+                listener(event, product)
+            except Exception:
+                # logging is imported on first use, it is slow to import
+                import logging
+
+                self.listener_errors += 1
+                logging.getLogger(__name__).exception(
+                    "Store listener %r failed on %s of %s", listener, event,
+                    product.name)
+
+    def get_product(self, name: str) -> Product | None:
+        """Returns the product with the given name, or None if the store
+        has no such product"""
+        return self._products_by_name.get(name)
+
+    def _update_quantity(self, product: Product, quantity: int):
+        """Applies the change in quantity of a product to the totals"""
+        delta = quantity - self._quantities.get(product, 0)
+        self._quantities[product] = quantity
+        if delta:
+            product_class = type(product)
+            self._total_quantity += delta
+            self._quantity_by_class[product_class] = \
+                self._quantity_by_class.get(product_class, 0) + delta
+
+    def _sync_product(self, product: Product):
+        """Keeps the set of active products, the stock totals and the
+        product states in sync with the product"""
+        quantity, price = product.quantity, product.price
+        active = product.is_active()
+        self._update_quantity(product, quantity)
+        if active:
+            if product not in self._active_products:
+                self._active_products[product] = None
+                self._active_view = None
+        elif product in self._active_products:
+            del self._active_products[product]
+            self._active_view = None
+        self._price_index.update(product, price if active else None)
+        self._quote_cache.invalidate(product)
+        self._rendered.pop(product, None)
+        self._state.set(product, (product, price, quantity, active,
+                                  product.promotion))
+
+    def _product_changed(self, product: Product):
+        """Observer registered on every product of the store"""
+        order_changes = getattr(self._order_changes, "products", None)
+        if order_changes is not None:
+            order_changes[product] = None
+            return
+        with self._lock:
+            self._sync_product(product)
+            self._notify_listeners("change", product)
+
+    def _check_totals(self):
+        """Recounts the stock of all products and compares it with the
+        running totals. Used only in debug mode. Raises RuntimeError if
+        they differ."""
+        with self._lock:
+            quantity_by_class = {}
+            for product in self._products:
+                product_class = type(product)
+                quantity_by_class[product_class] = \
+                    quantity_by_class.get(product_class, 0) + product.quantity
+            active_count = sum(1 for product in self._products
+                               if product.is_active())
+
+            if sum(quantity_by_class.values()) != self._total_quantity:
+                raise RuntimeError("total quantity is out of sync")
+            # classes without stock are left out of both sides
+            if {product_class: quantity for product_class, quantity
+                    in quantity_by_class.items() if quantity} != \
+                    {product_class: quantity for product_class, quantity
+                     in self._quantity_by_class.items() if quantity}:
+                raise RuntimeError("quantity by product class is out of sync")
+            if active_count != len(self._active_products):
+                raise RuntimeError("active product count is out of sync")
 
     def get_total_quantity(self) -> int:
         """Returns how many items are in the store in total."""
-        total_quantity = sum(prod.quantity for prod in self._products)
-        return total_quantity
+        if self._debug:
+            self._check_totals()
+        return self._total_quantity
+
+    def get_active_count(self) -> int:
+        """Returns how many products in the store are active."""
+        if self._debug:
+            self._check_totals()
+        return len(self._active_products)
+
+    def get_quantity_by_class(self) -> dict[type, int]:
+        """Returns how many items are in the store for every product class,
+        for example {Product: 850, LimitedProduct: 250}"""
+        if self._debug:
+            self._check_totals()
+        with self._lock:
+            return {product_class: quantity for product_class, quantity
+                    in self._quantity_by_class.items() if quantity}
+
+    def snapshot(self) -> StoreSnapshot:
+        """Returns a read-only view of the products and totals of the store
+        as they are now. Taking it is O(1), and reading it takes no lock,
+        so reports can go over all products while orders are made."""
+        with self._lock:
+            pages, slots, version = self._state.share()
+            return StoreSnapshot(pages, slots, version, self._total_quantity,
+                                 dict(self._quantity_by_class),
+                                 len(self._active_products))
+
+    def get_all_products(self) -> tuple[Product, ...]:
+        """Returns all products in the store that are active. The result is
+        cached until a product is added, removed, activated or deactivated"""
+        if metrics.ENABLED:
+            start = time.perf_counter()
+            active_products = self._get_all_products()
+            metrics.GET_ALL_PRODUCTS_SECONDS.time(start)
+            return active_products
+        return self._get_all_products()
+
+    def _get_all_products(self) -> tuple[Product, ...]:
+        """get_all_products() without the instrumentation"""
+        with self._lock:
+            if self._active_view is None:
+                # in catalog order, so a product deactivated and activated
+                # again keeps its place
+                active_products = self._active_products
+                self._active_view = tuple(product for product in self._products
+                                          if product in active_products)
+            return self._active_view
+
+    def render_products(self, start: int = 0, count: int | None = None,
+                        numbered: bool = False) -> str:
+        """Returns the show() lines of the active products, in the order of
+        get_all_products(), as one string ending with a newline. Only the
+        `count` products from index `start` are rendered, all the rest when
+        count is None. Numbered lines start with the position of the
+        product, counted from 1.
+
+        Lines are cached per product and rebuilt only after its price,
+        quantity, active status or promotion changed."""
+        with self._lock:
+            active_products = self._get_all_products()
+            end = len(active_products) if count is None \
+                else min(start + count, len(active_products))
+            rendered = self._rendered
+            lines = []
+            for product in active_products[start:end]:
+                line = rendered.get(product)
+                if line is None:
+                    line = rendered[product] = product.show()
+                lines.append(line)
 
-    def get_all_products(self) -> list[Product]:
-        """Returns all products in the store that are active"""
-        active_product = [prod for prod in self._products
-                          if prod.is_active()]
-        return active_product
+        if numbered:
+            lines = [f"{index} {line}"
+                     for index, line in enumerate(lines, start=start + 1)]
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def search(self, query: str, limit: int = 10) -> list[Product]:
+        """Returns up to `limit` products whose name matches the query,
+        best match first. Inactive products are included."""
+        with self._lock:
+            return self._search_index.search(query, limit)
+
+    def autocomplete(self, prefix: str, limit: int = 10) -> list[str]:
+        """Returns up to `limit` words of product names that complete the
+        last word of the prefix"""
+        with self._lock:
+            return self._search_index.autocomplete(prefix, limit)
+
+    def get_products_in_price_range(self, low: float, high: float) \
+            -> list[Product]:
+        """Returns the active products with low <= price <= high,
+        cheapest first"""
+        with self._lock:
+            return self._price_index.in_range(low, high)
+
+    def get_cheapest_products(self, count: int) -> list[Product]:
+        """Returns up to `count` active products, cheapest first"""
+        with self._lock:
+            return self._price_index.cheapest(count)
+
+    def get_most_expensive_products(self, count: int) -> list[Product]:
+        """Returns up to `count` active products, most expensive first"""
+        with self._lock:
+            return self._price_index.most_expensive(count)
+
+    def get_products_page(self, page: int, page_size: int,
+                          descending: bool = False) -> list[Product]:
+        """Returns a page of the active products sorted by price.
+        Pages are numbered from 1."""
+        with self._lock:
+            return self._price_index.page(page, page_size, descending)
+
+    def quote(self, shopping_list: list[tuple[Product, int]]) -> float:
+        """Returns the total price the order would cost, without buying
+        anything. Lines are merged by product like in order(), and the
+        price of every line comes from the quote cache when possible."""
+        merged_order = self._merge_order(shopping_list)
+        total_price = 0
+        for order_product, quantity in merged_order.items():
+            total_price += self._quote_cache.get_total_price(order_product,
+                                                             quantity)
+        return total_price
+
+    def get_quote_cache_stats(self) -> dict[str, int]:
+        """Returns the hits, misses, evictions and invalidations of the
+        quote cache"""
+        return self._quote_cache.stats()
+
+    def _check_basket(self, basket: list[tuple[Product | list[Product],
+                                               int]]) -> dict[Product, int]:
+        """Raises ValueError if a product of the basket is not in the
+        store. Returns how many items of the products of the basket are
+        held by reservations, for the ones that have holds."""
+        reservations = self._reservations
+        if reservations:
+            reservations.expire()
+        held = {}
+        for basket_products, _ in basket:
+            if isinstance(basket_products, Product):
+                basket_products = [basket_products]
+            for basket_product in basket_products:
+                if basket_product not in self._products:
+                    raise ValueError(f"Product {basket_product.name} "
+                                     f"is not in the store")
+                if reservations:
+                    held[basket_product] = reservations.held(basket_product)
+        return held
+
+    def plan_cart(self, basket: list[tuple[Product | list[Product], int]]):
+        """Returns the cheapest orders buying the basket, as an
+        optimizer.CartPlan. Every line of the basket is a product, or a
+        list of equivalent products, and how many items of it to buy.
+        Items held by reservations are left alone, like order() does."""
+        # the optimizer is only imported by processes planning carts
+        import optimizer
+
+        with self._lock:
+            return optimizer.plan_cart(basket, self._check_basket(basket))
+
+    def quote_cart(self, basket: list[tuple[Product | list[Product],
+                                            int]]) -> float:
+        """Returns the total price of plan_cart(basket), without listing its
+        orders. It takes milliseconds whatever the quantities."""
+        import optimizer
+
+        with self._lock:
+            return optimizer.quote_cart(basket, self._check_basket(basket))
+
+    @staticmethod
+    def bulk_quote(shopping_list: list[tuple[Product, int]]) -> list[float]:
+        """Returns the price of every line of the shopping list, without
+        buying anything. Lines are grouped by promotion, and every group is
+        priced with one apply_promotion_batch call."""
+        quotes: list[float] = [0] * len(shopping_list)
+        # key: promotion (None for no promotion), value: indexes of lines
+        lines_by_promotion: dict = {}
+        for index, (order_product, _) in enumerate(shopping_list):
+            lines_by_promotion.setdefault(order_product.promotion,
+                                          []).append(index)
+
+        for promotion, indexes in lines_by_promotion.items():
+            quantities = [shopping_list[index][1] for index in indexes]
+            prices = [shopping_list[index][0].price for index in indexes]
+            if promotion:
+                group_quotes = promotion.apply_promotion_batch(quantities,
+                                                               prices)
+            else:
+                group_quotes = [price * quantity for quantity, price
+                                in zip(quantities, prices)]
+            for index, quote in zip(indexes, group_quotes):
+                quotes[index] = quote
+
+        return quotes
+
+    @staticmethod
+    def _merge_order(shopping_list: list[tuple[Product, int]]) \
+            -> dict[Product, int]:
+        """Merges the lines of the shopping list by product.
+        Returns dict with Product as key and total quantity as value."""
+        merged_order: dict[Product, int] = {}
+        for order_product, quantity_to_buy in shopping_list:
+            if quantity_to_buy <= 0:
+                raise ValueError("Quantity to buy must be positive")
+            merged_order[order_product] = \
+                merged_order.get(order_product, 0) + quantity_to_buy
+        return merged_order
+
+    def _validate_order(self, merged_order: dict[Product, int]):
+        """Checks that every product of the merged order can be bought,
+        with the items held by reservations left alone.
+        Raises ValueError otherwise."""
+        reservations = self._reservations
+        if reservations:
+            reservations.expire()
+        for order_product, quantity_to_buy in merged_order.items():
+            if order_product not in self._products:
+                raise ValueError(f"Product {order_product.name} "
+                                 f"is not in the store")
+            if not order_product.is_active():
+                raise ValueError(f"Product {order_product.name} "
+                                 f"is not active")
+            order_product.check_buy(quantity_to_buy,
+                                    reservations.held(order_product))
 
     def order(self, shopping_list: list[tuple[Product, int]]) -> float:
         """Buys the products and returns the total price of the order.
+        The order is all-or-nothing: if any line cannot be bought, ValueError
+        is raised and the stock of no product is changed.
         :param
         shopping_list: list of tuples, where each tuple has 2 items:
         Product (Product class) and quantity (int).
         """
-        store_products = self.get_all_products()
+        return self._timed_order(shopping_list, run_hooks=True)
+
+    def _timed_order(self, shopping_list: list[tuple[Product, int]],
+                     run_hooks: bool) -> float:
+        """order(), leaving the order hooks to the caller unless run_hooks
+        is True"""
+        if not metrics.ENABLED:
+            return self._order(shopping_list, run_hooks)
+
+        start = time.perf_counter()
+        error = None
+        try:
+            return self._order(shopping_list, run_hooks)
+        except ValueError as e:
+            error = e
+            raise
+        finally:
+            outcome = metrics.outcome_of(error)
+            metrics.ORDER_SECONDS.time(start, outcome)
+            metrics.ORDERS.inc(outcome)
+
+    def _order(self, shopping_list: list[tuple[Product, int]],
+               run_hooks: bool) -> float:
+        """_timed_order() without the instrumentation"""
+        merged_order = self._merge_order(shopping_list)
         total_price = 0
 
-        # buying product if it in the store, and it has required quantity
-        for order_product, quantity_to_buy in shopping_list:
-            total_price += order_product.buy(quantity_to_buy)
+        with contextlib.ExitStack() as product_locks:
+            # locks are always taken in the same order, so orders that share
+            # products cannot deadlock, and orders that don't never wait
+            for order_product in sorted(merged_order, key=id):
+                product_locks.enter_context(order_product._lock)
+
+            self._validate_order(merged_order)
 
+            # every line was validated, so none of the buys can fail. The
+            # buys run without the store lock, and the products they change
+            # are synced together once they are done, so a snapshot sees
+            # all the lines of the order or none.
+            changed_products = self._order_changes.products = {}
+            try:
+                for order_product, quantity_to_buy in merged_order.items():
+                    total_price += order_product.buy(quantity_to_buy)
+            finally:
+                self._order_changes.products = None
+                # the store lock is always taken after the product locks
+                with self._lock:
+                    for changed_product in changed_products:
+                        # it may have been removed since it was validated
+                        if changed_product in self._products:
+                            self._sync_product(changed_product)
+                            self._notify_listeners("change", changed_product)
+
+        if run_hooks:
+            self._run_order_hooks()
+        return total_price
+
+    def _run_order_hooks(self):
+        """Calls the order hooks, once the locks of the orders are
+        released"""
+        for hook in self._order_hooks:
+            hook()
+
+    def reserve(self, product: Product, quantity: int, ttl: float) -> int:
+        """Holds items of the product for an order made within `ttl`
+        seconds, and returns the id of the reservation. Held items cannot
+        be bought by other orders. The quantity is checked like an order
+        line, so it must also be within the maximum of a LimitedProduct.
+        Raises ValueError if the items cannot be held."""
+        with product._lock:
+            self._validate_order({product: quantity})
+            return self._reservations.add(product, quantity, ttl)
+
+    def confirm(self, reservation_id: int) -> float:
+        """Buys the items held by the reservation, and returns their total
+        price. Raises ValueError if the reservation expired or the items
+        cannot be bought anymore; the hold is released either way."""
+        product = self._reservations.get_product(reservation_id)
+        # the product stays locked from the release of the hold to the buy,
+        # so no other order can take the items in between. The order hooks
+        # run once it is released, like after any order.
+        with product._lock:
+            product, quantity = self._reservations.pop(reservation_id)
+            total_price = self._timed_order([(product, quantity)],
+                                            run_hooks=False)
+        self._run_order_hooks()
         return total_price
 
+    def release(self, reservation_id: int):
+        """Gives back the items held by the reservation. Raises ValueError
+        if it expired or was already confirmed or released."""
+        self._reservations.pop(reservation_id)
+
+    def get_available_quantity(self, product: Product) -> int | float:
+        """Returns how many items of the product can be ordered, which is
+        its quantity minus the items held by reservations, and math.inf for
+        a NonStockedProduct, which has no limit"""
+        if isinstance(product, NonStockedProduct):
+            return math.inf
+        self._reservations.expire()
+        return max(product.quantity - self._reservations.held(product), 0)
+
+    def order_many(self, shopping_lists: list[list[tuple[Product, int]]],
+                   errors: type | tuple[type, ...] = ValueError) \
+            -> list[float | Exception]:
+        """Makes many orders in one call. Every order is all-or-nothing on its
+        own, and a rejected order does not stop the ones after it.
+        Returns a list with the total price of each order, or the error
+        that rejected it. The order hooks are called once, after the last
+        order, so a journal syncs the whole batch at once.
+        :param errors: errors that are put in the results instead of
+            raised, ValueError by default.
+        """
+        results: list[float | Exception] = []
+        ordered = False
+        try:
+            for shopping_list in shopping_lists:
+                try:
+                    results.append(self._timed_order(shopping_list,
+                                                     run_hooks=False))
+                    ordered = True
+                except errors as e:
+                    results.append(e)
+        finally:
+            if ordered:
+                self._run_order_hooks()
+        return results
@@ -0,0 +1,68 @@
+import catalog
+import products
+import promotions
+import pytest
+import store
+
+
+def test_catalog_round_trip():
+    """rows keep the state of the products they were built from"""
+    third_one_free = promotions.ThirdOneFree("Third One Free!")
+    mac = products.Product("MacBook Air M2", price=1450.0, quantity=100)
+    mac.promotion = third_one_free
+    windows = products.NonStockedProduct("Windows License", price=125.5)
+    windows.promotion = third_one_free
+    shipping = products.LimitedProduct("Shipping", price=9.99, quantity=250,
+                                       maximum=1)
+    shipping.deactivate()
+    product_catalog = catalog.Catalog.from_products([mac, windows, shipping])
+
+    assert len(product_catalog) == 3
+    assert product_catalog.total_quantity() == 350
+    assert product_catalog.active_count() == 2
+    assert product_catalog.promotion(0) is product_catalog.promotion(1)
+
+    for original, copy in zip([mac, windows, shipping],
+                              product_catalog.products()):
+        assert type(copy) is type(original)
+        assert copy.show() == original.show()
+        assert copy.is_active() == original.is_active()
+    assert product_catalog.to_product(2).maximum == 1
+
+
+def test_snapshot_save_load(tmp_path):
+    """a store loaded from a snapshot has the same products"""
+    mac = products.Product("MacBook Air M2", price=1450.0, quantity=100)
+    mac.promotion = promotions.PercentDiscount("30% off!", percent=30)
+    pixel = products.Product("Google Pixel 7", price=500.0, quantity=0)
+    shipping = products.LimitedProduct("Shipping", price=9.99, quantity=250,
+                                       maximum=1)
+    bose = products.Product("Bose QuietComfort Earbuds", price=250,
+                            quantity=500)
+    best_buy = store.Store([mac, pixel, shipping, bose])
+    pixel.deactivate()
+    best_buy.save(tmp_path / "catalog.bin")
+
+    loaded = catalog.Catalog.load(tmp_path / "catalog.bin")
+    assert len(loaded) == 4
+    assert loaded.name(2) == "Shipping"
+    assert loaded.price(3) == 250 and isinstance(loaded.price(3), int)
+    assert isinstance(loaded.price(0), float)
+    assert loaded.product(0) is loaded.product(0)
+    with pytest.raises(ValueError, match="read-only"):
+        loaded.append(mac)
+
+    loaded_store = store.Store.load(tmp_path / "catalog.bin")
+    assert [product.show() for product in loaded_store.get_all_products()] \
+        == [mac.show(), shipping.show(), "Bose QuietComfort Earbuds, "
+                                         "Price: 250, Quantity: 500"]
+    assert loaded_store.get_total_quantity() == 850
+    assert loaded_store.get_product("Shipping").maximum == 1
+
+
+def test_load_rejects_other_files(tmp_path):
+    """loading a file that is not a snapshot raises ValueError"""
+    path = tmp_path / "catalog.bin"
+    path.write_bytes(b"not a snapshot at all, just some text")
+    with pytest.raises(ValueError, match="not a catalog snapshot"):
+        catalog.Catalog.load(path)
@@ -0,0 +1,95 @@
+import asyncio
+
+import events
+import products
+import promotions
+import store
+
+
+def test_event_bus():
+    """changes of the products are published as typed events"""
+    mac = products.Product("MacBook Air M2", price=1450, quantity=10)
+    bose = products.Product("Bose QuietComfort Earbuds", price=250,
+                            quantity=500)
+    best_buy = store.Store([mac, bose])
+    bus = events.EventBus(low_stock_threshold=100)
+    bus.set_low_stock_threshold(mac, 5)
+    bus.attach(best_buy)
+    received, alerts, batches = [], [], []
+    bus.subscribe(received.append)
+    bus.subscribe(alerts.append, (events.LowStock, events.SoldOut))
+
+    best_buy.order([(mac, 4), (bose, 450)])
+    assert received == [events.StockDecremented(mac, 6, 10),
+                        events.StockDecremented(bose, 50, 500),
+                        events.LowStock(bose, 50, 100)]
+
+    bus.subscribe(batches.append, batch=True)
+    with bus.batch():
+        best_buy.order([(mac, 6)])
+        assert batches == []
+        mac.quantity = 20
+        mac.activate()
+        mac.price = 1400
+    assert alerts == [events.LowStock(bose, 50, 100), events.SoldOut(mac)]
+    assert batches == [[events.StockDecremented(mac, 0, 6),
+                        events.SoldOut(mac),
+                        events.StockIncremented(mac, 20, 0),
+                        events.Reactivated(mac),
+                        events.PriceChanged(mac, 1400, 1450)]]
+
+    # a product without stock is deactivated, not sold out
+    windows = products.NonStockedProduct("Windows License", price=125)
+    best_buy.add_product(windows)
+    received.clear()
+    windows.deactivate()
+    windows.activate()
+    assert received == [events.Deactivated(windows),
+                        events.Reactivated(windows)]
+
+
+def test_async_subscription_drops_oldest():
+    """a full async queue drops its oldest events and counts them"""
+    mac = products.Product("MacBook Air M2", price=1450, quantity=100)
+    best_buy = store.Store([mac])
+    bus = events.EventBus()
+    bus.attach(best_buy)
+
+    async def run():
+        subscription = bus.subscribe_async((events.StockDecremented,),
+                                           max_pending=2)
+        for _ in range(3):
+            best_buy.order([(mac, 1)])
+        mac.promotion = promotions.ThirdOneFree("Third One Free!")
+        assert await subscription.get_batch() == \
+            [events.StockDecremented(mac, 98, 99),
+             events.StockDecremented(mac, 97, 98)]
+        assert subscription.dropped == 1
+
+    asyncio.run(run())
+
+
+def test_failing_subscriber_does_not_break_order():
+    """an error of a subscriber or listener is counted, and the order it
+    was raised in is still made in full"""
+    mac = products.Product("MacBook Air M2", price=1450, quantity=10)
+    bose = products.Product("Bose QuietComfort Earbuds", price=250,
+                            quantity=10)
+    best_buy = store.Store([mac, bose])
+    bus = events.EventBus()
+    bus.attach(best_buy)
+    received = []
+
+    def fail(event):
+        raise RuntimeError("subscriber failed")
+
+    failing = bus.subscribe(fail)
+    bus.subscribe(received.append)
+    best_buy.add_listener(lambda event, product: 1 / 0)
+
+    assert best_buy.order([(mac, 1), (bose, 1)]) == 1700
+    assert mac.quantity == bose.quantity == 9
+    assert failing.errors == 2
+    assert best_buy.listener_errors == 2
+    assert received == [events.StockDecremented(mac, 9, 10),
+                        events.StockDecremented(bose, 9, 10)]
@@ -0,0 +1,100 @@
+import journal
+import products
+import store
+
+
+def make_store() -> store.Store:
+    return store.Store([
+        products.Product("MacBook Air M2", price=1450, quantity=100),
+        products.Product("Google Pixel 7", price=500, quantity=250),
+    ])
+
+
+def test_replay_after_crash(tmp_path):
+    """changes recorded in the journal are applied on top of the snapshot"""
+    snapshot_path = str(tmp_path / "store.bin")
+    journal_path = str(tmp_path / "store.journal")
+    best_buy = make_store()
+    best_buy.save(snapshot_path)
+
+    store_journal = journal.Journal(journal_path, snapshot_path,
+                                    group_size=2)
+    store_journal.attach(best_buy)
+    mac = best_buy.get_product("MacBook Air M2")
+    best_buy.order([(mac, 10)])
+    best_buy.remove_product(best_buy.get_product("Google Pixel 7"))
+    best_buy.add_product(products.LimitedProduct("Shipping", price=10,
+                                                 quantity=250, maximum=1))
+    mac.price = 1400
+    store_journal.close()
+
+    recovered = store.Store.load(snapshot_path)
+    journal.Journal(journal_path, snapshot_path).replay(recovered)
+    assert [(product.name, product.price, product.quantity)
+            for product in recovered.get_all_products()] == \
+        [("MacBook Air M2", 1400, 90), ("Shipping", 10, 250)]
+    assert recovered.get_total_quantity() == 340
+
+
+def test_compaction(tmp_path):
+    """compaction saves the snapshot and empties the journal"""
+    snapshot_path = str(tmp_path / "store.bin")
+    journal_path = tmp_path / "store.journal"
+    best_buy = make_store()
+
+    store_journal = journal.Journal(str(journal_path), snapshot_path,
+                                    group_size=1)
+    store_journal.attach(best_buy)
+    best_buy.order([(best_buy.get_product("MacBook Air M2"), 100)])
+    assert journal_path.stat().st_size > 0
+
+    store_journal.compact()
+    store_journal.close()
+    assert journal_path.stat().st_size == 0
+    assert store.Store.load(snapshot_path).get_total_quantity() == 250
+
+    store_journal = journal.Journal(str(journal_path), snapshot_path)
+    store_journal.attach(best_buy)
+    best_buy.order([(best_buy.get_product("Google Pixel 7"), 50)])
+    store_journal.close(compact=True)
+    assert journal_path.stat().st_size == 0
+    assert not (tmp_path / "store.bin.tmp").exists()
+    assert store.Store.load(snapshot_path).get_total_quantity() == 200
+
+
+def test_orders_wait_for_their_records(tmp_path):
+    """an order returns once its record is on disk, and nothing is written
+    by the store listener itself"""
+    snapshot_path = str(tmp_path / "store.bin")
+    journal_path = tmp_path / "store.journal"
+    best_buy = make_store()
+    mac = best_buy.get_product("MacBook Air M2")
+
+    store_journal = journal.Journal(str(journal_path), snapshot_path,
+                                    commit_interval=60)
+    store_journal.attach(best_buy)
+    best_buy.order([(mac, 10)])
+    assert '"quantity": 90' in journal_path.read_text()
+    mac.price = 1400
+    assert "1400" not in journal_path.read_text()
+
+    # a batch of orders is synced once, after its last order
+    waits = []
+    best_buy.add_order_hook(lambda: waits.append(
+        journal_path.read_text().count('"op"')))
+    records = journal_path.read_text().count('"op"')
+    assert best_buy.order_many([[(mac, 1)], [(mac, 1000)], [(mac, 1)]]) \
+        [::2] == [1400, 1400]
+    assert waits == [records + 3]
+    store_journal.close()
+    assert "1400" in journal_path.read_text()
+
+    journal_path.unlink()
+    store_journal = journal.Journal(str(journal_path), snapshot_path,
+                                    commit_interval=60,
+                                    wait_for_commit=False)
+    store_journal.attach(best_buy)
+    best_buy.order([(mac, 10)])
+    assert journal_path.read_text() == ""
+    store_journal.close()
+    assert '"quantity": 78' in journal_path.read_text()
@@ -0,0 +1,38 @@
+import random
+
+import benchmarks
+import loadgen
+import store
+
+
+def test_latency_histogram_percentiles():
+    """percentiles are within the relative error of the buckets"""
+    rng = random.Random(0)
+    values = [int(rng.lognormvariate(10, 2)) for _ in range(10_000)]
+    histogram = loadgen.LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+
+    values.sort()
+    for percent in (50, 90, 99, 99.9):
+        exact = values[int(percent / 100 * len(values)) - 1]
+        assert exact <= histogram.percentile(percent) <= exact * 1.016 + 1
+    assert histogram.percentile(100) == histogram.max == values[-1]
+    assert loadgen.LatencyHistogram().percentile(99) == 0
+
+
+def test_run_load_with_sampling_profiler():
+    """orders are made at the target rate and the samples show the order
+    path"""
+    catalog_products = benchmarks.make_mixed_catalog(100, quantity=10)
+    best_buy = store.Store(catalog_products)
+    carts = benchmarks.make_carts(catalog_products, 2_000, 3)
+
+    with loadgen.SamplingProfiler(interval=0.0005) as profiler:
+        histogram, outcomes, elapsed = loadgen.run_load(best_buy, carts,
+                                                        rate=20_000)
+    assert histogram.count == sum(outcomes.values()) == 2_000
+    assert outcomes["success"] and outcomes["rejected"]
+    assert elapsed >= 0.09
+    assert any("store.py:Store.order" in line
+               for line in profiler.folded().splitlines())
@@ -0,0 +1,29 @@
+import io
+
+import main
+import products
+import store
+
+
+def test_ingest_orders():
+    """bulk orders are applied per order and errors are reported per line"""
+    mac = products.Product("MacBook Air M2", price=1450, quantity=100)
+    shipping = products.LimitedProduct("Shipping", price=10, quantity=250,
+                                       maximum=1)
+    best_buy = store.Store([mac, shipping])
+    orders_file = io.StringIO("order_id,product,quantity\n"
+                              "1,MacBook Air M2,2\n"
+                              "1,2,1\n"
+                              "2,Shipping,2\n"
+                              "3,MacBook Air M2,-1\n")
+    output, errors_output = io.StringIO(), io.StringIO()
+
+    rejected = main.ingest_orders(orders_file, "csv", best_buy,
+                                  batch_size=2, output=output,
+                                  errors_output=errors_output)
+    assert rejected == 2
+    assert output.getvalue() == "order 1: 2910\n"
+    assert "order 2: line 4: Product Shipping can be purchased 1 times" \
+        in errors_output.getvalue()
+    assert "order 3: line 5: Wrong amount" in errors_output.getvalue()
+    assert best_buy.get_total_quantity() == 347
@@ -0,0 +1,80 @@
+import pytest
+
+import optimizer
+import products
+import promotions
+import store
+
+
+def test_plan_cart():
+    """plans split lines to get the most of promotions and limits"""
+    bose = products.Product("Bose QuietComfort Earbuds", price=250,
+                            quantity=500)
+    bose.promotion = promotions.ThirdOneFree("Third One Free!")
+    shipping = products.LimitedProduct("Shipping", price=10, quantity=250,
+                                       maximum=1)
+    best_buy = store.Store([bose, shipping])
+
+    plan = best_buy.plan_cart([(bose, 7), (shipping, 3)])
+    assert plan.total_price == 5 * 250 + 3 * 10
+    assert plan.orders == [[(bose, 6), (shipping, 1)],
+                           [(bose, 1), (shipping, 1)],
+                           [(shipping, 1)]]
+    assert best_buy.quote_cart([(bose, 7), (shipping, 3)]) == \
+        plan.total_price
+    assert sum(best_buy.order(order) for order in plan.orders) == \
+        plan.total_price
+
+    with pytest.raises(ValueError):
+        best_buy.plan_cart([(shipping, 248)])
+
+
+def test_plan_cart_with_equivalent_products():
+    """the basket is spread over equivalent products by price and stock"""
+    capped = products.Product("Pixel 7", price=500, quantity=3)
+    capped.promotion = promotions.CappedPromotion(
+        "Up to 2", promotions.SecondHalfPrice("Second Half price!"), 2)
+    discounted = products.Product("Pixel 7 Refurbished", price=420,
+                                  quantity=1_000_000)
+    discounted.promotion = promotions.PercentDiscount("10% off!", percent=10)
+
+    plan = optimizer.plan_cart([([capped, discounted], 5)])
+    assert plan.orders == [[(capped, 2), (discounted, 3)]]
+    assert plan.total_price == 750 + 3 * 378
+    assert optimizer.quote_cart([([capped, discounted], 10**6)]) == \
+        pytest.approx(750 + (10**6 - 2) * 378)
+
+
+def test_plan_cart_ignores_rounding_cents():
+    """lines are not split into many orders to gain a rounded cent"""
+    cable = products.Product("USB Cable", price=0.07, quantity=10_000)
+    cable.promotion = promotions.PercentDiscount("10% off!", percent=10)
+    charger = products.Product("Charger", price=1.14, quantity=100)
+    charger.promotion = cable.promotion
+
+    plan = optimizer.plan_cart([(cable, 1000), (charger, 20)])
+    assert plan.orders == [[(cable, 1000), (charger, 20)]]
+    assert plan.total_price == 63 + 20.52
+    assert optimizer.quote_cart([(cable, 1000), (charger, 20)]) == \
+        plan.total_price
+
+
+def test_plan_cart_tries_lines_past_the_searched_ones():
+    """a plan never costs more than one order, and stays fast when the
+    promotion gives no small split size"""
+    thirty_percent = promotions.PercentDiscount("30% off!", percent=30)
+    from_20 = promotions.ConditionalPromotion("30% off from 20",
+                                              thirty_percent, 20)
+    mac = products.Product("MacBook Air M2", price=100, quantity=100)
+    mac.promotion = from_20
+    assert from_20.split_size() == 39
+
+    plan = optimizer.plan_cart([(mac, 20)])
+    assert plan.orders == [[(mac, 20)]]
+    assert plan.total_price == 1400
+    assert optimizer.quote_cart([(mac, 45)]) == 3150
+
+    capped = products.Product("Pixel 7", price=100, quantity=10_000)
+    capped.promotion = promotions.CappedPromotion("Up to 300", from_20, 300)
+    assert optimizer.quote_cart([(capped, 10)]) == 1000
+    assert optimizer.quote_cart([(capped, 300)]) == 21000
@@ -0,0 +1,138 @@
+import catalog
+import products
+import promotions
+import pytest
+import quote_cache
+import store
+
+
+def test_batch_matches_scalar_pricing():
+    """apply_promotion_batch returns exactly what apply_promotion does"""
+    quantities = list(range(0, 50)) * 3
+    prices = [0.1, 19.99, 1450, 33.33, 0.07, 125.5] * 25
+    for promotion in (promotions.SecondHalfPrice("Second Half price!"),
+                      promotions.ThirdOneFree("Third One Free!"),
+                      promotions.PercentDiscount("30% off!", percent=30),
+                      promotions.PercentDiscount("15% off!", percent=15)):
+        expected = [promotion.apply_promotion(quantity, price)
+                    for quantity, price in zip(quantities, prices)]
+        assert promotion.apply_promotion_batch(quantities, prices) == expected
+
+
+def test_bulk_quote():
+    """bulk_quote prices every line like buy, without changing stock"""
+    mac = products.Product("MacBook Air M2", price=1450, quantity=100)
+    bose = products.Product("Bose QuietComfort Earbuds", price=250,
+                            quantity=500)
+    pixel = products.Product("Google Pixel 7", price=500, quantity=250)
+    mac.promotion = promotions.SecondHalfPrice("Second Half price!")
+    bose.promotion = promotions.ThirdOneFree("Third One Free!")
+    shopping_list = [(mac, 3), (bose, 4), (pixel, 2), (mac, 1)]
+
+    quotes = store.Store([mac, bose, pixel]).bulk_quote(shopping_list)
+    assert quotes == [3625.0, 750, 1000, 1450]
+    assert mac.quantity == 100
+
+
+def test_quote_uses_cache():
+    """quotes are cached until the price or promotion changes"""
+    mac = products.Product("MacBook Air M2", price=1450, quantity=100)
+    mac.promotion = promotions.SecondHalfPrice("Second Half price!")
+    best_buy = store.Store([mac])
+
+    assert best_buy.quote([(mac, 2), (mac, 1)]) == 3625.0
+    assert best_buy.quote([(mac, 3)]) == 3625.0
+    mac.buy(1)
+    assert best_buy.quote([(mac, 3)]) == 3625.0
+    assert mac.quantity == 99
+    assert best_buy.get_quote_cache_stats()["hits"] == 2
+    assert best_buy.get_quote_cache_stats()["size"] == 1
+
+    mac.promotion = promotions.PercentDiscount("30% off!", percent=30)
+    assert best_buy.get_quote_cache_stats()["size"] == 0
+    assert best_buy.quote([(mac, 3)]) == 3045.0
+    mac.price = 1000
+    assert best_buy.quote([(mac, 3)]) == 2100.0
+    assert best_buy.get_quote_cache_stats()["invalidations"] == 2
+
+
+def test_quote_cache_eviction():
+    """the least recently used quote is evicted when the cache is full"""
+    mac = products.Product("MacBook Air M2", price=1450, quantity=100)
+    cache = quote_cache.QuoteCache(max_size=2)
+    for quantity in (1, 2, 1, 3):
+        cache.get_total_price(mac, quantity)
+
+    assert cache.stats() == {"hits": 1, "misses": 3, "evictions": 1,
+                             "invalidations": 0, "size": 2}
+    cache.get_total_price(mac, 1)
+    assert cache.stats()["hits"] == 2
+
+
+def test_composite_promotions():
+    """stacked, best-of, capped and conditional promotions"""
+    third_one_free = promotions.ThirdOneFree("Third One Free!")
+    thirty_percent = promotions.PercentDiscount("30% off!", percent=30)
+    second_half_price = promotions.SecondHalfPrice("Second Half price!")
+
+    stacked = promotions.ChainedPromotion(
+        "Third free, then 30% off", [third_one_free, thirty_percent])
+    assert stacked.apply_promotion(3, 10) == 14.0
+    assert stacked.apply_promotion(0, 10) == 0
+    single = promotions.ChainedPromotion("Only", [second_half_price])
+    assert single.apply_promotion(3, 0.1) == \
+        second_half_price.apply_promotion(3, 0.1)
+
+    best = promotions.BestOfPromotion("Best deal",
+                                      [third_one_free, thirty_percent])
+    assert best.apply_promotion(2, 10) == 14.0
+    assert best.apply_promotion(3, 10) == 20.0
+
+    capped = promotions.CappedPromotion("Up to 2", second_half_price,
+                                        max_quantity=2)
+    assert capped.apply_promotion(5, 10) == 45.0
+    conditional = promotions.ConditionalPromotion("3 or more", thirty_percent,
+                                                  min_quantity=3)
+    assert conditional.apply_promotion_batch([2, 3], [10, 10]) == [20, 21.0]
+
+
+def test_composite_promotion_config():
+    """composite promotions survive a round trip through their config"""
+    promotion = promotions.BestOfPromotion("Best deal", [
+        promotions.CappedPromotion(
+            "Up to 2", promotions.SecondHalfPrice("Second Half price!"), 2),
+        promotions.ChainedPromotion("Stacked", [
+            promotions.ThirdOneFree("Third One Free!"),
+            promotions.PercentDiscount("30% off!", percent=30)]),
+    ])
+    config = promotion.to_config()
+    copy = catalog.promotion_from_config(config)
+    assert copy.to_config() == config
+    assert [copy.apply_promotion(quantity, 9.99) for quantity in range(10)] \
+        == [promotion.apply_promotion(quantity, 9.99)
+            for quantity in range(10)]
+
+
+def test_promotion_registry(monkeypatch):
+    """promotions are built once per config, and classes load on first
+    use"""
+    # the promotions registered and built here don't outlive the test
+    monkeypatch.setattr(promotions, "_PROMOTION_TYPES",
+                        dict(promotions._PROMOTION_TYPES))
+    monkeypatch.setattr(promotions, "_PROMOTION_CACHE",
+                        dict(promotions._PROMOTION_CACHE))
+    config = {"type": "PercentDiscount", "name": "30% off!", "percent": 30}
+    promotion = promotions.create_promotion(config)
+    assert promotion.apply_promotion(2, 10) == 14
+    assert promotions.create_promotion(dict(config)) is promotion
+    assert promotions.create_promotion(
+        {"type": "CappedPromotion", "name": "Up to 2", "max_quantity": 2,
+         "promotion": config})._promotion is promotion
+
+    promotions.register_promotion("LazyDiscount",
+                                  "promotions:PercentDiscount")
+    lazy = promotions.create_promotion(dict(config, type="LazyDiscount"))
+    assert isinstance(lazy, promotions.PercentDiscount)
+    assert lazy is not promotion
+    with pytest.raises(ValueError):
+        promotions.create_promotion({"type": "Unknown", "name": "?"})
@@ -0,0 +1,98 @@
+import random
+
+import products
+import pytest
+import reservations
+import store
+from timer_wheel import TimerWheel
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_timer_wheel_expires_in_order():
+    """timers expire on the tick of their deadline, across all levels"""
+    wheel = TimerWheel(tick=1, wheel_size=4, levels=2)
+    deadlines = random.Random(0).sample(range(1, 100), 40)
+    handles = {deadline: wheel.schedule(deadline, deadline)
+               for deadline in deadlines}
+    assert wheel.cancel(handles[deadlines[0]])
+    assert not wheel.cancel(handles[deadlines[0]])
+
+    expired = []
+    for now in range(1, 101):
+        for deadline in wheel.advance(now):
+            assert deadline == now
+            expired.append(deadline)
+    assert expired == sorted(deadlines[1:])
+    assert len(wheel) == 0
+
+
+def test_reservations():
+    """held items cannot be ordered until they are released or expire"""
+    clock = FakeClock()
+    pixel = products.Product("Google Pixel 7", price=500, quantity=10)
+    shipping = products.LimitedProduct("Shipping", price=10, quantity=250,
+                                       maximum=1)
+    best_buy = store.Store([pixel, shipping],
+                           reservations=reservations.Reservations(
+                               clock=clock))
+
+    first = best_buy.reserve(pixel, 6, ttl=60)
+    second = best_buy.reserve(pixel, 3, ttl=10)
+    assert best_buy.get_available_quantity(pixel) == 1
+    with pytest.raises(products.OutOfStockError):
+        best_buy.order([(pixel, 2)])
+    with pytest.raises(products.OutOfStockError):
+        best_buy.reserve(pixel, 2, ttl=60)
+    with pytest.raises(products.LimitExceededError):
+        best_buy.reserve(shipping, 2, ttl=60)
+
+    clock.now = 10.5
+    assert best_buy.get_available_quantity(pixel) == 4
+    with pytest.raises(ValueError):
+        best_buy.confirm(second)
+    # order hooks run once the product is unlocked
+    locked = []
+    best_buy.add_order_hook(lambda: locked.append(pixel._lock._is_owned()))
+    assert best_buy.confirm(first) == 3000
+    assert locked == [False]
+    assert pixel.quantity == 4
+
+    third = best_buy.reserve(pixel, 4, ttl=60)
+    best_buy.release(third)
+    with pytest.raises(ValueError):
+        best_buy.release(third)
+    assert best_buy.order([(pixel, 4)]) == 2000
+    assert not pixel.is_active()
+
+
+def test_holds_in_availability_plans_and_removal():
+    """cart plans leave held items alone, holds go with their product and
+    a non-stocked product has no limit"""
+    clock = FakeClock()
+    pixel = products.Product("Google Pixel 7", price=500, quantity=10)
+    windows = products.NonStockedProduct("Windows License", price=125)
+    best_buy = store.Store([pixel, windows],
+                           reservations=reservations.Reservations(
+                               clock=clock))
+
+    best_buy.reserve(windows, 1000, ttl=60)
+    assert best_buy.get_available_quantity(windows) == float("inf")
+
+    best_buy.reserve(pixel, 8, ttl=60)
+    assert best_buy.quote_cart([(pixel, 2)]) == 1000
+    with pytest.raises(ValueError):
+        best_buy.plan_cart([(pixel, 3)])
+    with pytest.raises(ValueError):
+        best_buy.quote_cart([(pixel, 3)])
+
+    best_buy.remove_product(pixel)
+    best_buy.add_product(pixel)
+    assert best_buy.get_available_quantity(pixel) == 10
+    assert best_buy.order([(pixel, 10)]) == 5000
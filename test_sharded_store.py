@@ -0,0 +1,90 @@
+import products
+import pytest
+import sharded_store
+
+
+def test_sharded_store():
+    """orders across shards are all-or-nothing and reads gather shards"""
+    catalog_products = [products.Product(f"Product {index}", price=10,
+                                         quantity=5)
+                        for index in range(20)]
+    catalog_products.append(products.LimitedProduct("Shipping", price=1,
+                                                    quantity=100, maximum=1))
+    with sharded_store.ShardedStore(catalog_products,
+                                    shard_count=3) as best_buy:
+        assert best_buy.get_total_quantity() == 200
+        assert best_buy.order([("Product 0", 2), ("Product 7", 1),
+                               (catalog_products[-1], 1)]) == 31
+
+        with pytest.raises(ValueError, match="can be purchased 1 times"):
+            best_buy.order([("Product 1", 5), ("Product 2", 5),
+                            ("Shipping", 2)])
+        assert best_buy.get_total_quantity() == 196
+
+        results = best_buy.order_many([[("Product 3", 5)],
+                                       [("Product 3", 1)],
+                                       [("Product 4", 1), ("Product 5", 1)]])
+        assert results[0] == 50
+        assert isinstance(results[1], ValueError)
+        assert results[2] == 20
+        assert len(best_buy.get_all_products()) == 20
+
+
+def test_sharded_store_survives_failures():
+    """an error in a shard rolls the order back and leaves the shards
+    running"""
+    catalog_products = [products.Product(f"Product {index}", price=10,
+                                         quantity=5)
+                        for index in range(20)]
+    with sharded_store.ShardedStore(catalog_products,
+                                    shard_count=2) as best_buy:
+        with pytest.raises(RuntimeError, match="TypeError"):
+            best_buy.order([("Product 0", "2")])
+
+        names = [f"Product {index}" for index in range(20)]
+        first = names[0]
+        other = next(name for name in names
+                     if best_buy.shard_of(name) != best_buy.shard_of(first))
+        with pytest.raises(RuntimeError, match="TypeError"):
+            best_buy.order([(first, 2), (other, "1")])
+        assert best_buy.get_total_quantity() == 100
+
+        results = best_buy.order_many([[(first, 1)], [(first, None)],
+                                       [(first, 1)]])
+        assert results[0] == results[2] == 10
+        assert isinstance(results[1], RuntimeError)
+        assert best_buy.get_total_quantity() == 98
+
+        # a shard that stopped fails its orders, and the other shard is
+        # rolled back
+        best_buy._processes[best_buy.shard_of(other)].kill()
+        with pytest.raises(RuntimeError, match="not running"):
+            best_buy.order([(first, 1), (other, 1)])
+        assert best_buy.order([(first, 1)]) == 10
+
+
+def test_sharded_store_two_phase_commit():
+    """prepared orders only hold their stock, and order_many keeps the
+    order of the orders"""
+    catalog_products = [products.Product(f"Product {index}", price=10,
+                                         quantity=5)
+                        for index in range(20)]
+    with sharded_store.ShardedStore(catalog_products,
+                                    shard_count=2) as best_buy:
+        first = "Product 0"
+        other = next(product.name for product in catalog_products
+                     if best_buy.shard_of(product.name) !=
+                     best_buy.shard_of(first))
+
+        shard = best_buy.shard_of(first)
+        assert best_buy._request_all(
+            {shard: ("prepare", -1, [(first, 5)])}) == {shard: ("ok", None)}
+        assert best_buy.get_total_quantity() == 100
+        assert isinstance(best_buy.order_many([[(first, 1)]])[0], ValueError)
+        best_buy._request_all({shard: ("abort", -1)})
+
+        results = best_buy.order_many([[(first, 5), (other, 1)],
+                                       [(first, 1)]])
+        assert results[0] == 60
+        assert isinstance(results[1], ValueError)
+        assert best_buy.get_total_quantity() == 94
@@ -0,0 +1,90 @@
+import threading
+
+import products
+import promotions
+import snapshots
+import store
+
+
+def test_snapshot_is_isolated_from_later_changes():
+    """a snapshot keeps the state the store had when it was taken"""
+    mac = products.Product("MacBook Air M2", price=1450, quantity=100)
+    bose = products.Product("Bose QuietComfort Earbuds", price=250,
+                            quantity=500)
+    windows = products.NonStockedProduct("Windows License", price=125)
+    best_buy = store.Store([mac, bose, windows])
+
+    snapshot = best_buy.snapshot()
+    best_buy.order([(mac, 100), (bose, 10)])
+    bose.price = 200
+    bose.promotion = promotions.ThirdOneFree("Third One Free!")
+    best_buy.remove_product(windows)
+    pixel = products.Product("Google Pixel 7", price=500, quantity=250)
+    best_buy.add_product(pixel)
+
+    assert list(snapshot) == [
+        (mac, 1450, 100, True, None), (bose, 250, 500, True, None),
+        (windows, 125, 0, True, None)]
+    assert snapshot.get(windows).price == 125
+    assert snapshot.get(pixel) is None
+    assert snapshot.get_total_quantity() == 600
+    assert snapshot.get_active_count() == 3
+
+    later = best_buy.snapshot()
+    assert later.version > snapshot.version
+    assert [state.product for state in later.get_all_products()] == \
+        [bose, pixel]
+    assert later.get(bose).quantity == 490
+    assert later.get(mac) == (mac, 1450, 0, False, None)
+    assert later.get_total_quantity() == 740
+
+
+def test_snapshots_stay_consistent_while_orders_run():
+    """the totals of every snapshot match its products, across pages"""
+    catalog_products = [products.Product(f"Product {index}", price=10,
+                                         quantity=10**9)
+                        for index in range(snapshots.PAGE_SIZE * 3)]
+    best_buy = store.Store(catalog_products)
+    stop = threading.Event()
+
+    def make_orders():
+        while not stop.is_set():
+            for product in catalog_products[::97]:
+                best_buy.order([(product, 1)])
+
+    writer = threading.Thread(target=make_orders)
+    writer.start()
+    try:
+        for _ in range(50):
+            snapshot = best_buy.snapshot()
+            assert sum(state.quantity for state in snapshot) == \
+                snapshot.get_total_quantity()
+    finally:
+        stop.set()
+        writer.join()
+
+
+def test_snapshots_see_orders_whole():
+    """an order buying several products is never seen half made"""
+    first = products.Product("First", price=10, quantity=10**9)
+    catalog_products = [products.Product(f"Product {index}", price=10,
+                                         quantity=10**9)
+                        for index in range(snapshots.PAGE_SIZE)]
+    last = products.Product("Last", price=10, quantity=10**9)
+    best_buy = store.Store([first, *catalog_products, last])
+    stop = threading.Event()
+
+    def make_orders():
+        while not stop.is_set():
+            best_buy.order([(first, 1), (last, 1)])
+
+    writer = threading.Thread(target=make_orders)
+    writer.start()
+    try:
+        for _ in range(200):
+            snapshot = best_buy.snapshot()
+            assert snapshot.get(first).quantity == \
+                snapshot.get(last).quantity
+    finally:
+        stop.set()
+        writer.join()
@@ -0,0 +1,320 @@
+import asyncio
+import threading
+
+import async_store
+import metrics
+import pytest
+import products
+import promotions
+import store
+
+
+def test_add_remove_product():
+    """adding and removing products updates membership and name lookup"""
+    mac = products.Product("MacBook Air M2", price=1450, quantity=100)
+    bose = products.Product("Bose QuietComfort Earbuds", price=250,
+                            quantity=500)
+    best_buy = store.Store([mac])
+
+    best_buy.add_product(bose)
+    best_buy.add_product(bose)
+    assert len(best_buy) == 2
+    assert best_buy.get_product("Bose QuietComfort Earbuds") is bose
+
+    best_buy.remove_product(mac)
+    best_buy.remove_product(mac)
+    assert mac not in best_buy
+    assert best_buy.get_product("MacBook Air M2") is None
+    assert best_buy.get_all_products() == (bose,)
+
+    with pytest.raises(ValueError, match="already in the store"):
+        best_buy.add_product(products.Product("Bose QuietComfort Earbuds",
+                                              price=200, quantity=1))
+    assert best_buy.get_product("Bose QuietComfort Earbuds") is bose
+
+
+def test_add_products():
+    """products added together are indexed like ones added one by one"""
+    mac = products.Product("MacBook Air M2", price=1450, quantity=100)
+    bose = products.Product("Bose QuietComfort Earbuds", price=250,
+                            quantity=500)
+    pixel = products.Product("Google Pixel 7", price=500, quantity=250)
+    pixel_buds = products.Product("Google Pixel Buds", price=250, quantity=5)
+    pixel_buds.deactivate()
+    best_buy = store.Store([mac])
+
+    with pytest.raises(ValueError, match="already in the store"):
+        best_buy.add_products([bose, products.Product("Bose QuietComfort "
+                                                      "Earbuds", price=1,
+                                                      quantity=1)])
+    assert len(best_buy) == 1
+
+    best_buy.add_products([bose, pixel, pixel_buds, mac, bose])
+    assert best_buy.get_all_products() == (mac, bose, pixel)
+    assert best_buy.get_cheapest_products(10) == [bose, pixel, mac]
+    assert best_buy.search("google pixel") == [pixel, pixel_buds]
+    assert best_buy.autocomplete("b") == ["bose", "buds"]
+
+    pixel_buds.activate()
+    assert best_buy.get_products_in_price_range(250, 250) == \
+        [bose, pixel_buds]
+
+
+def test_all_products_follow_active_status():
+    """deactivated products disappear from get_all_products"""
+    mac = products.Product("MacBook Air M2", price=1450, quantity=100)
+    pixel = products.Product("Google Pixel 7", price=500, quantity=1)
+    best_buy = store.Store([mac, pixel])
+    assert best_buy.get_all_products() == (mac, pixel)
+
+    pixel.buy(1)
+    assert best_buy.get_all_products() == (mac,)
+
+    mac.deactivate()
+    pixel.activate()
+    assert best_buy.get_all_products() == (pixel,)
+
+    mac.activate()
+    assert best_buy.get_all_products() == (mac, pixel)
+
+
+def test_running_totals():
+    """stock totals follow buys, quantity changes and removals"""
+    mac = products.Product("MacBook Air M2", price=1450, quantity=100)
+    shipping = products.LimitedProduct("Shipping", price=10, quantity=250,
+                                       maximum=1)
+    windows = products.NonStockedProduct("Windows License", price=125)
+    best_buy = store.Store([mac, shipping, windows], debug=True)
+    assert best_buy.get_total_quantity() == 350
+    assert best_buy.get_active_count() == 3
+
+    mac.buy(40)
+    shipping.buy(1)
+    windows.buy(5)
+    assert best_buy.get_total_quantity() == 309
+    assert best_buy.get_quantity_by_class() == {
+        products.Product: 60, products.LimitedProduct: 249}
+
+    mac.quantity = 0
+    best_buy.remove_product(shipping)
+    assert best_buy.get_total_quantity() == 0
+    assert best_buy.get_active_count() == 1
+    assert best_buy.get_quantity_by_class() == {}
+
+    # stock moved to a class the store has no products of
+    best_buy._quantity_by_class[products.LimitedProduct] = 5
+    best_buy._quantity_by_class[products.Product] = -5
+    with pytest.raises(RuntimeError, match="by product class"):
+        best_buy.get_total_quantity()
+
+
+def test_order_is_all_or_nothing():
+    """a failing line leaves the stock of the other lines untouched"""
+    mac = products.Product("MacBook Air M2", price=1450, quantity=100)
+    shipping = products.LimitedProduct("Shipping", price=10, quantity=250,
+                                       maximum=1)
+    best_buy = store.Store([mac, shipping])
+
+    with pytest.raises(ValueError, match="can be purchased 1 times"):
+        best_buy.order([(mac, 10), (shipping, 1), (shipping, 1)])
+    with pytest.raises(ValueError, match="Quantity larger than what exists"):
+        best_buy.order([(mac, 60), (mac, 60)])
+    assert mac.quantity == 100
+    assert shipping.quantity == 250
+
+    assert best_buy.order([(mac, 2), (shipping, 1)]) == 2910
+
+
+def test_order_many():
+    """rejected orders are reported without stopping the batch"""
+    mac = products.Product("MacBook Air M2", price=1450, quantity=3)
+    best_buy = store.Store([mac])
+
+    results = best_buy.order_many([[(mac, 2)], [(mac, 2)], [(mac, 1)]])
+    assert results[0] == 2900
+    assert isinstance(results[1], ValueError)
+    assert results[2] == 1450
+    assert not mac.is_active()
+
+
+def test_concurrent_orders_do_not_oversell():
+    """orders from many threads never sell more than what exists"""
+    mac = products.Product("MacBook Air M2", price=1450, quantity=100)
+    bose = products.Product("Bose QuietComfort Earbuds", price=250,
+                            quantity=500)
+    best_buy = store.Store([mac, bose])
+    results = []
+
+    def worker():
+        results.extend(best_buy.order_many([[(bose, 1), (mac, 1)]] * 20))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    successful = [result for result in results
+                  if not isinstance(result, ValueError)]
+    assert len(successful) == 100
+    assert mac.quantity == 0
+    assert bose.quantity == 400
+    assert best_buy.get_total_quantity() == 400
+
+
+def test_buys_run_without_the_store_lock():
+    """orders only take the store lock to sync the products they changed,
+    so orders of other products don't wait for their pricing"""
+    mac = products.Product("MacBook Air M2", price=1450, quantity=100)
+    best_buy = store.Store([mac])
+    store_locked = []
+
+    class WatchingPromotion(promotions.PercentDiscount):
+        __slots__ = ()
+
+        def apply_promotion(self, quantity, price):
+            store_locked.append(best_buy._lock._is_owned())
+            return super().apply_promotion(quantity, price)
+
+    mac.promotion = WatchingPromotion("10% off!", percent=10)
+    assert best_buy.order([(mac, 2)]) == 2610
+    assert store_locked == [False]
+    assert best_buy.get_total_quantity() == 98
+    assert best_buy.snapshot().get(mac).quantity == 98
+
+
+def test_async_store_batches_orders():
+    """concurrent async orders are applied and rejected ones raise"""
+    mac = products.Product("MacBook Air M2", price=1450, quantity=3)
+    best_buy = store.Store([mac])
+
+    async def place_orders():
+        async with async_store.AsyncStore(best_buy) as async_best_buy:
+            return await asyncio.gather(
+                *(async_best_buy.order([(mac, 1)]) for _ in range(4)),
+                return_exceptions=True)
+
+    results = asyncio.run(place_orders())
+    assert results[:3] == [1450, 1450, 1450]
+    assert isinstance(results[3], ValueError)
+    assert not mac.is_active()
+
+
+def test_async_store_survives_failing_batch():
+    """an error other than ValueError fails its order, not its batch or the
+    worker"""
+    mac = products.Product("MacBook Air M2", price=1450, quantity=3)
+    best_buy = store.Store([mac])
+
+    async def place_orders():
+        async with async_store.AsyncStore(best_buy) as async_best_buy:
+            results = await asyncio.gather(
+                async_best_buy.order([(mac, 1)]),
+                async_best_buy.order([("bogus", 1)]),
+                async_best_buy.order([(mac, 1)]), return_exceptions=True)
+            return results + [await async_best_buy.order([(mac, 1)])]
+
+    results = asyncio.run(asyncio.wait_for(place_orders(), timeout=10))
+    assert results[0] == results[2] == results[3] == 1450
+    assert isinstance(results[1], AttributeError)
+    assert mac.quantity == 0
+
+
+def test_price_index():
+    """price queries follow price changes and active status"""
+    mac = products.Product("MacBook Air M2", price=1450, quantity=100)
+    bose = products.Product("Bose QuietComfort Earbuds", price=250,
+                            quantity=500)
+    pixel = products.Product("Google Pixel 7", price=500, quantity=250)
+    windows = products.NonStockedProduct("Windows License", price=125)
+    best_buy = store.Store([mac, bose, pixel, windows])
+
+    assert best_buy.get_products_in_price_range(200, 600) == [bose, pixel]
+    assert best_buy.get_cheapest_products(2) == [windows, bose]
+    assert best_buy.get_most_expensive_products(2) == [mac, pixel]
+    assert best_buy.get_products_page(2, 3) == [mac]
+    assert best_buy.get_products_page(1, 3, descending=True) == \
+        [mac, pixel, bose]
+
+    mac.price = 300
+    pixel.deactivate()
+    best_buy.remove_product(windows)
+    assert best_buy.get_products_in_price_range(200, 600) == [bose, mac]
+    assert best_buy.get_cheapest_products(10) == [bose, mac]
+    assert best_buy.get_most_expensive_products(0) == []
+
+
+def test_search():
+    """search ranks products by matched words and follows the catalog"""
+    mac = products.Product("MacBook Air M2", price=1450, quantity=100)
+    bose = products.Product("Bose QuietComfort Earbuds", price=250,
+                            quantity=500)
+    pixel = products.Product("Google Pixel 7", price=500, quantity=250)
+    pixel_buds = products.Product("Google Pixel Buds", price=100, quantity=5)
+    best_buy = store.Store([mac, bose, pixel, pixel_buds])
+
+    assert best_buy.search("google pixel") == [pixel, pixel_buds]
+    assert best_buy.search("pixel bu") == [pixel_buds, pixel]
+    assert best_buy.search("mac") == [mac]
+    assert best_buy.search("iphone") == []
+    assert best_buy.autocomplete("google pix") == ["pixel"]
+    assert best_buy.autocomplete("b") == ["bose", "buds"]
+
+    best_buy.remove_product(pixel_buds)
+    assert best_buy.search("buds") == []
+    assert best_buy.autocomplete("b") == ["bose"]
+
+
+def test_render_products():
+    """the cached listing follows every change of the products"""
+    mac = products.Product("MacBook Air M2", price=1450, quantity=100)
+    bose = products.Product("Bose QuietComfort Earbuds", price=250,
+                            quantity=500)
+    pixel = products.LimitedProduct("Google Pixel 7", price=500, quantity=250,
+                                    maximum=1)
+    best_buy = store.Store([mac, bose, pixel])
+
+    assert best_buy.render_products() == \
+        "".join(product.show() + "\n" for product in (mac, bose, pixel))
+    assert best_buy.render_products(1, 1, numbered=True) == \
+        f"2 {bose.show()}\n"
+
+    best_buy.order([(mac, 10)])
+    bose.promotion = promotions.SecondHalfPrice("Second Half price!")
+    pixel.price = 450
+    assert best_buy.render_products() == \
+        "".join(product.show() + "\n" for product in (mac, bose, pixel))
+    assert "Quantity: 90" in best_buy.render_products(0, 1)
+
+    bose.deactivate()
+    assert best_buy.render_products(1, numbered=True) == \
+        f"2 {pixel.show()}\n"
+    assert best_buy.render_products(5) == ""
+
+
+def test_metrics():
+    """orders are counted by outcome while metrics are enabled"""
+    mac = products.Product("MacBook Air M2", price=1450, quantity=2)
+    mac.promotion = promotions.SecondHalfPrice("Second Half price!")
+    shipping = products.LimitedProduct("Shipping", price=10, quantity=250,
+                                       maximum=1)
+    best_buy = store.Store([mac, shipping])
+    best_buy.order([(mac, 1)])
+
+    metrics.enable()
+    try:
+        best_buy.order_many([[(mac, 5)], [(shipping, 2)]])
+        best_buy.order([(mac, 1), (shipping, 1)])
+        best_buy.get_all_products()
+    finally:
+        metrics.disable()
+    best_buy.order([(shipping, 1)])
+
+    assert metrics.ORDERS.get("success") >= 1
+    assert metrics.ORDERS.get("out_of_stock") >= 1
+    assert metrics.ORDERS.get("limit_exceeded") >= 1
+    assert metrics.PROMOTION_SECONDS.get_count("Second Half price!") >= 1
+    exported = metrics.REGISTRY.to_prometheus()
+    assert 'store_orders_total{outcome="out_of_stock"}' in exported
+    assert 'store_order_seconds_bucket{outcome="success",le="+Inf"}' \
+        in exported
@@ -0,0 +1,114 @@
+import itertools
+import math
+
+
+class TimerWheel:
+    """
+    Hierarchical timer wheel: schedules values to expire at a deadline.
+
+    Time is counted in ticks of `tick` seconds. Level 0 has one slot per
+    tick for the next `wheel_size` ticks, level 1 one slot per
+    `wheel_size` ticks, and so on. A timer goes in the slot of the lowest
+    level whose range reaches its deadline. When time reaches the range
+    of a slot of a higher level, its timers move down a level, so a timer
+    is moved at most `levels` times. Scheduling, cancelling and expiring
+    a timer are O(1), whatever the number of timers, and no timer is ever
+    scanned before it is due. Deadlines past the last level wait in an
+    overflow bucket, moved down once per turn of the last level.
+
+    Deadlines are rounded up to a tick, so values expire at most one tick
+    late, and never early.
+    """
+    def __init__(self, tick: float = 0.01, wheel_size: int = 256,
+                 levels: int = 4, start: float = 0.0):
+        if tick <= 0:
+            raise ValueError("tick must be positive")
+        if wheel_size < 2 or levels < 1:
+            raise ValueError("wheel size must be at least 2 and levels at "
+                             "least 1")
+        self._tick = tick
+        self._wheel_size = wheel_size
+        self._current_tick = math.floor(start / tick)
+        # key: timer handle, value: (expiry tick, value)
+        self._wheels: list[list[dict]] = \
+            [[{} for _ in range(wheel_size)] for _ in range(levels)]
+        self._overflow: dict = {}
+        # key: timer handle, value: the slot holding it
+        self._slot_by_handle: dict[int, dict] = {}
+        self._handles = itertools.count()
+
+    def __len__(self):
+        return len(self._slot_by_handle)
+
+    def schedule(self, deadline: float, value) -> int:
+        """Schedules the value to expire at the deadline, in seconds of the
+        same clock as `start`. Returns a handle to cancel it."""
+        handle = next(self._handles)
+        expiry_tick = max(math.ceil(deadline / self._tick),
+                          self._current_tick + 1)
+        self._place(handle, expiry_tick, value)
+        return handle
+
+    def _place(self, handle: int, expiry_tick: int, value):
+        """Puts the timer in the slot of the lowest level reaching it"""
+        delta = expiry_tick - self._current_tick
+        span = 1
+        for wheel in self._wheels:
+            if delta < span * self._wheel_size:
+                slot = wheel[expiry_tick // span % self._wheel_size]
+                break
+            span *= self._wheel_size
+        else:
+            slot = self._overflow
+        slot[handle] = (expiry_tick, value)
+        self._slot_by_handle[handle] = slot
+
+    def cancel(self, handle: int) -> bool:
+        """Cancels the timer. Returns False if it already expired or was
+        cancelled."""
+        slot = self._slot_by_handle.pop(handle, None)
+        if slot is None:
+            return False
+        del slot[handle]
+        return True
+
+    def advance(self, now: float) -> list:
+        """Moves the wheel to the time `now`, and returns the values whose
+        deadline passed, in the order they expired"""
+        target_tick = math.floor(now / self._tick)
+        expired = []
+        while self._current_tick < target_tick:
+            if not self._slot_by_handle:
+                self._current_tick = target_tick
+                break
+            self._current_tick += 1
+            self._cascade()
+            slot = self._wheels[0][self._current_tick % self._wheel_size]
+            for handle, (_, value) in slot.items():
+                del self._slot_by_handle[handle]
+                expired.append(value)
+            slot.clear()
+        return expired
+
+    def _cascade(self):
+        """Moves the timers of the higher level slots starting at the
+        current tick down a level, highest level first, so they are placed
+        before the lower levels are cascaded in turn"""
+        levels = []
+        span = 1
+        for level in range(1, len(self._wheels) + 1):
+            span *= self._wheel_size
+            if self._current_tick % span:
+                break
+            levels.append((level, span))
+
+        for level, span in reversed(levels):
+            if level == len(self._wheels):
+                slot = self._overflow
+            else:
+                slot = self._wheels[level][self._current_tick // span %
+                                           self._wheel_size]
+            timers = list(slot.items())
+            slot.clear()
+            for handle, (expiry_tick, value) in timers:
+                self._place(handle, expiry_tick, value)